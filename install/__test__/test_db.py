@@ -0,0 +1,101 @@
+import unittest
+import helioviewer.db as db
+
+class FakeCursor:
+    """Cursor which answers `filename IN (...)` queries from in-memory tables"""
+    def __init__(self, tables):
+        self.tables = tables
+        self.queries = []
+        self._result = []
+
+    def execute(self, sql, params=None):
+        self.queries.append((sql, params))
+        table = sql.split("FROM ")[1].split(" ")[0]
+        self._result = [(f,) for f in params if f in self.tables[table]]
+
+    def fetchall(self):
+        return self._result
+
+class TestDb(unittest.TestCase):
+    def test_get_known_filenames(self):
+        cursor = FakeCursor({"data": {"a.jp2", "b.jp2"}, "corrupt": {"c.jp2"}})
+        known = db.get_known_filenames(cursor, ["a.jp2", "b.jp2", "c.jp2", "d.jp2"])
+        self.assertEqual({"a.jp2", "b.jp2", "c.jp2"}, known)
+        # Files found in data are not checked against corrupt
+        self.assertEqual(["c.jp2", "d.jp2"], cursor.queries[1][1])
+
+    def test_get_known_filenames_chunks_queries(self):
+        cursor = FakeCursor({"data": set(), "corrupt": set()})
+        filenames = ["%d.jp2" % i for i in range(25)]
+        known = db.get_known_filenames(cursor, filenames, chunk_size=10)
+        self.assertEqual(set(), known)
+        # 3 chunks, each checked against data and corrupt
+        self.assertEqual(6, len(cursor.queries))
+        self.assertEqual(filenames[20:], cursor.queries[-1][1])
+
+    def test_get_known_filenames_empty(self):
+        cursor = FakeCursor({"data": set(), "corrupt": set()})
+        self.assertEqual(set(), db.get_known_filenames(cursor, []))
+        self.assertEqual(0, len(cursor.queries))
+
+class DatasourceCursor:
+    """Cursor which answers the datasources query"""
+    def __init__(self, rows):
+        self.rows = rows
+        self.reads = 0
+
+    def execute(self, sql, params=None):
+        self.reads += 1
+
+    def fetchall(self):
+        return self.rows
+
+class TestDatasourceResolver(unittest.TestCase):
+    ROWS = [(13, 1, "SDO", "AIA", "304", None, None),
+            (4, 0, "SOHO", "LASCO", "C2", "white-light", None)]
+
+    def test_lookup(self):
+        cursor = DatasourceCursor(self.ROWS)
+        resolver = db.DatasourceResolver()
+        source = resolver.lookup(cursor, ("SDO", "AIA", "304"))
+        self.assertEqual(13, source.id)
+        self.assertTrue(source.enabled)
+        self.assertEqual(db.getImageGroup(13), source.groups)
+        self.assertFalse(resolver.lookup(cursor, ("SOHO", "LASCO", "C2", "white-light")).enabled)
+        self.assertEqual(1, cursor.reads)
+
+    def test_unknown_key_refreshes_once(self):
+        cursor = DatasourceCursor(self.ROWS)
+        resolver = db.DatasourceResolver()
+        for i in range(3):
+            with self.assertRaises(KeyError):
+                resolver.lookup(cursor, ("SDO", "AIA", "1600"))
+        self.assertEqual(1, cursor.reads)
+
+        # A datasource added to the table is found on the next refresh
+        cursor.rows = self.ROWS + [(14, 1, "SDO", "AIA", "1600", None, None)]
+        with self.assertRaises(KeyError):
+            resolver.lookup(cursor, ("SDO", "AIA", "1700"))
+        self.assertEqual(14, resolver.lookup(cursor, ("SDO", "AIA", "1600")).id)
+
+    def test_ttl(self):
+        cursor = DatasourceCursor(self.ROWS)
+        resolver = db.DatasourceResolver(ttl=0)
+        resolver.lookup(cursor, ("SDO", "AIA", "304"))
+        resolver.lookup(cursor, ("SDO", "AIA", "304"))
+        self.assertEqual(2, cursor.reads)
+
+    def test_is_known_prefix(self):
+        resolver = db.DatasourceResolver()
+        cursor = DatasourceCursor(self.ROWS)
+        self.assertTrue(resolver.is_known_prefix(cursor, ("SOHO", "LASCO")))
+        self.assertFalse(resolver.is_known_prefix(cursor, ("SOHO", "EIT")))
+
+    def test_get_datasources_tree(self):
+        tree = db.get_datasources(DatasourceCursor(self.ROWS))
+        self.assertEqual({"id": 13, "enabled": True}, tree["SDO"]["AIA"]["304"])
+        self.assertEqual({"id": 4, "enabled": False}, tree["SOHO"]["LASCO"]["C2"]["white-light"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,30 @@
+import unittest
+from unittest.mock import patch
+from helioviewer.hvpull.servers.hv import HvDataServer
+
+TREE = {
+    "https://helioviewer.org/jp2/2024/01/02": ["AIA", "EIT"],
+    "https://helioviewer.org/jp2/2024/01/02/AIA": ["171", "304"],
+    "https://helioviewer.org/jp2/2024/01/01": ["AIA"],
+    "https://helioviewer.org/jp2/2024/01/01/AIA": ["171"],
+}
+
+class TestHvDataServer(unittest.TestCase):
+    @patch.object(HvDataServer, "_get_subdirectories", side_effect=lambda url: TREE.get(url, []))
+    def test_enumerate_subdirectories(self, get_subdirectories):
+        server = HvDataServer()
+        dirs = server._enumerate_subdirectories(["https://helioviewer.org/jp2/2024/01/02",
+                                                 "https://helioviewer.org/jp2/2024/01/01"])
+        # Leaf directories are returned depth first
+        self.assertEqual([
+            "https://helioviewer.org/jp2/2024/01/02/AIA/171",
+            "https://helioviewer.org/jp2/2024/01/02/AIA/304",
+            "https://helioviewer.org/jp2/2024/01/02/EIT",
+            "https://helioviewer.org/jp2/2024/01/01/AIA/171",
+        ], dirs)
+        # Each directory is only queried once
+        self.assertEqual(8, get_subdirectories.call_count)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,11 @@
+import os
+import time
+import tempfile
+import threading
 import unittest
+from unittest.mock import patch
 import helioviewer.jp2 as jp2
+from helioviewer.db import DatasourceResolver
 
 class TestJp2(unittest.TestCase):
     EMPTY_GROUP = {
@@ -63,5 +69,180 @@ class TestJp2(unittest.TestCase):
         self.assertEqual({"groupOne": 10001, "groupTwo": 0, "groupThree": 0}, result)
 
 
+class FakeInsertCursor:
+    """Cursor which rejects any batch containing a file named bad*.jp2"""
+    def __init__(self):
+        self.batches = []
+        self.rows = []
+
+    def executemany(self, sql, rows):
+        self.batches.append(len(rows))
+        if any(row[1].startswith("bad") for row in rows):
+            raise ValueError("bad row")
+        self.rows += rows
+
+class FakeDb:
+    def __init__(self):
+        self.commits = 0
+
+    def commit(self):
+        self.commits += 1
+
+class FakeDatasourceCursor:
+    """Cursor which returns datasource rows and records other queries"""
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+
+    def execute(self, sql, params=None):
+        self.queries.append(sql)
+
+    def fetchall(self):
+        return self.rows
+
+class TestInsertImages(unittest.TestCase):
+    def setUp(self):
+        # Repeated keys (AIA -> AIA) are collapsed when finding the source
+        self.resolver = DatasourceResolver()
+        self.resolver.refresh(FakeDatasourceCursor([(13, 1, "SDO", "AIA", "304", None, None)]))
+
+    def _image(self, filename):
+        img = {"observatory": "SDO", "instrument": "AIA", "detector": "AIA", "measurement": "304",
+               "filepath": "/archive/AIA/2024/04/16/304/" + filename, "date": "2024-04-16T11:15:41.129",
+               "scale": 0.6, "width": 4096, "height": 4096, "refPixelX": 2048.5, "refPixelY": 2048.5,
+               "layeringOrder": 1}
+        for key in ["DSUN_OBS", "SOLAR_R", "RADIUS", "CDELT1", "CDELT2", "CRVAL1", "CRVAL2",
+                    "CRPIX1", "CRPIX2", "XCEN", "YCEN", "CROTA1"]:
+            img[key] = 'NULL'
+        img["DSUN_OBS"] = 150159030000.0
+        return img
+
+    def test_insert_images(self):
+        cursor = FakeInsertCursor()
+        cursor_v2 = FakeInsertCursor()
+        db_v2 = FakeDb()
+        v2_writer = jp2.V2Writer(db_v2, cursor_v2)
+        images = [self._image("%d.jp2" % i) for i in range(5)]
+        failed = jp2.insert_images(images, self.resolver, "/archive", FakeDb(), cursor, True,
+                                   v2_writer=v2_writer, batch_size=2)
+        v2_writer.close()
+        self.assertEqual([], failed)
+        self.assertEqual([2, 2, 1], cursor.batches)
+        self.assertEqual(5, len(cursor.rows))
+        self.assertEqual(5, len(cursor_v2.rows))
+        # v2 rows are committed on the v2 connection
+        self.assertEqual(3, db_v2.commits)
+
+        row = cursor.rows[0]
+        self.assertEqual(25, len(row))
+        self.assertEqual(("/AIA/2024/04/16/304", "0.jp2", "2024-04-16T11:15:41.129", 13, 0.6, 4096), row[:6])
+        # Values are passed as parameters, with missing values as NULL
+        self.assertEqual(150159030000.0, row[10])
+        self.assertIsNone(row[11])
+        self.assertEqual(jp2.__DATA_INSERT_QUERY__.count("%s"), len(row))
+
+    def test_bad_row_only_costs_that_row(self):
+        cursor = FakeInsertCursor()
+        images = [self._image("%d.jp2" % i) for i in range(8)]
+        images[5] = self._image("bad.jp2")
+        failed = jp2.insert_images(images, self.resolver, "/archive", FakeDb(), cursor, True)
+        self.assertEqual([images[5]], failed)
+        self.assertEqual(7, len(cursor.rows))
+        self.assertNotIn("bad.jp2", [row[1] for row in cursor.rows])
+
+    def test_connection_errors_are_not_bisected(self):
+        class OperationalError(Exception):
+            pass
+
+        class LostConnectionCursor(FakeInsertCursor):
+            def executemany(self, sql, rows):
+                self.batches.append(len(rows))
+                raise OperationalError("Lost connection to MySQL server during query")
+
+        cursor = LostConnectionCursor()
+        images = [self._image("%d.jp2" % i) for i in range(8)]
+        with self.assertRaises(OperationalError):
+            jp2.insert_images(images, self.resolver, "/archive", FakeDb(), cursor, True)
+        self.assertEqual([8], cursor.batches)
+
+    def test_disabled_source_is_enabled_once(self):
+        resolver = DatasourceResolver()
+        resolver.refresh(FakeDatasourceCursor([(13, 0, "SDO", "AIA", "304", None, None)]))
+        cursor = FakeInsertCursor()
+        cursor.execute = lambda sql: cursor.rows.append(sql)
+        images = [self._image("%d.jp2" % i) for i in range(4)]
+        jp2.insert_images(images, resolver, "/archive", FakeDb(), cursor, True)
+        updates = [row for row in cursor.rows if isinstance(row, str)]
+        self.assertEqual(["UPDATE datasources SET enabled=1 WHERE id=13;"], updates)
+
+    def test_spooled_v2_writer(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            spool = os.path.join(tmp, "v2.spool")
+            cursor_v2 = FakeInsertCursor()
+            db_v2 = FakeDb()
+            available = threading.Event()
+            def connect():
+                # The v2 database is down until the test says otherwise
+                if not available.is_set():
+                    raise ConnectionError("v2 is down")
+                return db_v2, cursor_v2
+
+            v2_writer = jp2.SpooledV2Writer(spool, connect, retry_interval=0.01)
+            images = [self._image("%d.jp2" % i) for i in range(3)]
+            jp2.insert_images(images, self.resolver, "/archive", FakeDb(), FakeInsertCursor(), True,
+                              v2_writer=v2_writer)
+            time.sleep(0.05)
+            self.assertEqual([], cursor_v2.rows)
+            with open(spool) as f:
+                self.assertEqual(3, len(f.readlines()))
+
+            available.set()
+            for i in range(100):
+                if len(cursor_v2.rows) == 3:
+                    break
+                time.sleep(0.01)
+            v2_writer.close()
+
+            self.assertEqual([("/AIA/2024/04/16/304", "%d.jp2" % i, "2024-04-16T11:15:41.129", 13)
+                              for i in range(3)], cursor_v2.rows)
+            with open(spool) as f:
+                self.assertEqual("", f.read())
+
+
+    def test_spooled_v2_writer_resumes_after_restart(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            spool = os.path.join(tmp, "v2.spool")
+            cursor_v2 = FakeInsertCursor()
+            executemany = cursor_v2.executemany
+            def fail_after_first_chunk(sql, rows):
+                # The v2 database goes down after the first chunk
+                if cursor_v2.rows:
+                    raise ConnectionError("v2 is down")
+                executemany(sql, rows)
+            cursor_v2.executemany = fail_after_first_chunk
+
+            with patch.object(jp2, "__SPOOL_REPLAY_ROWS__", 2):
+                v2_writer = jp2.SpooledV2Writer(spool, lambda: (FakeDb(), cursor_v2), retry_interval=0.01)
+                v2_writer.submit([("/AIA", "%d.jp2" % i, "2024-04-16T11:15:41.129", 13) for i in range(3)])
+                for i in range(100):
+                    if os.path.exists(spool + ".offset"):
+                        break
+                    time.sleep(0.01)
+                v2_writer.close()
+            self.assertEqual(["0.jp2", "1.jp2"], [row[1] for row in cursor_v2.rows])
+
+            # Only the row which wasn't inserted is replayed after a restart
+            cursor_v2 = FakeInsertCursor()
+            v2_writer = jp2.SpooledV2Writer(spool, lambda: (FakeDb(), cursor_v2), retry_interval=0.01)
+            for i in range(100):
+                if cursor_v2.rows:
+                    break
+                time.sleep(0.01)
+            v2_writer.close()
+            self.assertEqual(["2.jp2"], [row[1] for row in cursor_v2.rows])
+            with open(spool) as f:
+                self.assertEqual("", f.read())
+            self.assertFalse(os.path.exists(spool + ".offset"))
+
 if __name__ == '__main__':
     unittest.main()
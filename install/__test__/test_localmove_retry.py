@@ -13,7 +13,7 @@ class TestLocalFileMoveRetry(unittest.TestCase):
         self.queue = Queue()
         self.mover = LocalFileMove("/tmp/incoming", self.queue)
 
-    @patch('shutil.move')
+    @patch('helioviewer.archive.ArchiveWriter.move')
     @patch('os.path.exists', return_value=True)
     def test_successful_move_does_not_retry(self, mock_exists, mock_move):
         """A successful move should not add anything to the queue"""
@@ -22,7 +22,7 @@ class TestLocalFileMoveRetry(unittest.TestCase):
         mock_move.assert_called_once()
         self.assertTrue(self.queue.empty())
 
-    @patch('shutil.move', side_effect=IOError("File busy"))
+    @patch('helioviewer.archive.ArchiveWriter.move', side_effect=IOError("File busy"))
     @patch('os.path.exists', return_value=True)
     def test_failed_move_retries_up_to_max(self, mock_exists, mock_move):
         """A failing move should retry MAX_RETRY_ATTEMPTS times then give up"""
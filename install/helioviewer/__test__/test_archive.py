@@ -0,0 +1,92 @@
+import os
+import errno
+import pytest
+from unittest.mock import patch
+from helioviewer.archive import ArchiveWriter
+
+def _write(path, data=b"jp2"):
+    with open(path, "wb") as f:
+        f.write(data)
+
+def test_move_creates_directories(tmp_path):
+    src = tmp_path / "incoming.jp2"
+    _write(src)
+    dest = tmp_path / "archive" / "AIA" / "2024" / "04" / "16" / "171" / "file.jp2"
+
+    archive = ArchiveWriter(group=None)
+    assert archive.move(str(src), str(dest)) == str(dest)
+    assert dest.read_bytes() == b"jp2"
+    assert not src.exists()
+
+def test_known_directories_are_not_checked_again(tmp_path):
+    archive = ArchiveWriter(group=None)
+    directory = str(tmp_path / "AIA" / "171")
+    archive.makedirs(directory)
+    with patch("os.path.isdir") as isdir, patch("os.mkdir") as mkdir:
+        archive.makedirs(directory)
+    isdir.assert_not_called()
+    mkdir.assert_not_called()
+
+def test_removed_directory_is_created_again(tmp_path):
+    archive = ArchiveWriter(group=None)
+    directory = tmp_path / "AIA"
+    archive.makedirs(str(directory))
+    directory.rmdir()
+
+    src = tmp_path / "file.jp2"
+    _write(src)
+    archive.move(str(src), str(directory / "file.jp2"))
+    assert (directory / "file.jp2").exists()
+
+def test_move_across_filesystems(tmp_path):
+    src = tmp_path / "incoming.jp2"
+    data = os.urandom(100000)
+    _write(src, data)
+    dest = tmp_path / "archive" / "file.jp2"
+
+    rename = os.rename
+    def cross_device(a, b):
+        # Only the final rename of the copied file is on one filesystem
+        if a == str(src):
+            raise OSError(errno.EXDEV, "Invalid cross-device link")
+        rename(a, b)
+
+    archive = ArchiveWriter(group=None)
+    with patch("os.rename", side_effect=cross_device):
+        archive.move(str(src), str(dest))
+    assert dest.read_bytes() == data
+    assert not src.exists()
+    assert not (tmp_path / "archive" / "file.jp2.part").exists()
+
+def test_short_copy_keeps_source(tmp_path):
+    src = tmp_path / "incoming.jp2"
+    _write(src, b"x" * 1000)
+    dest = tmp_path / "archive" / "file.jp2"
+
+    archive = ArchiveWriter(group=None)
+    with patch("os.rename", side_effect=OSError(errno.EXDEV, "Invalid cross-device link")), \
+         patch("os.copy_file_range", return_value=0, create=True):
+        with pytest.raises(OSError):
+            archive.move(str(src), str(dest))
+    assert src.read_bytes() == b"x" * 1000
+    assert not dest.exists()
+    assert not (tmp_path / "archive" / "file.jp2.part").exists()
+
+def test_fsync_batch(tmp_path):
+    archive = ArchiveWriter(group=None, fsync_batch=2)
+    with patch("os.fsync") as fsync:
+        for i in range(3):
+            src = tmp_path / ("%d.jp2" % i)
+            _write(src)
+            archive.move(str(src), str(tmp_path / "archive" / src.name))
+        # Two files and their directory
+        assert fsync.call_count == 3
+        archive.flush()
+        assert fsync.call_count == 5
+
+def test_group_is_resolved_once(tmp_path):
+    archive = ArchiveWriter(group="helioviewer")
+    with patch("grp.getgrnam") as getgrnam, patch("os.chown"):
+        getgrnam.return_value.gr_gid = 1234
+        archive.makedirs(str(tmp_path / "a" / "b" / "c"))
+    assert getgrnam.call_count == 1
@@ -0,0 +1,68 @@
+import os
+import struct
+import pytest
+from helioviewer.jp2codestream import read_codestream_info, needs_transcode
+DIR = os.path.dirname(__file__)
+
+def _info(filename):
+    return read_codestream_info(os.path.join(DIR, "__tdata__", filename))
+
+def test_aia_codestream():
+    info = _info("2024_04_16__11_15_41_129__SDO_AIA_AIA_304.jp2")
+    assert (info.width, info.height) == (4096, 4096)
+    assert info.tiles == 1
+    assert info.progression == "RPCL"
+    assert info.layers == 8
+    assert info.levels == 8
+    assert info.precincts == [(128, 128)] * 9
+    assert info.plt
+    assert not needs_transcode(info, [128, 128])
+
+def test_default_precincts():
+    info = _info("2024_04_16__13_00_13_908__SOHO_EIT_EIT_171.jp2")
+    assert info.precincts == [(32768, 32768)] * 9
+    assert info.plt
+    assert not needs_transcode(info)
+    # AIA's precincts would have to be applied
+    assert needs_transcode(info, [128, 128])
+
+def test_missing_plt_needs_transcode():
+    info = _info("2012_07_05__03_25_52_200__RHESSI_RHESSI_Back_Projection_25-50keV.jp2")
+    assert info.progression == "RPCL"
+    assert not info.plt
+    assert needs_transcode(info)
+
+def test_wrong_progression_needs_transcode():
+    info = _info("2024_04_16__11_15_41_129__SDO_AIA_AIA_304.jp2")._replace(progression="LRCP")
+    assert needs_transcode(info, [128, 128])
+
+def _codestream(size, tile_size):
+    """Returns a minimal RPCL codestream with a PLT marker"""
+    siz = struct.pack('>HIIIIIIIIH', 0, size, size, 0, 0, tile_size, tile_size, 0, 0, 1) + b"\x07\x01\x01"
+    cod = struct.pack('>BBHBBBBBB', 0, 2, 1, 0, 0, 4, 4, 0, 0)
+    sot = struct.pack('>HIBB', 0, 0, 0, 1)
+    plt = b"\x00\x00"
+    return (b"\xff\x4f"
+            + b"\xff\x51" + struct.pack('>H', len(siz) + 2) + siz
+            + b"\xff\x52" + struct.pack('>H', len(cod) + 2) + cod
+            + b"\xff\x90" + struct.pack('>H', len(sot) + 2) + sot
+            + b"\xff\x58" + struct.pack('>H', len(plt) + 2) + plt
+            + b"\xff\x93")
+
+def test_tiled_file_needs_transcode(tmp_path):
+    path = tmp_path / "tiled.j2k"
+    path.write_bytes(_codestream(4096, 1024))
+    info = read_codestream_info(str(path))
+    assert info.tiles == 16
+    assert info.progression == "RPCL"
+    assert info.plt
+    assert needs_transcode(info)
+
+    path.write_bytes(_codestream(4096, 4096))
+    assert not needs_transcode(read_codestream_info(str(path)))
+
+def test_not_a_jpeg2000_file(tmp_path):
+    path = tmp_path / "bad.jp2"
+    path.write_bytes(b"\x00\x00\x00\x0cjP  \r\n\x87\n")
+    with pytest.raises(ValueError):
+        read_codestream_info(str(path))
@@ -32,3 +32,100 @@ def test_get_dsun():
         assert dsun == known_answers[jp2file], "Failed on file %s" % os.path.basename(jp2file)
 
 
+
+def test_create_image_data_batch():
+    """
+    Tests that headers parsed across several processes match those parsed
+    one at a time, and that a bad file doesn't abort the batch
+    """
+    from helioviewer.jp2 import create_image_data, create_image_data_batch
+    files = [os.path.join(DIR, "__tdata__", f) for f in sorted(os.listdir(os.path.join(DIR, "__tdata__"))) if f.endswith(".jp2")]
+    bad_file = os.path.join(DIR, "__tdata__", "README.md")
+
+    images, failures = create_image_data_batch(files + [bad_file], workers=2, chunksize=2)
+
+    assert [f for f, error in failures] == [bad_file]
+    assert [img["filepath"] for img in images] == files
+    for image in images:
+        expected = create_image_data(image["filepath"])
+        assert image["storage_path"] == expected["storage_path"]
+        assert image["date"] == expected["date"]
+        assert dict(image["header"]) == dict(expected["header"])
+
+def test_create_image_data_batch_reuses_pool():
+    """
+    A pool created once can be shared by several batches and is left
+    running for the caller to shut down
+    """
+    from helioviewer.jp2 import create_image_data_batch, create_parse_pool
+    files = [os.path.join(DIR, "__tdata__", f) for f in sorted(os.listdir(os.path.join(DIR, "__tdata__"))) if f.endswith(".jp2")]
+
+    pool = create_parse_pool(2)
+    try:
+        for i in range(2):
+            images, failures = create_image_data_batch(files, chunksize=2, executor=pool)
+            assert failures == []
+            assert [img["filepath"] for img in images] == files
+    finally:
+        pool.shutdown()
+
+def test_fast_xml_box_reader_matches_glymur():
+    """
+    The lightweight XML box reader must produce exactly the same header as
+    reading the XML box through glymur and sunpy's xml_to_dict
+    """
+    from helioviewer.jp2box import read_header_xml
+    files = [os.path.join(DIR, "__tdata__", f) for f in sorted(os.listdir(os.path.join(DIR, "__tdata__"))) if f.endswith(".jp2")]
+    assert len(files) > 0
+    for jp2file in files:
+        parser = JP2parser(jp2file)
+        fits, helioviewer = read_header_xml(jp2file)
+        expected_fits, expected_helioviewer = parser._read_header_xml_with_glymur()
+        assert fits == expected_fits, "Failed on file %s" % os.path.basename(jp2file)
+        assert list(fits.keys()) == list(expected_fits.keys())
+        assert helioviewer == expected_helioviewer, "Failed on file %s" % os.path.basename(jp2file)
+
+def test_fast_metadata_matches_sunpy():
+    """
+    Image data derived straight from the header must match the data read
+    through a sunpy map for every sample image
+    """
+    from helioviewer.jp2meta import HeaderMetadata
+    files = [os.path.join(DIR, "__tdata__", f) for f in sorted(os.listdir(os.path.join(DIR, "__tdata__"))) if f.endswith(".jp2")]
+    assert len(files) > 0
+    for jp2file in files:
+        fast_parser = JP2parser(jp2file, fast_metadata=True)
+        assert isinstance(fast_parser.getImageMap(), HeaderMetadata), "Not resolved from header: %s" % os.path.basename(jp2file)
+
+        fast = fast_parser.getData()
+        expected = JP2parser(jp2file).getData()
+        assert fast.keys() == expected.keys()
+        for key in expected:
+            if key == "header":
+                assert dict(fast[key]) == dict(expected[key]), "Failed on file %s" % os.path.basename(jp2file)
+            elif key == "date":
+                assert fast[key] == expected[key], "Failed on file %s" % os.path.basename(jp2file)
+                assert fast[key].scale == expected[key].scale
+                assert fast[key].isot == expected[key].isot
+            else:
+                assert fast[key] == expected[key], "Failed on key %s of file %s" % (key, os.path.basename(jp2file))
+
+def test_fast_metadata_falls_back_to_sunpy():
+    """
+    Headers which aren't in the rule table are left to sunpy
+    """
+    from helioviewer.jp2meta import resolve_metadata
+    header = JP2parser(os.path.join(DIR, "__tdata__", "2024_04_16__11_15_41_129__SDO_AIA_AIA_304.jp2")).get_header()[0]
+    assert resolve_metadata(header) is not None
+
+    # AIA header without a WAVEUNIT needs sunpy to find the unit
+    no_waveunit = dict(header)
+    del no_waveunit["WAVEUNIT"]
+    assert resolve_metadata(no_waveunit) is None
+
+    # CUNITs which would need patching up
+    bad_cunit = dict(header, CUNIT1="degrees", CUNIT2="degrees")
+    assert resolve_metadata(bad_cunit) is None
+
+    unknown = dict(header, INSTRUME="XRT", TELESCOP="HINODE")
+    assert resolve_metadata(unknown) is None
@@ -1,4 +1,6 @@
 import os
+import time
+import pytest
 import helioviewer.jp2 as jp2
 
 def test_transcode():
@@ -13,3 +15,44 @@ def test_transcode():
     assert transcoded == "/tmp/jp2/2021_06_01__00_01_21_347__SDO_AIA_AIA_171.jp2.tmp.jp2"
     assert os.path.exists(transcoded)
     os.remove(transcoded)
+
+def _write_fake_transcoder(path, body):
+    """Writes a script which accepts the same -i/-o arguments as kdu_transcode"""
+    with open(path, "w") as fp:
+        fp.write("#!/bin/sh\n" + body + "\n")
+    os.chmod(path, 0o755)
+    return str(path)
+
+def test_transcode_batch(tmp_path):
+    transcoder = _write_fake_transcoder(tmp_path / "transcoder", 'sleep 0.5; cp "$2" "$4"')
+    files = []
+    for i in range(4):
+        files.append(str(tmp_path / ("%d.jp2" % i)))
+        with open(files[-1], "w") as fp:
+            fp.write(str(i))
+
+    t1 = time.time()
+    transcoded = jp2.transcode_batch(transcoder, [(f, None) for f in files], workers=4)
+    t2 = time.time()
+
+    assert transcoded == [f + ".tmp.jp2" for f in files]
+    assert all(os.path.exists(f) for f in transcoded)
+    # All four files are transcoded at the same time
+    assert t2 - t1 < 1.5
+
+def test_transcode_batch_raises_on_failure(tmp_path):
+    transcoder = _write_fake_transcoder(tmp_path / "transcoder", 'exit 1')
+    infile = str(tmp_path / "bad.jp2")
+    with pytest.raises(jp2.KduTranscodeError):
+        jp2.transcode_batch(transcoder, [(infile, None), (infile, [128, 128])], workers=1)
+
+def test_transcode_batch_removes_output_on_failure(tmp_path):
+    transcoder = _write_fake_transcoder(tmp_path / "transcoder", 'case "$2" in *bad*) exit 1;; esac; cp "$2" "$4"')
+    files = []
+    for name in ["good.jp2", "bad.jp2"]:
+        files.append(str(tmp_path / name))
+        with open(files[-1], "w") as fp:
+            fp.write(name)
+    with pytest.raises(jp2.KduTranscodeError):
+        jp2.transcode_batch(transcoder, [(f, None) for f in files], workers=2)
+    assert not any(os.path.exists(f + ".tmp.jp2") for f in files)
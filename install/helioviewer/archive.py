@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""Helioviewer.org image archive file operations"""
+import os
+import grp
+import stat
+import errno
+import shutil
+import logging
+import threading
+
+# Group which is given write access to the image archive
+ARCHIVE_GROUP = 'helioviewer'
+
+# Permissions of directories created in the archive
+DIRECTORY_PERMISSIONS = stat.S_IRWXU | stat.S_IRWXG | stat.S_IROTH | stat.S_IXOTH
+
+# Bytes copied per system call when moving across filesystems
+COPY_BLOCK_SIZE = 2**30
+
+
+class ArchiveWriter:
+    """Moves files into the image archive.
+
+    Directories are created with group write access for the helioviewer
+    group. Directories which are known to exist are remembered, so moving a
+    file into one costs no system calls beyond the move itself. Files are
+    renamed into place when source and destination share a filesystem, and
+    otherwise copied in the kernel with copy_file_range or sendfile.
+
+    With fsync_batch set, moved files and their directories are flushed to
+    disk after every fsync_batch moves, and when flush() is called.
+
+    Parameters
+    ----------
+    group : str
+        Group given write access to created directories, or None to create
+        them with the default ownership and permissions
+    fsync_batch : int
+        Number of moves between flushes to disk, 0 to leave it to the OS
+    """
+    def __init__(self, group=ARCHIVE_GROUP, fsync_batch=0):
+        self.group = group
+        self.fsync_batch = fsync_batch
+        self._directories = set()
+        self._gid = None
+        self._gid_resolved = False
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def get_group_id(self):
+        """Returns the id of the archive group, creating the group if it
+        doesn't exist. Returns None if there is no such group."""
+        with self._lock:
+            if not self._gid_resolved:
+                self._gid = self._resolve_group()
+                self._gid_resolved = True
+            return self._gid
+
+    def _resolve_group(self):
+        if self.group is None:
+            return None
+        try:
+            return grp.getgrnam(self.group).gr_gid
+        except KeyError:
+            # create the group if it doesn't exist
+            os.system('groupadd {}'.format(self.group))
+        try:
+            return grp.getgrnam(self.group).gr_gid
+        except KeyError:
+            logging.warning("Unable to create the %s group", self.group)
+            return None
+
+    def makedirs(self, path):
+        """Creates a directory and any missing parents, each with group
+        write permissions"""
+        path = os.path.abspath(path)
+        if path in self._directories:
+            return
+
+        # Find the deepest directory which already exists
+        missing = []
+        parent = path
+        while parent not in self._directories and not os.path.isdir(parent):
+            missing.append(parent)
+            parent = os.path.dirname(parent)
+
+        for directory in reversed(missing):
+            try:
+                os.mkdir(directory)
+            except FileExistsError:
+                # Created by another archive worker in the meantime
+                continue
+            self._set_permissions(directory)
+
+        with self._lock:
+            self._directories.add(path)
+
+    def _set_permissions(self, directory):
+        if self.group is None:
+            return
+        try:
+            group_id = self.get_group_id()
+            if group_id is not None:
+                os.chown(directory, os.getuid(), group_id)
+            os.chmod(directory, mode=DIRECTORY_PERMISSIONS)
+        except OSError:
+            # Not necessarily an error, things ought to still function, but
+            # admins may have permission to edit these files.
+            logging.warning("Unable to set group permissions on %s.", directory)
+
+    def forget(self, path):
+        """Drops a directory from the cache, e.g. after it was removed"""
+        with self._lock:
+            self._directories.discard(os.path.abspath(path))
+
+    def move(self, src, dest):
+        """Moves a file to dest, creating its directory if needed"""
+        directory = os.path.dirname(dest)
+        self.makedirs(directory)
+
+        try:
+            try:
+                os.rename(src, dest)
+            except FileNotFoundError:
+                if not os.path.exists(src):
+                    raise
+                # The cached directory has been removed since
+                self.forget(directory)
+                self.makedirs(directory)
+                os.rename(src, dest)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            self._copy(src, dest)
+            os.remove(src)
+
+        if self.fsync_batch > 0:
+            self._add_pending(dest)
+        return dest
+
+    def _copy(self, src, dest):
+        """Copies a file to another filesystem. The copy is written next to
+        dest and renamed into place so that a partial file never appears."""
+        tmp = dest + ".part"
+        try:
+            with open(src, 'rb') as fsrc, open(tmp, 'wb') as fdst:
+                _copy_fd(fsrc.fileno(), fdst.fileno(), os.fstat(fsrc.fileno()).st_size)
+            shutil.copystat(src, tmp)
+            os.rename(tmp, dest)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def _add_pending(self, filepath):
+        with self._lock:
+            self._pending.append(filepath)
+            if len(self._pending) < self.fsync_batch:
+                return
+            pending, self._pending = self._pending, []
+        _fsync_files(pending)
+
+    def flush(self):
+        """Flushes the files moved since the last flush to disk"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        _fsync_files(pending)
+
+
+def _copy_fd(src, dest, size):
+    """Copies size bytes between file descriptors without passing the data
+    through Python"""
+    offset = 0
+    copy = getattr(os, 'copy_file_range', None)
+    while offset < size:
+        count = min(COPY_BLOCK_SIZE, size - offset)
+        if copy is not None:
+            try:
+                n = copy(src, dest, count)
+            except OSError as e:
+                # Not supported between these filesystems
+                if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                    raise
+                copy = None
+                continue
+        else:
+            n = os.sendfile(dest, src, offset, count)
+        if n == 0:
+            raise OSError(errno.EIO, "Copy ended after %d of %d bytes" % (offset, size))
+        offset += n
+
+
+def _fsync_files(filepaths):
+    """Flushes files, then each of their directories once, to disk"""
+    directories = set()
+    for filepath in filepaths:
+        fd = os.open(filepath, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        directories.add(os.path.dirname(filepath))
+
+    for directory in directories:
+        fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
@@ -2,6 +2,15 @@
 """Helioviewer.org installer database functions"""
 import sys
 import os
+import time
+import threading
+from collections import namedtuple
+
+# Seconds that a DatasourceResolver keeps its copy of the datasources table
+__DATASOURCE_TTL__ = 600
+
+# Database id of a datasource, whether it is enabled and its XRT groups
+Datasource = namedtuple("Datasource", ["id", "enabled", "groups"])
 
 def setup_database_schema(adminuser, adminpass, dbhost, dbname, dbuser, dbpass, mysql):
     """Sets up Helioviewer.org database schema"""
@@ -1292,11 +1301,48 @@ def mark_as_corrupt(cursor, filename, note):
 
     cursor.execute(sql)
 
-def get_datasources(cursor):
-    """Returns a list of the known datasources"""
-    __SOURCE_ID_IDX__ = 0
-    __ENABLED_IDX__ = 1
+def get_known_filenames(cursor, filenames, chunk_size=1000):
+    """Returns the subset of filenames present in the `data` or `corrupt` tables
+
+    Filenames are checked in chunks using a single `WHERE filename IN (...)`
+    query per table and chunk rather than one query per file.
+    """
+    known = set()
+    filenames = list(filenames)
+
+    for i in range(0, len(filenames), chunk_size):
+        chunk = filenames[i:i + chunk_size]
+
+        for table in ["data", "corrupt"]:
+            # Files found in `data` don't need to be checked against `corrupt`
+            chunk = [f for f in chunk if f not in known]
+            if len(chunk) == 0:
+                break
+            placeholders = ", ".join(["%s"] * len(chunk))
+            sql = "SELECT filename FROM %s WHERE filename IN (%s)" % (table, placeholders)
+            cursor.execute(sql, chunk)
+            known.update(row[0] for row in cursor.fetchall())
+
+    return known
+
+def get_ingested_filenames(cursor, starttime, endtime):
+    """Returns (filename, date) pairs for all images in the `data` table
+    observed within the given time range"""
+    sql = "SELECT filename, date FROM data WHERE date BETWEEN %s AND %s"
+    cursor.execute(sql, (starttime, endtime))
+    return cursor.fetchall()
 
+def get_corrupt_filenames(cursor, starttime):
+    """Returns (filename, timestamp) pairs for all images marked as corrupt
+    since the given time"""
+    sql = "SELECT filename, timestamp FROM corrupt WHERE timestamp >= %s"
+    cursor.execute(sql, (starttime,))
+    return cursor.fetchall()
+
+def _get_datasource_rows(cursor):
+    """Returns a row for each datasource with its id, whether it is enabled
+    and the fitsName of each of its properties in uiOrder, or None where it
+    has fewer properties"""
     letters = {0:'a', 1:'b', 2:'c', 3:'d', 4:'e'}
 
     sql = \
@@ -1317,7 +1363,24 @@ def get_datasources(cursor):
 
     # Fetch available data-sources
     cursor.execute(sql)
-    results = cursor.fetchall()
+    return cursor.fetchall()
+
+def _get_property_names(source):
+    """Returns the property names of a datasource row up to the first
+    missing one"""
+    names = []
+    for name in source[2:]:
+        if name is None:
+            break
+        names.append(name)
+    return tuple(names)
+
+def get_datasources(cursor):
+    """Returns a list of the known datasources"""
+    __SOURCE_ID_IDX__ = 0
+    __ENABLED_IDX__ = 1
+
+    results = _get_datasource_rows(cursor)
 
     # Convert results into a more easily traversable tree structure
     tree = {}
@@ -1327,13 +1390,128 @@ def get_datasources(cursor):
         enabled = bool(source[__ENABLED_IDX__])
 
         leaf = tree
-        for i in range(2, len(letters)+2):
-            if source[i] is None:
-                leaf['id'] = id
-                leaf['enabled'] = enabled
-                break
-            if source[i] not in leaf:
-                leaf[source[i]] = {}
-            leaf = leaf[source[i]]
+        for name in _get_property_names(source):
+            if name not in leaf:
+                leaf[name] = {}
+            leaf = leaf[name]
+        leaf['id'] = id
+        leaf['enabled'] = enabled
 
     return tree
+
+def getImageGroup(sourceId):
+    """Create data object of XRT groups
+
+    TODO: move groupId definition to the database
+    """
+    groups = dict()
+    groups["groupOne"] = 0
+    groups["groupTwo"] = 0
+    groups["groupThree"] = 0
+
+    if sourceId > 37 and sourceId < 75:
+        groups["groupOne"] = 10001
+
+        # ID 68 messes up the math because it doesn't fit the pattern.
+        # So for values > 68 offset it by 1 so we basically ignore it
+        # in the math. This is confirmed to work via test_jp2.py
+        offset = sourceId
+        if sourceId > 68:
+            offset = sourceId - 1
+
+        # sourceId 68 doesn't follow the pattern. groups 2 and 3 should
+        # be 0 for 68, so exclude it here.
+        if sourceId != 68:
+            # thanks to the pattern of how the data is laid out
+            # group 2 follows a modulus of 10002 - 10007 and repeats
+            # i.e. 38 -> 10002 ... 43 -> 10007, 44 -> 10002 ... 49 -> 10007, etc
+            # So group 2 can be set with a modulus
+            groups["groupTwo"] = ((offset - 38) % 6) + 10002
+
+            # Group 3 has a similar pattern, every 6 share a group and then
+            # the group is incremented by one.
+            # i.e. 38 -> 10008 ... 43 -> 10008, 44 -> 10009 ... 49 -> 10009, etc
+            # Count on integer division to drop the result in the correct bucket
+            # 38 to 43 when subtracted will return 0 - 5, when divided by 6 returns 0.
+            # 44 to 49 when subtracted will return 6 - 11, when divided by 6 returns 1.
+            # etc.
+            groups["groupThree"] = ((offset - 38) // 6) + 10008
+
+    return groups
+
+
+class DatasourceResolver:
+    """Finds the datasource of each image from a cached copy of the
+    datasources table.
+
+    Datasources are keyed by the tuple of an image's detection values (see
+    JP2parser.get_source_key). The table is read again when an unknown key
+    is looked up and once ttl seconds have passed, so one resolver can be
+    kept for the lifetime of a process. Disabled datasources are enabled
+    the first time an image is found for them.
+
+    Parameters
+    ----------
+    ttl : float
+        Seconds before the cached table is read again
+    """
+    def __init__(self, ttl=__DATASOURCE_TTL__):
+        self.ttl = ttl
+        self._sources = {}
+        self._prefixes = set()
+        self._missing = set()
+        self._loaded = None
+        self._lock = threading.Lock()
+
+    def refresh(self, cursor):
+        """Reads the datasources table"""
+        sources = {}
+        prefixes = set()
+        for source in _get_datasource_rows(cursor):
+            key = _get_property_names(source)
+            sourceId = int(source[0])
+            sources[key] = Datasource(sourceId, bool(source[1]), getImageGroup(sourceId))
+            prefixes.update(key[:i] for i in range(1, len(key) + 1))
+        with self._lock:
+            self._sources = sources
+            self._prefixes = prefixes
+            self._missing = set()
+            self._loaded = time.monotonic()
+
+    def lookup(self, cursor, key):
+        """Returns the Datasource for a key, raising KeyError if there is
+        none"""
+        with self._lock:
+            expired = self._loaded is None or time.monotonic() - self._loaded >= self.ttl
+            # Each unknown key only causes one read until the next refresh
+            unknown = key not in self._sources and key not in self._missing
+        if expired or unknown:
+            self.refresh(cursor)
+
+        with self._lock:
+            if key not in self._sources:
+                self._missing.add(key)
+                raise KeyError(key)
+            return self._sources[key]
+
+    def resolve(self, cursor, key):
+        """Returns the Datasource for a key, enabling it if it is disabled.
+        The UPDATE is committed along with the next insert."""
+        source = self.lookup(cursor, key)
+        if not source.enabled:
+            with self._lock:
+                # Another thread may have just enabled it
+                source = self._sources.get(key, source)
+                enable = not source.enabled
+                source = source._replace(enabled=True)
+                self._sources[key] = source
+            if enable:
+                enable_datasource(cursor, source.id)
+        return source
+
+    def is_known_prefix(self, cursor, key):
+        """Returns True if any datasource's key starts with the given
+        values"""
+        if self._loaded is None:
+            self.refresh(cursor)
+        return tuple(key) in self._prefixes
@@ -0,0 +1,95 @@
+import datetime
+import threading
+from configparser import ConfigParser
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pytest
+from ..httpbrowser import HTTPDataBrowser, URLLister
+
+LISTING = b'<a href="?C=N;O=D">Name</a> <a href="/parent/">Parent</a> <a href="a.jp2">a.jp2</a> <a href="b.jp2">b.jp2</a>'
+
+class ListingHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    requests = []
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        ListingHandler.requests.append((self.path, self.headers.get("If-None-Match")))
+        if self.headers.get("If-None-Match") == '"v1"':
+            self.send_response(304)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("ETag", '"v1"')
+        self.send_header("Content-Length", str(len(LISTING)))
+        self.end_headers()
+        self.wfile.write(LISTING)
+
+@pytest.fixture
+def server():
+    ListingHandler.requests = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ListingHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield "http://127.0.0.1:%d" % server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+def test_listing_is_revalidated(server):
+    """
+    A cached listing is reused when the server reports it hasn't changed
+    """
+    browser = HTTPDataBrowser(None)
+    location = server + "/2011/11/17/"
+    first = list(browser.get_files(location, "jp2"))
+    second = list(browser.get_files(location, "jp2"))
+
+    assert first == [location + "a.jp2", location + "b.jp2"]
+    assert second == first
+    assert ListingHandler.requests == [("/2011/11/17/", None), ("/2011/11/17/", '"v1"')]
+
+def test_old_directories_are_not_requested_again(server):
+    """
+    Listings of date directories older than listing_immutable_days are
+    served from the cache without contacting the server
+    """
+    conf = ConfigParser()
+    conf.read_dict({"network": {"listing_immutable_days": "3"}})
+    browser = HTTPDataBrowser(None)
+    browser.configure(conf)
+
+    today = datetime.datetime.utcnow().date()
+    old = server + (today - datetime.timedelta(days=10)).strftime("/%Y/%m/%d/")
+    recent = server + today.strftime("/%Y/%m/%d/")
+    for i in range(2):
+        assert len(list(browser.get_files(old, "jp2"))) == 2
+        assert len(list(browser.get_files(recent, "jp2"))) == 2
+
+    paths = [path for path, etag in ListingHandler.requests]
+    assert paths.count(old[len(server):]) == 1
+    assert paths.count(recent[len(server):]) == 2
+
+class FakeResponse:
+    """Serves a body a few bytes at a time, without a charset"""
+    def __init__(self, body):
+        self.body = body
+        self.headers = ListingHandler.MessageClass()
+
+    def read(self, amt=None):
+        chunk, self.body = self.body[:7], self.body[7:]
+        return chunk
+
+def test_lister_extracts_hrefs_across_reads():
+    """
+    Links split between reads are still found, in all quoting styles, and
+    only those with the requested extension are kept
+    """
+    body = ('<html><body><a href="a.jp2">a</a> <A HREF=\'b.jp2\'>b</A>\n'
+            '<a class="x" href=c.jp2>c</a> <a href="d.fits">d</a>'
+            '<a href="e&amp;f.jp2">é</a><a href="unterminated.jp2"').encode("utf-8")
+    lister = URLLister("jp2")
+    assert lister.parse(FakeResponse(body)) == ["a.jp2", "b.jp2", "c.jp2", "e&f.jp2"]
@@ -1,39 +1,85 @@
 """HTTP data browser"""
 import sys
 import os
+import re
 import socket
+import datetime
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional
 from helioviewer.hvpull.browser.basebrowser import BaseDataBrowser, NetworkError
+from helioviewer.hvpull.servers import get_date_from_directory
 
 if (sys.version_info >= (3, 0)):
+    import codecs
+    import html
     import urllib.request, urllib.parse, urllib.error
-    from html.parser import HTMLParser
-    class URLLister(HTMLParser):
+    from helioviewer.hvpull.net import connectionpool
+
+    # href attribute of any start tag, with double, single or no quotes
+    HREF_REGEX = re.compile(r"""<[a-zA-Z][^>]*?\shref\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))""",
+                            re.IGNORECASE)
+
+    # Size of the blocks read from the server while parsing a listing
+    LISTING_CHUNK_SIZE = 64 * 1024
+
+    # Charset used when the server doesn't send one
+    DEFAULT_CHARSET = "utf-8"
+
+    class URLLister:
         '''
         Created on Nov 1, 2011
         @author: Jack Ireland <jack.ireland@nasa.gov>
         copied from the original version of the download code.
+
+        Links are pulled out of the listing with a regular expression as
+        it is read, rather than by a full HTML parse of the whole page.
         '''
-        def __init__(self):
-            HTMLParser.__init__(self)
+        def __init__(self, extension=None):
+            self.suffix = None if extension is None else "." + extension
             self.urls = []
+            self._pending = ""
 
         def read(self, uri):
             """Read a URI and return a list of files/directories"""
-            usock = urllib.request.urlopen(uri)
-            self.feed(usock.read().decode(usock.headers.get_content_charset()))
+            usock = connectionpool.urlopen(uri)
+            result = self.parse(usock)
             usock.close()
 
+            return result
+
+        def parse(self, usock):
+            """Parse an open response and return a list of files/directories"""
+            charset = usock.headers.get_content_charset() or DEFAULT_CHARSET
+            decoder = codecs.getincrementaldecoder(charset)(errors="replace")
+            while True:
+                chunk = usock.read(LISTING_CHUNK_SIZE)
+                if not chunk:
+                    break
+                self.feed(decoder.decode(chunk))
+            self.feed(decoder.decode(b"", final=True))
             return self.urls
 
+        def feed(self, data):
+            """Extract the links from each complete tag received so far"""
+            data = self._pending + data
+            end = data.rfind(">") + 1
+            self._pending = data[end:]
+            for match in HREF_REGEX.finditer(data, 0, end):
+                href = match.group(match.lastindex)
+                if "&" in href:
+                    href = html.unescape(href)
+                if self.suffix is None or href.endswith(self.suffix):
+                    self.urls.append(href)
+
         def reset(self):
             """Reset state of URLLister"""
-            HTMLParser.reset(self)
             self.urls = []
+            self._pending = ""
 
-        def handle_starttag(self, tag, attrs):
-            href = [v for k, v in attrs if k == 'href']
-            if href:
-                self.urls.extend(href)
+        def close(self):
+            """Discard any unterminated tag at the end of the listing"""
+            self._pending = ""
 
 else:
     import urllib
@@ -74,6 +120,23 @@ class HTTPDataBrowser(BaseDataBrowser):
         BaseDataBrowser.__init__(self, server)
         socket.setdefaulttimeout(60)
 
+        # Listings of recently queried directories, keyed by URL and
+        # extension. Each entry is (urls, etag, last_modified, fetched),
+        # where fetched is the UTC date the listing was downloaded.
+        self.listing_cache = OrderedDict()
+        self.listing_cache_size = 1000
+        # Days after which a date directory is assumed to no longer change.
+        # None always revalidates the cached listing with the server.
+        self.immutable_after = None
+        self._cache_lock = threading.Lock()
+
+    def configure(self, conf):
+        """Applies the listing cache settings"""
+        self.listing_cache_size = conf.getint('network', 'listing_cache_size',
+                                              fallback=self.listing_cache_size)
+        days = conf.getint('network', 'listing_immutable_days', fallback=0)
+        self.immutable_after = datetime.timedelta(days=days) if days > 0 else None
+
     def get_directories(self, start_date, end_date):
         """Generates a list of remote directories which may be queried
         for files corresponding to the requested range. Note that these
@@ -81,7 +144,7 @@ class HTTPDataBrowser(BaseDataBrowser):
         # filter(lambda url: url.endswith("/"), self._query(location))
         return self.server.compute_directories(start_date, end_date)
 
-    def get_files(self, location, extension, filter_func: callable | None = None):
+    def get_files(self, location, extension, filter_func: Optional[Callable] = None):
         """Get all the files that end with specified extension at the uri"""
         files = None
         num_retries = 0
@@ -92,7 +155,7 @@ class HTTPDataBrowser(BaseDataBrowser):
         while files is None and num_retries <= 10:
             try:
                 # Only grab files with the matching file extension
-                files = filter(lambda url: url.endswith("." + extension), self._query(location))
+                files = self._query(location, extension)
                 # If there is a user-defined filter function, use that to only get those specific files.
                 if filter_func is not None:
                     files = filter(filter_func, files)
@@ -110,19 +173,62 @@ class HTTPDataBrowser(BaseDataBrowser):
 
         return files
 
-    def _query(self, location):
-        """Get a list of files and folders at the specified remote location"""
-        # query the remote location for the list of files and subdirectories.
-
-        if (sys.version_info >= (3, 0)):
-            url_lister = URLLister()
-        else:
-            url_lister = URLLister()
+    def _query(self, location, extension=None):
+        """Get a list of files and folders at the specified remote location,
+        optionally only those with the given extension
+
+        Listings are cached and revalidated with a conditional request, so
+        unchanged directories are neither downloaded nor parsed again.
+        """
+        key = (location, extension)
+        with self._cache_lock:
+            cached = self.listing_cache.get(key)
+            if cached is not None:
+                self.listing_cache.move_to_end(key)
+        if cached is not None and self._is_immutable(location, cached[3]):
+            return cached[0]
+
+        headers = {}
+        if cached is not None:
+            if cached[1] is not None:
+                headers["If-None-Match"] = cached[1]
+            if cached[2] is not None:
+                headers["If-Modified-Since"] = cached[2]
 
-        result = url_lister.read(location)
-        url_lister.close()
+        # query the remote location for the list of files and subdirectories.
+        usock = connectionpool.urlopen(location, headers)
+        try:
+            if usock.status == 304 and cached is not None:
+                usock.read()
+                return cached[0]
+            url_lister = URLLister(extension)
+            result = url_lister.parse(usock)
+            url_lister.close()
+        finally:
+            usock.close()
 
         urls = filter(lambda url: url[0] != "/" and url[0] != "?", result)
-
-        return [os.path.join(location, url) for url in urls]
+        urls = [os.path.join(location, url) for url in urls]
+
+        etag = usock.getheader("ETag")
+        last_modified = usock.getheader("Last-Modified")
+        fetched = datetime.datetime.utcnow().date()
+        if etag is not None or last_modified is not None or self.immutable_after is not None:
+            with self._cache_lock:
+                self.listing_cache[key] = (urls, etag, last_modified, fetched)
+                self.listing_cache.move_to_end(key)
+                while len(self.listing_cache) > self.listing_cache_size:
+                    self.listing_cache.popitem(last=False)
+
+        return urls
+
+    def _is_immutable(self, location, fetched):
+        """Returns True if the cached listing of a date directory was
+        downloaded long enough after that date for it to be complete"""
+        if self.immutable_after is None:
+            return False
+        date = get_date_from_directory(location)
+        if date is None:
+            return False
+        return fetched - date > self.immutable_after
 
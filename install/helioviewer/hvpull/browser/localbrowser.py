@@ -1,5 +1,6 @@
 """Local data browser"""
 import os
+from typing import Callable, Optional
 from helioviewer.hvpull.browser.basebrowser import BaseDataBrowser
 
 
@@ -14,7 +15,7 @@ class LocalDataBrowser(BaseDataBrowser):
         """Get a list of directories at the passed uri"""
         return self.server.compute_directories(start_date, end_date)
 
-    def get_files(self, location, extension, filter_func: callable | None = None):
+    def get_files(self, location, extension, filter_func: Optional[Callable] = None):
         """Get all the files that end with specified extension at the uri"""
 
         # ensure the location exists
@@ -0,0 +1,93 @@
+"""Fixtures shared by the HVPull tests"""
+import threading
+import pytest
+from helioviewer.hvpull.browser.basebrowser import BaseDataBrowser, NetworkError
+from helioviewer.hvpull.net.daemon import ImageRetrievalDaemon
+from helioviewer.hvpull.net.fileindex import KnownFileIndex
+from helioviewer.hvpull.net.filters import QueryFilter
+from helioviewer.hvpull.servers import DataServer
+
+
+class FakeBrowser(BaseDataBrowser):
+    """Browser which lists a fixed set of directories, tracking concurrency
+
+    Parameters
+    ----------
+    directories : list
+        Directories returned for any time range
+    failures : dict
+        Number of times listing each directory fails before it succeeds
+    delay : float
+        Seconds each listing takes
+    filenames : callable
+        Returns the names of the files in a directory, by default 0.jp2
+        and 1.jp2
+    """
+    def __init__(self, server, directories, failures=None, delay=0.05, filenames=None):
+        BaseDataBrowser.__init__(self, server)
+        self.directories = directories
+        self.failures = failures or {}
+        self.delay = delay
+        self.filenames = filenames or (lambda uri: ["%d.jp2" % i for i in range(2)])
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def get_directories(self, start_time, end_time):
+        return self.directories
+
+    def get_files(self, uri, extension, filter_func=None):
+        with self._lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        threading.Event().wait(self.delay)
+        with self._lock:
+            self.active -= 1
+        if self.failures.get(uri, 0) > 0:
+            self.failures[uri] -= 1
+            raise NetworkError()
+        return filter(filter_func, ["%s/%s" % (uri, name) for name in self.filenames(uri)])
+
+
+@pytest.fixture
+def fake_browser():
+    """Returns the FakeBrowser class"""
+    return FakeBrowser
+
+
+@pytest.fixture
+def make_daemon():
+    """Returns a function which creates an ImageRetrievalDaemon ready for
+    query() and query_server(), without loading servers, starting
+    downloaders or connecting to a database.
+
+    The servers default to those of the browsers given, or a single TEST
+    server. Each gets a QueryFilter without any delays or strides.
+    """
+    def make(browsers=(), servers=None, watermarks=None):
+        daemon = ImageRetrievalDaemon.__new__(ImageRetrievalDaemon)
+        if servers is None:
+            servers = [browser.server for browser in browsers]
+        daemon.servers = servers or [DataServer("http://example.com", "TEST")]
+        daemon.browsers = list(browsers)
+        daemon.filters = {server.name: QueryFilter(server.name) for server in daemon.servers}
+        daemon.downloaders = []
+        daemon.queues = []
+        daemon.concurrency = []
+        daemon.pipeline = None
+        daemon.watermarks = watermarks
+        daemon.stats_file = ""
+        daemon.shutdown_requested = False
+        daemon.sent_diskspace_warning = True
+        daemon.known_files = KnownFileIndex()
+        daemon.known_files.seed([])
+        daemon._cursor = None
+        daemon._db_lock = threading.Lock()
+        daemon._file_times = {}
+        daemon._listings = []
+        daemon._downloaded = []
+        daemon._downloaded_lock = threading.Lock()
+        daemon._unreachable_servers = set()
+        daemon._unreachable_lock = threading.Lock()
+        return daemon
+    return make
@@ -0,0 +1,75 @@
+import os
+import threading
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from queue import Queue
+from ..aiohttp import AIOHTTPDownloader
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+def _serve(directory):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(QuietHandler, directory=directory))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, "http://127.0.0.1:%d/" % server.server_address[1]
+
+def _start_downloader(incoming, queue, max_downloads):
+    downloader = AIOHTTPDownloader(incoming, queue)
+    downloader.max_downloads = max_downloads
+    downloader.setDaemon(True)
+    downloader.start()
+    return downloader
+
+def test_aiohttp_downloader(tmp_path):
+    """
+    Downloads several files at once from a local server
+    """
+    remote = tmp_path / "remote"
+    incoming = tmp_path / "incoming"
+    remote.mkdir()
+    files = {"%d.jp2" % i: os.urandom(100000 + i) for i in range(12)}
+    for name, contents in files.items():
+        (remote / name).write_bytes(contents)
+
+    server, url = _serve(str(remote))
+    completed = []
+    queue = Queue()
+    downloader = _start_downloader(str(incoming), queue, 4)
+    downloader.set_complete_callback(completed.append)
+
+    for name in files:
+        queue.put(["testing", 10, url + name])
+    queue.join()
+    server.shutdown()
+
+    # The downloader thread must exit once asked to stop
+    downloader.stop()
+    downloader.join(5)
+    assert not downloader.is_alive()
+
+    assert not downloader.has_failed()
+    assert sorted(completed) == sorted(str(incoming / name) for name in files)
+    assert sorted(os.listdir(incoming)) == sorted(files)
+    for name, contents in files.items():
+        assert (incoming / name).read_bytes() == contents
+
+def test_aiohttp_downloader_failure(tmp_path):
+    """
+    Makes sure the downloader stops once each download slot has seen 10 failures
+    """
+    server, url = _serve(str(tmp_path))
+    queue = Queue()
+    downloader = _start_downloader(str(tmp_path / "incoming"), queue, 2)
+
+    # Missing files are put back on the queue until the downloader gives up
+    queue.put(["testing", 10, url + "boop.jp2"])
+    queue.join()
+    server.shutdown()
+    downloader.stop()
+
+    assert downloader.has_failed()
+    assert downloader.failure_count == 20
+    assert not os.path.exists(tmp_path / "incoming" / "boop.jp2.part")
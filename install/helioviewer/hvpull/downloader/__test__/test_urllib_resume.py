@@ -0,0 +1,60 @@
+import os
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from queue import Queue
+from ..urllib import URLLibDownloader
+
+CONTENTS = os.urandom(3 * 1024 * 1024 + 123)
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    """Serves CONTENTS, honouring Range requests. The first full request is
+    cut off half way through."""
+    ranges = []
+    cut_off = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        requested = self.headers.get("Range")
+        FlakyHandler.ranges.append(requested)
+        start = int(requested[len("bytes="):-1]) if requested else 0
+        body = CONTENTS[start:]
+
+        self.send_response(206 if requested else 200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if FlakyHandler.cut_off:
+            FlakyHandler.cut_off = False
+            self.wfile.write(body[:len(body) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+def test_interrupted_download_resumes(tmp_path):
+    """
+    A transfer which is cut off is requeued and resumes from the partial
+    file with a Range request
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FlakyHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    completed = []
+    queue = Queue()
+    downloader = URLLibDownloader(str(tmp_path), queue)
+    downloader.set_complete_callback(completed.append)
+    downloader.setDaemon(True)
+    downloader.start()
+
+    queue.put(["testing", 10, "http://127.0.0.1:%d/file.jp2" % server.server_address[1]])
+    queue.join()
+    server.shutdown()
+
+    half = len(CONTENTS) // 2
+    assert FlakyHandler.ranges == [None, "bytes=%d-" % half]
+    assert downloader.failure_count == 1
+    assert completed == [str(tmp_path / "file.jp2")]
+    assert (tmp_path / "file.jp2").read_bytes() == CONTENTS
+    assert not os.path.exists(tmp_path / "file.jp2.part")
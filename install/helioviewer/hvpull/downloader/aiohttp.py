@@ -0,0 +1,165 @@
+"""aiohttp-based file downloader
+
+Runs many transfers from a single server on one asyncio event loop, rather
+than one thread per transfer. Connections to the server are kept alive and
+reused between files, and each file is streamed to disk as it arrives.
+"""
+import os
+import asyncio
+import logging
+import queue
+import threading
+import time
+import aiohttp
+from .downloader_interface import Downloader
+
+# Size of the blocks written to disk while streaming a file
+CHUNK_SIZE = 1024 * 1024
+
+# Seconds an idle connection is kept open for reuse
+KEEPALIVE_TIMEOUT = 60
+
+# Seconds to wait for a file to finish downloading
+DOWNLOAD_TIMEOUT = 600
+
+# Seconds between checks for a shutdown while waiting for work
+QUEUE_POLL_INTERVAL = 1
+
+class AIOHTTPDownloader(Downloader):
+    multiplexed = True
+
+    def __init__(self, incoming, queue):
+        """Creates a new AIOHTTPDownloader"""
+        super().__init__(incoming, queue)
+
+        self.failure_count = 0
+
+        # The fields below are set by the Downloader parent class
+        # self.incoming
+        # self.queue
+        # self.max_downloads
+
+    def _handle_download_failure(self):
+        # URLLibDownloader threads each stop at 10 failures. This downloader
+        # stands in for max_downloads of them, so allow as many failures.
+        self.failure_count += 1
+        if (self.failure_count >= 10 * self.max_downloads):
+            self.flag_failure()
+
+    def run(self):
+        asyncio.run(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        items = asyncio.Queue()
+        # Transfers are limited by the shared controller if there is one
+        slots = self.concurrency or threading.Semaphore(self.max_downloads)
+
+        # Items are taken off the shared queue by a helper thread so that
+        # waiting for work doesn't block the event loop
+        feeder = threading.Thread(target=self._feed, args=(loop, items, slots),
+                                  name="%s-feeder" % self.name)
+        feeder.daemon = True
+        feeder.start()
+
+        connector = aiohttp.TCPConnector(limit_per_host=self.max_downloads,
+                                         keepalive_timeout=KEEPALIVE_TIMEOUT)
+        timeout = aiohttp.ClientTimeout(total=DOWNLOAD_TIMEOUT)
+        # The event loop only keeps weak references to tasks
+        tasks = set()
+
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            while True:
+                item = await items.get()
+                if item is None:
+                    break
+                task = asyncio.create_task(self._process(session, slots, item))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+            # Shutting down, abandon any transfers still in progress
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _feed(self, loop, items, slots):
+        """Passes items from the shared queue to the event loop, one for each
+        free download slot, until a shutdown is requested"""
+        while not self.shutdown_requested:
+            if not slots.acquire(timeout=QUEUE_POLL_INTERVAL):
+                continue
+            try:
+                item = self.queue.get(timeout=QUEUE_POLL_INTERVAL)
+            except queue.Empty:
+                slots.release()
+                continue
+            loop.call_soon_threadsafe(items.put_nowait, item)
+        loop.call_soon_threadsafe(items.put_nowait, None)
+
+    async def _process(self, session, slots, item):
+        try:
+            # If the downloader has failed, then just mark that the operation is done
+            # without any further processing. The main downloader daemon will handle the failure
+            if not self.has_failed():
+                await self.process(session, item)
+        finally:
+            slots.release()
+            self.queue.task_done()
+
+    async def process(self, session, item):
+        """Downloads the file at the specified URL"""
+        server, percent, url = item
+
+        # Location to save file to
+        filepath = os.path.join(self.incoming, os.path.basename(url))
+        partial = filepath + ".part"
+
+        # Create sub-directory if it does not already exist
+        if not os.path.exists(os.path.dirname(filepath)):
+            try:
+                os.makedirs(os.path.dirname(filepath))
+            except OSError:
+                pass
+
+        try:
+            t1 = time.time()
+            size = 0
+
+            async with session.get(url) as response:
+                response.raise_for_status()
+                # Disk writes run off the event loop so that a slow disk
+                # doesn't stall the other transfers
+                with open(partial, "wb") as local_file:
+                    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                        await asyncio.to_thread(local_file.write, chunk)
+                        size += len(chunk)
+
+            t2 = time.time()
+            self.record_transfer(size, t2 - t1)
+
+            mbps = (size / 10e5) / (t2 - t1)
+            logging.info("(%s) Downloaded %s (%0.3f MB/s) [%0.2f%%]", server, url, mbps, percent)
+
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            # If download fails, add back into queue and try again later
+            if not isinstance(e, aiohttp.ClientResponseError) or e.status == 429 or e.status >= 500:
+                self.record_failure()
+            logging.warning("Failed to download %s. Adding to end of queue to retry later.", url)
+            self._remove_partial(partial)
+            self.queue.put([server, percent, url])
+            self._handle_download_failure()
+        except Exception:
+            logging.warning("Failed to download %s.", url)
+            self._remove_partial(partial)
+            self._handle_download_failure()
+        else:
+            os.rename(partial, filepath)
+            # The callback blocks while the ingestion pipeline is full, so
+            # only this transfer's slot waits for it to catch up
+            await asyncio.to_thread(self.notify_complete, filepath)
+
+    def _remove_partial(self, partial):
+        try:
+            os.remove(partial)
+        except OSError:
+            pass
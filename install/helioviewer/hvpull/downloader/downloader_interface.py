@@ -2,6 +2,11 @@ from threading import Thread
 from queue import Queue
 
 class Downloader(Thread):
+    # Downloaders which run several transfers at once set this, in which case
+    # a single instance is created per server with max_downloads set to the
+    # number of simultaneous transfers it should run.
+    multiplexed = False
+
     def __init__(self, incoming_dir: str, queue: Queue):
         """
         Creates a Downloader thread
@@ -13,6 +18,9 @@ class Downloader(Thread):
         self.incoming = incoming_dir
         self.queue = queue
         self._failure_flag = False
+        self._on_complete = None
+        self.max_downloads = 1
+        self.concurrency = None
 
     def has_failed(self) -> bool:
         """
@@ -27,6 +35,44 @@ class Downloader(Thread):
         """
         self._failure_flag = True
 
+    def set_complete_callback(self, callback):
+        """
+        Sets a function to be called with the local path of each file
+        once it has been successfully downloaded
+        """
+        self._on_complete = callback
+
+    def notify_complete(self, filepath: str):
+        """
+        To be called by derived classes when a file has been downloaded
+        """
+        if self._on_complete is not None:
+            self._on_complete(filepath)
+
+    def set_concurrency(self, controller):
+        """
+        Sets a shared limit on the number of transfers run at once, with
+        acquire/release methods like a threading.Semaphore. If the
+        controller also has record/record_failure methods, the result of
+        each transfer is reported to it.
+        """
+        self.concurrency = controller
+
+    def record_transfer(self, nbytes: int, seconds: float):
+        """
+        To be called by derived classes when a transfer completes
+        """
+        if self.concurrency is not None and hasattr(self.concurrency, "record"):
+            self.concurrency.record(nbytes, seconds)
+
+    def record_failure(self):
+        """
+        To be called by derived classes when a transfer fails because of
+        the server or the network
+        """
+        if self.concurrency is not None and hasattr(self.concurrency, "record_failure"):
+            self.concurrency.record_failure()
+
     def stop(self):
         self.shutdown_requested = True
 
@@ -37,9 +83,19 @@ class Downloader(Thread):
             # task_done must be called so callers don't hang if queue.join was called.
             item = self.queue.get()
             if (not self.has_failed()):
-                self.process(item)
+                self._process_with_slot(item)
             self.queue.task_done()
 
+    def _process_with_slot(self, item):
+        """Processes an item once a transfer slot is free"""
+        if self.concurrency is None:
+            return self.process(item)
+        self.concurrency.acquire()
+        try:
+            self.process(item)
+        finally:
+            self.concurrency.release()
+
     def process(self):
         """
         To be implemented by derived classes.
@@ -3,7 +3,7 @@ import os
 import logging
 import threading
 import time
-import shutil
+from helioviewer.archive import ArchiveWriter
 from .downloader_interface import Downloader
 
 # Maximum number of retry attempts per file before giving up
@@ -13,6 +13,7 @@ class LocalFileMove(Downloader):
     def __init__(self, incoming, queue):
         """Creates a new LocalFileMover"""
         super().__init__(incoming, queue)
+        self.archive = ArchiveWriter(group=None)
 
         # The fields below are set by the Downloader parent class
         # self.incoming
@@ -36,16 +37,11 @@ class LocalFileMove(Downloader):
         # Location to save file to
         filepath = os.path.join(self.incoming, os.path.basename(uri))
 
-        # Create sub-directory if it does not already exist
-        if not os.path.exists(os.path.dirname(filepath)):
-            try:
-                os.makedirs(os.path.dirname(filepath))
-            except OSError:
-                pass
-        #Attempt to move the file
+        #Attempt to move the file. The sub-directory is created if it does
+        #not already exist.
         try:
             t1 = time.time()
-            shutil.move(uri, filepath)
+            self.archive.move(uri, filepath)
             t2 = time.time()
             logging.info("(%s) locally moved %s to %s", server, uri, filepath)
         except IOError:
@@ -60,3 +56,5 @@ class LocalFileMove(Downloader):
                              uri, MAX_RETRY_ATTEMPTS)
         except:
             logging.warning("Failed to move %s.", uri)
+        else:
+            self.notify_complete(filepath)
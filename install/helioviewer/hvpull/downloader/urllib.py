@@ -3,10 +3,14 @@ import sys
 import os
 import logging
 import time
-from urllib.request import urlopen, Request
 from urllib.error import URLError, HTTPError
+from http.client import HTTPException, IncompleteRead
+from helioviewer.hvpull.net.connectionpool import urlopen
 from .downloader_interface import Downloader
 
+# Size of the blocks read from the server and written to disk
+CHUNK_SIZE = 1024 * 1024
+
 class URLLibDownloader(Downloader):
     def __init__(self, incoming, queue):
         """Creates a new URLLibDownloader"""
@@ -41,32 +45,81 @@ class URLLibDownloader(Downloader):
             except OSError:
                 pass
 
-        #Write to our local file
+        # Stream to a partial file which is renamed once complete. If an
+        # earlier attempt left one behind, resume from where it stopped.
+        partial = filepath + ".part"
+        offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+
         try:
-            # TODO: should urlretrieve be used instead?
             t1 = time.time()
 
-            remote_file = urlopen(Request(url))
+            headers = {}
+            if offset > 0:
+                headers["Range"] = "bytes=%d-" % offset
+
+            # Connections are shared with the other downloaders and kept
+            # open between files
+            remote_file = urlopen(url, headers)
 
-            file_contents = remote_file.read()
+            # Servers which ignore the range send the whole file again
+            if offset > 0 and remote_file.status != 206:
+                offset = 0
+
+            size = 0
+            with open(partial, "ab" if offset > 0 else "wb") as local_file:
+                while True:
+                    chunk = remote_file.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    local_file.write(chunk)
+                    size += len(chunk)
+            remote_file.close()
+
+            # Reading in chunks doesn't raise if the connection closes early
+            length = remote_file.getheader("Content-Length")
+            if length is not None and size < int(length):
+                raise IncompleteRead(b"", int(length) - size)
 
             t2 = time.time()
+            self.record_transfer(size, t2 - t1)
 
-            mbps = (len(file_contents) / 10e5) / (t2 - t1)
-            logging.info("(%s) Downloaded %s (%0.3f MB/s) [%0.2f%%]", server, url, mbps, percent)
+            mbps = (size / 10e5) / (t2 - t1)
+            if offset > 0:
+                logging.info("(%s) Downloaded %s (%0.3f MB/s, resumed at %d bytes) [%0.2f%%]",
+                             server, url, mbps, offset, percent)
+            else:
+                logging.info("(%s) Downloaded %s (%0.3f MB/s) [%0.2f%%]", server, url, mbps, percent)
 
-        except URLError:
-            # If download fails, add back into queue and try again later
+        except HTTPError as e:
+            # The partial file no longer matches the remote one
+            if e.code == 416:
+                self._remove_partial(partial)
+            # Busy or failing servers should be given fewer transfers
+            if e.code == 429 or e.code >= 500:
+                self.record_failure()
+            logging.warning("Failed to download %s. Adding to end of queue to retry later.", url)
+            self.queue.put([server, percent, url])
+            self._handle_download_failure()
+        except (URLError, ConnectionError, TimeoutError, HTTPException):
+            # If download fails, add back into queue and try again later.
+            # Whatever was received is kept and the retry resumes from there.
+            self.record_failure()
             logging.warning("Failed to download %s. Adding to end of queue to retry later.", url)
             self.queue.put([server, percent, url])
             self._handle_download_failure()
         except:
             logging.warning("Failed to download %s.", url)
+            self._remove_partial(partial)
             self._handle_download_failure()
         else:
-            # Open our local file for writing
             # @TODO: handle full disk scenario:
             # IOError: [Errno 28] No space left on device
-            local_file = open(filepath, "wb")
-            local_file.write(file_contents)
-            local_file.close()
+            os.rename(partial, filepath)
+
+            self.notify_complete(filepath)
+
+    def _remove_partial(self, partial):
+        try:
+            os.remove(partial)
+        except OSError:
+            pass
@@ -0,0 +1,49 @@
+import os
+import random
+from helioviewer.hvpull.servers import DataServer
+
+def _quadratic_balance_load(urls, m):
+    """The list-searching implementation _balance_load replaced"""
+    files = [[os.path.basename(url) for url in x] for x in urls]
+    n = sum(len(x) for x in files)
+    counters = [0] * m
+    for i in range(n):
+        idx = i % m
+        if len(files[idx]) > counters[idx]:
+            value = files[idx][counters[idx]]
+            while value is None:
+                counters[idx] += 1
+                if len(files[idx]) > counters[idx]:
+                    value = files[idx][counters[idx]]
+                else:
+                    break
+            if value is None:
+                continue
+            for k, file_list in enumerate(files):
+                if k != idx and value in file_list:
+                    j = file_list.index(value)
+                    files[k][j] = None
+                    urls[k][j] = None
+        counters[idx] += 1
+    return [[x for x in url_list if x is not None] for url_list in urls]
+
+def _servers(m):
+    return [DataServer("http://server%d.com" % i, "TEST%d" % i) for i in range(m)]
+
+def test_balance_load_matches_original(make_daemon):
+    """
+    Files shared between servers, including repeats within one server's
+    list, are distributed exactly as before
+    """
+    rng = random.Random(42)
+    for trial in range(200):
+        m = rng.randint(2, 4)
+        urls = [["http://server%d.com/%d.jp2" % (i, rng.randint(0, 30))
+                 for j in range(rng.randint(1, 40))] for i in range(m)]
+        expected = _quadratic_balance_load([list(x) for x in urls], m)
+        assert make_daemon(servers=_servers(m))._balance_load([list(x) for x in urls]) == expected
+
+def test_dedupe_urls_keeps_first_copy(make_daemon):
+    urls = ["http://a.com/1.jp2", "http://a.com/2.jp2", "http://b.com/1.jp2", "http://a.com/3.jp2"]
+    assert make_daemon()._dedupe_urls(urls) == ["http://a.com/1.jp2", "http://a.com/2.jp2",
+                                                  "http://a.com/3.jp2"]
@@ -0,0 +1,63 @@
+import itertools
+import threading
+from unittest.mock import patch
+from ..concurrency import AdaptiveConcurrency
+
+def _round(controller, nbytes=1000000, seconds=1.0):
+    for i in range(controller.limit):
+        controller.record(nbytes, seconds)
+
+def test_limit_grows_while_throughput_holds():
+    # Each round takes one second
+    with patch("time.monotonic", side_effect=itertools.count()):
+        controller = AdaptiveConcurrency("TEST", 1, 4)
+        for i in range(10):
+            _round(controller)
+    assert controller.limit == 4
+
+def test_failure_halves_limit():
+    controller = AdaptiveConcurrency("TEST", 1, 8, initial=8)
+    for i in range(7):
+        controller.record(1000000, 1.0)
+    controller.record_failure()
+    assert controller.limit == 4
+    assert controller.stats()["failures"] == 1
+
+def test_slow_transfers_halve_limit():
+    controller = AdaptiveConcurrency("TEST", 2, 8, initial=8)
+    _round(controller, seconds=1.0)
+    _round(controller, seconds=5.0)
+    assert controller.limit == 4
+
+def test_limit_stays_within_range():
+    controller = AdaptiveConcurrency("TEST", 2, 3, initial=10)
+    assert controller.limit == 3
+    for i in range(5):
+        controller.record_failure()
+    assert controller.limit == 2
+
+def test_static_range_never_changes():
+    controller = AdaptiveConcurrency("TEST", 2, 2, initial=2)
+    _round(controller)
+    controller.record_failure()
+    controller.record_failure()
+    assert controller.limit == 2
+
+def test_acquire_blocks_at_limit():
+    controller = AdaptiveConcurrency("TEST", 1, 4, initial=2)
+    assert controller.acquire()
+    assert controller.acquire()
+    assert not controller.acquire(timeout=0.01)
+    assert not controller.acquire(blocking=False)
+
+    acquired = threading.Event()
+    def waiter():
+        controller.acquire()
+        acquired.set()
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    assert not acquired.wait(0.05)
+    controller.release()
+    assert acquired.wait(1)
+    thread.join()
+    assert controller.stats()["active"] == 2
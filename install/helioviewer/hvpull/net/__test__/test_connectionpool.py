@@ -0,0 +1,73 @@
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.error import HTTPError
+import pytest
+from ..connectionpool import ConnectionPool
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == "/missing":
+            body = b"not found"
+            self.send_response(404)
+        elif self.path == "/moved":
+            body = b""
+            self.send_response(302)
+            self.send_header("Location", "/listing")
+        else:
+            body = b'<a href="file.jp2">file.jp2</a>'
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield "http://127.0.0.1:%d" % server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+def test_connections_are_reused(server):
+    """
+    Requests to the same host share one connection once each response is read
+    """
+    pool = ConnectionPool()
+    for i in range(5):
+        with pool.urlopen(server + "/listing") as response:
+            assert response.read() == b'<a href="file.jp2">file.jp2</a>'
+    assert pool.stats() == {"opened": 1, "reused": 4}
+    pool.clear()
+
+def test_redirects_and_errors(server):
+    """
+    Redirects are followed and error responses raise HTTPError without
+    losing the connection
+    """
+    pool = ConnectionPool()
+    with pool.urlopen(server + "/moved") as response:
+        assert response.status == 200
+        assert response.read() == b'<a href="file.jp2">file.jp2</a>'
+    with pytest.raises(HTTPError) as e:
+        pool.urlopen(server + "/missing")
+    assert e.value.code == 404
+    assert pool.stats() == {"opened": 1, "reused": 2}
+    pool.clear()
+
+def test_expired_connections_are_replaced(server):
+    """
+    Connections idle for longer than the timeout are not reused
+    """
+    pool = ConnectionPool(idle_timeout=0)
+    for i in range(2):
+        with pool.urlopen(server + "/listing") as response:
+            response.read()
+    assert pool.stats() == {"opened": 2, "reused": 0}
+    pool.clear()
@@ -0,0 +1,45 @@
+import datetime
+from unittest.mock import patch
+from ..fileindex import KnownFileIndex
+
+AIA_171 = "2024_04_16__11_15_41_129__SDO_AIA_AIA_171.jp2"
+AIA_304 = "2024_04_16__11_15_42_129__SDO_AIA_AIA_304.jp2"
+AIA_335 = "2024_04_16__11_15_43_129__SDO_AIA_AIA_335.jp2"
+
+def test_evict_before():
+    index = KnownFileIndex()
+    index.add("old.jp2", datetime.datetime(2024, 1, 1))
+    index.update([("new.jp2", datetime.datetime(2024, 1, 3))])
+
+    assert index.evict_before(datetime.datetime(2024, 1, 2)) == 1
+    assert "old.jp2" not in index
+    assert "new.jp2" in index
+    assert len(index) == 1
+
+def test_seed():
+    index = KnownFileIndex()
+    assert not index.seeded
+    index.seed([("a.jp2", datetime.datetime(2024, 1, 1))])
+    assert index.seeded
+    assert "a.jp2" in index
+
+def test_filter_new_only_queries_unknown_files(make_daemon):
+    """
+    Files in the index should never reach the database, and files found in
+    the database should be added to the index.
+    """
+    daemon = make_daemon()
+    daemon.known_files.add(AIA_171, datetime.datetime(2024, 4, 16, 11, 15, 41))
+    urls = ["http://example.com/" + f for f in [AIA_171, AIA_304, AIA_335]]
+
+    with patch("helioviewer.hvpull.net.daemon.get_known_filenames", return_value={AIA_304}) as query:
+        new_urls = daemon._filter_new(urls)
+
+    query.assert_called_once_with(None, [AIA_304, AIA_335])
+    assert new_urls == ["http://example.com/" + AIA_335]
+    assert AIA_304 in daemon.known_files
+
+    # Second pass, nothing left for the database to resolve except the new file
+    with patch("helioviewer.hvpull.net.daemon.get_known_filenames", return_value=set()) as query:
+        new_urls = daemon._filter_new(urls)
+    query.assert_called_once_with(None, [AIA_335])
@@ -0,0 +1,41 @@
+import datetime
+from configparser import ConfigParser
+from ..filters import QueryFilter
+
+START = datetime.datetime(2024, 4, 16, 12)
+END = datetime.datetime(2024, 4, 16, 13)
+
+def _url(instrument, t):
+    return t.strftime("http://example.com/%Y_%m_%d__%H_%M_%S_00__SDO_{0}_{0}_171.jp2".format(instrument))
+
+def test_delayed_instruments_use_shifted_window():
+    rules = QueryFilter("LMSAL", delays={"hmi": datetime.timedelta(hours=4)})
+    times = [START + datetime.timedelta(minutes=30), START - datetime.timedelta(hours=3, minutes=30),
+             START - datetime.timedelta(hours=3, minutes=30), START - datetime.timedelta(hours=5)]
+    urls = [_url("AIA", times[0]), _url("HMI", times[1]), _url("AIA", times[2]), _url("HMI", times[3])]
+
+    assert rules.apply(urls, times, START, END) == urls[:2]
+
+def test_stride_applies_to_new_files_only():
+    rules = QueryFilter("LMSAL2", strides={"aia": 3})
+    times = [START + datetime.timedelta(minutes=i + 1) for i in range(10)]
+    urls = [_url("AIA", t) for t in times] + [_url("EIT", times[0])]
+    times.append(times[0])
+    ingested = set(urls[:2])
+
+    kept = rules.apply(urls, times, START, END, lambda files: [f for f in files if f not in ingested])
+
+    # Every third new AIA file, and everything else
+    assert kept == [urls[2], urls[5], urls[8], urls[10]]
+
+def test_rules_from_config():
+    conf = ConfigParser()
+    conf.read_dict({"stride": {"LMSAL2": "aia:5"}, "processing_delay": {"ROB": "eit:30, lasco:90"}})
+
+    lmsal2 = QueryFilter.from_config(conf, "LMSAL2")
+    assert lmsal2.strides == {"aia": 5}
+    assert lmsal2.delays == {"hmi": datetime.timedelta(minutes=240)}
+
+    rob = QueryFilter.from_config(conf, "ROB")
+    assert rob.strides == {}
+    assert rob.max_delay == datetime.timedelta(minutes=90)
@@ -0,0 +1,81 @@
+import threading
+from ..pipeline import IngestPipeline, Stage
+
+def test_items_flow_through_stages_into_batches():
+    batches = []
+    stages = [
+        Stage("double", lambda x: x * 2, workers=3),
+        # Odd numbers are dropped by returning None
+        Stage("drop", lambda x: x if x % 4 == 0 else None, workers=2),
+    ]
+    pipeline = IngestPipeline(stages, batches.append, batch_size=10, queue_size=5)
+    pipeline.start()
+
+    for i in range(25):
+        pipeline.put(i)
+    pipeline.join()
+
+    assert not pipeline.has_failed()
+    assert sorted(x for batch in batches for x in batch) == [i * 2 for i in range(0, 25, 2)]
+    # Full batches are written as they fill, the remainder on join
+    assert [len(batch) for batch in batches] == [10, 3]
+    assert stages[0].processed == 25
+    assert stages[1].processed == 25
+
+def test_queues_apply_backpressure():
+    release = threading.Event()
+    stages = [Stage("slow", lambda x: release.wait() and x, workers=1)]
+    pipeline = IngestPipeline(stages, lambda batch: None, queue_size=2)
+    pipeline.start()
+
+    # One item in the worker and two waiting fill the pipeline
+    for i in range(3):
+        pipeline.put(i)
+    producer = threading.Thread(target=pipeline.put, args=(3,))
+    producer.start()
+    producer.join(0.2)
+    assert producer.is_alive()
+
+    release.set()
+    producer.join(1)
+    assert not producer.is_alive()
+    pipeline.join()
+
+def test_failure_stops_processing_but_drains():
+    batches = []
+
+    def fail_on_three(x):
+        if x == 3:
+            raise RuntimeError("boom")
+        return x
+
+    stages = [Stage("fail", fail_on_three, workers=1)]
+    pipeline = IngestPipeline(stages, batches.append, batch_size=100, queue_size=2)
+    pipeline.start()
+    for i in range(10):
+        pipeline.put(i)
+    pipeline.join()
+
+    assert pipeline.has_failed()
+    # The sink isn't called once the pipeline has failed
+    assert batches == []
+
+def test_stage_calling_sys_exit_fails_pipeline():
+    """A stage which tries to quit must not leave join() waiting forever"""
+    import sys
+
+    def exit_on_one(x):
+        if x == 1:
+            sys.exit(1)
+        return x
+
+    pipeline = IngestPipeline([Stage("exit", exit_on_one)], lambda batch: None)
+    pipeline.start()
+    for i in range(3):
+        pipeline.put(i)
+
+    joiner = threading.Thread(target=pipeline.join)
+    joiner.start()
+    joiner.join(2)
+    assert not joiner.is_alive()
+    assert pipeline.has_failed()
@@ -0,0 +1,43 @@
+import threading
+from unittest.mock import patch
+from helioviewer.hvpull.servers import DataServer
+
+def test_query_server_lists_directories_concurrently(make_daemon, fake_browser):
+    server = DataServer("http://example.com", "TEST")
+    server.max_connections = 3
+    directories = ["http://example.com/%d" % i for i in range(9)]
+    browser = fake_browser(server, directories)
+
+    files = make_daemon().query_server(browser, None, None)
+
+    # Results keep the directory order
+    assert files == ["%s/%d.jp2" % (d, i) for d in directories for i in range(2)]
+    assert browser.max_active == 3
+
+def test_query_server_retries_each_directory(make_daemon, fake_browser):
+    server = DataServer("http://example.com", "TEST")
+    browser = fake_browser(server, ["http://example.com/a", "http://example.com/b"],
+                          failures={"http://example.com/b": 2})
+
+    with patch("helioviewer.hvpull.net.daemon.time.sleep") as sleep:
+        files = make_daemon().query_server(browser, None, None)
+
+    assert len(files) == 4
+    assert sleep.call_count == 2
+
+def test_unreachable_server_alerts_once(make_daemon, fake_browser):
+    server = DataServer("http://example.com", "TEST")
+    server.max_connections = 4
+    directories = ["http://example.com/%d" % i for i in range(4)]
+    browser = fake_browser(server, directories, failures={d: 10**6 for d in directories}, delay=0)
+
+    daemon = make_daemon()
+    # The other listings give up while the alert is being sent
+    slow_alert = lambda msg: threading.Event().wait(0.2)
+    with patch("helioviewer.hvpull.net.daemon.time.sleep"), \
+         patch.object(daemon, "send_email_alert", side_effect=slow_alert) as send_email_alert:
+        files = daemon.query_server(browser, None, None)
+
+    assert files == []
+    assert send_email_alert.call_count == 1
+    assert daemon.shutdown_requested
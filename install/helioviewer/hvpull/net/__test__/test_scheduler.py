@@ -0,0 +1,141 @@
+import datetime
+import threading
+from unittest.mock import patch
+from ..scheduler import DownloadScheduler
+from helioviewer.hvpull.servers import get_datetime_from_file
+
+NOW = datetime.datetime.utcnow()
+
+def _item(age):
+    t = NOW - age
+    return ["TEST", 0, t.strftime("http://example.com/%Y_%m_%d__%H_%M_%S_00__SDO_AIA_AIA_171.jp2")]
+
+def _drain(q):
+    items = []
+    while not q.empty():
+        items.append(q.get())
+        q.task_done()
+    return items
+
+def test_recent_files_go_first_newest_first():
+    q = DownloadScheduler(get_datetime_from_file, backfill_share=0)
+    old = [_item(datetime.timedelta(days=d)) for d in (3, 2)]
+    recent = [_item(datetime.timedelta(minutes=m)) for m in (30, 10, 20)]
+    for item in old + recent:
+        q.put(item)
+
+    assert _drain(q) == [recent[1], recent[2], recent[0], old[1], old[0]]
+
+def test_backfill_share():
+    q = DownloadScheduler(get_datetime_from_file, backfill_share=0.25)
+    for i in range(8):
+        q.put(_item(datetime.timedelta(minutes=i + 1)))
+    for i in range(4):
+        q.put(_item(datetime.timedelta(days=i + 1)))
+
+    recent_window = datetime.timedelta(hours=6)
+    kinds = ["recent" if NOW - get_datetime_from_file(url) < recent_window else "backfill"
+             for server, percent, url in _drain(q)]
+    # One backfill file for every three recent files while both are waiting
+    assert kinds[:8] == ["recent"] * 3 + ["backfill"] + ["recent"] * 3 + ["backfill"]
+    assert kinds.count("backfill") == 4
+
+def test_aged_backfill_goes_next():
+    clock = [0.0]
+    with patch("time.monotonic", lambda: clock[0]):
+        q = DownloadScheduler(get_datetime_from_file, backfill_share=0, max_wait=60)
+        old = _item(datetime.timedelta(days=5))
+        q.put(old)
+        recent = [_item(datetime.timedelta(minutes=m)) for m in range(1, 4)]
+        for item in recent:
+            q.put(item)
+
+        assert q.get() == recent[0]
+        clock[0] = 61
+        assert q.get() == old
+        assert q.get() == recent[1]
+
+def test_queue_interface():
+    """
+    Blocking get, task_done and join work as with queue.Queue
+    """
+    q = DownloadScheduler(get_datetime_from_file)
+    results = []
+
+    def worker():
+        item = q.get()
+        results.append(item)
+        q.task_done()
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    q.put(["TEST", 0, "not-a-dated-file.jp2"])
+    q.join()
+    thread.join()
+    assert results == [["TEST", 0, "not-a-dated-file.jp2"]]
+
+def test_join_timeout():
+    q = DownloadScheduler(get_datetime_from_file)
+    assert q.join(0)
+    q.put(_item(datetime.timedelta(minutes=1)))
+    assert not q.join(0.01)
+    q.get()
+    q.task_done()
+    assert q.join(0.01)
+
+class FakeDownloader(threading.Thread):
+    """Downloads one file at a time once ready is set, recording the order
+    of the downloads"""
+    def __init__(self, queue, on_complete):
+        threading.Thread.__init__(self, daemon=True)
+        self.queue = queue
+        self.on_complete = on_complete
+        self.ready = threading.Event()
+        self.order = []
+
+    def has_failed(self):
+        return False
+
+    def run(self):
+        self.ready.wait()
+        while True:
+            item = self.queue.get()
+            self.order.append(item)
+            self.on_complete(item[2])
+            self.queue.task_done()
+
+def test_acquire_feeds_scheduler_with_every_file(make_daemon):
+    """
+    The scheduler is given the whole set of files at once, so the backfill
+    share applies across all of it rather than within batches, and files
+    are ingested in batches as they are downloaded
+    """
+    daemon = make_daemon()
+    queue = DownloadScheduler(get_datetime_from_file, backfill_share=0.5)
+    daemon.queues = [queue]
+    downloader = FakeDownloader(queue, daemon._add_downloaded)
+    downloader.start()
+    daemon.downloaders = [[downloader]]
+
+    # Listed oldest first: 150 backfill files then 150 recent ones
+    urls = [_item(datetime.timedelta(days=10, minutes=i))[2] for i in range(150, 0, -1)]
+    urls += [_item(datetime.timedelta(minutes=i))[2] for i in range(150, 0, -1)]
+
+    # Downloads start once every file has been queued
+    wait_for_downloads = daemon._wait_for_downloads
+    def start_downloads(timeout):
+        downloader.ready.set()
+        return wait_for_downloads(timeout)
+
+    ingested = []
+    with patch.object(daemon, "_wait_for_downloads", side_effect=start_downloads), \
+         patch.object(daemon, "ingest", side_effect=ingested.append):
+        assert daemon.acquire([list(urls)])
+
+    order = [item[2] for item in downloader.order]
+    recent = set(urls[150:])
+    # Newest first, with every other download going to backfill
+    assert order[0] == urls[-1]
+    assert [url in recent for url in order[:6]] == [True, False] * 3
+    assert sorted(sum(ingested, [])) == sorted(urls)
+    assert all(len(batch) >= 100 for batch in ingested[:-1])
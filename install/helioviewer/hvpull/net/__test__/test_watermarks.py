@@ -0,0 +1,106 @@
+import os
+import datetime
+from unittest.mock import patch
+from ..watermarks import WatermarkStore
+from ..filters import QueryFilter
+from helioviewer.hvpull.servers import DataServer
+
+LOOKBACK = datetime.timedelta(hours=2)
+
+def test_watermarks_persist(tmp_path):
+    path = str(tmp_path / "state.json")
+    store = WatermarkStore(path, LOOKBACK)
+    store.update("LMSAL", "http://example.com/2024/04/16/", datetime.datetime(2024, 4, 16, 11, 15),
+                 datetime.datetime(2024, 4, 16, 12))
+    store.update("ROB", "http://example.com/2024/04/16/", datetime.datetime(2024, 4, 16, 9),
+                 datetime.datetime(2024, 4, 16, 12))
+    # An empty listing doesn't move the watermark back
+    store.update("ROB", "http://example.com/2024/04/16/", None, datetime.datetime(2024, 4, 16, 13))
+    store.save()
+
+    restored = WatermarkStore(path, LOOKBACK)
+    restored.load()
+    assert restored.get_starttime(["LMSAL"]) == datetime.datetime(2024, 4, 16, 9, 15)
+    assert restored.get_starttime(["LMSAL", "ROB"]) == datetime.datetime(2024, 4, 16, 7)
+    assert restored.get_starttime(["LMSAL", "JSOC"]) is None
+
+def test_complete_directories():
+    """
+    A date directory is complete once listed later than the lookback after
+    the end of its day
+    """
+    store = WatermarkStore("unused", LOOKBACK)
+    directory = "http://example.com/2024/04/16/"
+    assert not store.is_complete("LMSAL", directory)
+    store.update("LMSAL", directory, None, datetime.datetime(2024, 4, 17, 1))
+    assert not store.is_complete("LMSAL", directory)
+    store.update("LMSAL", directory, None, datetime.datetime(2024, 4, 17, 2))
+    assert store.is_complete("LMSAL", directory)
+
+    store.update("LMSAL", "http://example.com/latest/", None, datetime.datetime(2024, 5, 1))
+    assert not store.is_complete("LMSAL", "http://example.com/latest/")
+
+    assert store.evict_before(datetime.datetime(2024, 4, 17, 0, 1)) == 1
+    assert not store.is_complete("LMSAL", directory)
+
+def test_processing_delay_outlasts_lookback():
+    """
+    HMI files on LMSAL appear up to 4 hours after they were observed, so a
+    listing after the lookback but before the delay isn't complete
+    """
+    store = WatermarkStore("unused", LOOKBACK)
+    directory = "http://example.com/2024/04/16/"
+    delay = QueryFilter.from_config(_EmptyConfig(), "LMSAL").max_delay
+    assert delay == datetime.timedelta(minutes=240)
+
+    store.update("LMSAL", directory, None, datetime.datetime(2024, 4, 17, 2, 1))
+    assert store.is_complete("LMSAL", directory)
+    assert not store.is_complete("LMSAL", directory, delay)
+    store.update("LMSAL", directory, None, datetime.datetime(2024, 4, 17, 6))
+    assert store.is_complete("LMSAL", directory, delay)
+
+def test_query_server_skips_complete_directories(tmp_path, make_daemon, fake_browser):
+    server = DataServer("http://example.com", "TEST")
+    old = "http://example.com/2011/11/17"
+    recent = datetime.datetime.utcnow().strftime("http://example.com/%Y/%m/%d")
+    browser = fake_browser(server, [old, recent])
+    daemon = make_daemon([browser], watermarks=WatermarkStore(str(tmp_path / "state.json"), LOOKBACK))
+
+    assert len(daemon.query_server(browser, None, None)) == 4
+    daemon._commit_watermarks()
+    assert daemon.query_server(browser, None, None) == [recent + "/0.jp2", recent + "/1.jp2"]
+
+class _EmptyConfig:
+    """Configuration without any settings, so defaults are used"""
+    def get(self, section, option, fallback=None):
+        return fallback
+
+def _aia_file(directory):
+    """Names one AIA file for the date of a directory"""
+    return [directory[-10:].replace("/", "_") + "__12_00_00_000__SDO_AIA_AIA_171.jp2"]
+
+def test_watermarks_wait_for_downloads(tmp_path, make_daemon, fake_browser):
+    """
+    Listings are only recorded once the files found in them have been
+    downloaded, so files left over by an interrupted download are fetched
+    again after a restart
+    """
+    server = DataServer("http://example.com", "TEST")
+    directory = "http://example.com/2011/11/17"
+    browser = fake_browser(server, [directory], filenames=_aia_file)
+    state_file = str(tmp_path / "state.json")
+    daemon = make_daemon([browser], watermarks=WatermarkStore(state_file, LOOKBACK))
+
+    starttime = datetime.datetime(2011, 11, 17)
+    endtime = datetime.datetime(2011, 11, 18)
+    with patch("helioviewer.hvpull.net.daemon.get_known_filenames", return_value=set()):
+        with patch.object(daemon, "acquire", return_value=False) as acquire:
+            daemon.query(starttime, endtime)
+        assert len(acquire.call_args[0][0][0]) == 1
+        assert not os.path.exists(state_file)
+        assert not daemon.watermarks.is_complete("TEST", directory)
+
+        with patch.object(daemon, "acquire", return_value=True):
+            daemon.query(starttime, endtime)
+        assert os.path.exists(state_file)
+        assert daemon.watermarks.is_complete("TEST", directory)
@@ -0,0 +1,129 @@
+"""Adaptive limit on the number of simultaneous downloads from a server"""
+import logging
+import threading
+import time
+
+
+class AdaptiveConcurrency:
+    """Additive-increase/multiplicative-decrease control of the number of
+    transfers run against one server.
+
+    Downloaders take a slot before each transfer and report how it went.
+    Once a round of transfers (one per slot) has finished, the limit is
+
+    - halved if any transfer in the round failed, or the average transfer
+      time grew to more than latency_factor times the best recent round,
+    - raised by one if the round's throughput kept up with the last round,
+    - otherwise left as it is.
+
+    The limit stays between floor and ceiling. acquire and release follow
+    threading.Semaphore, so the controller can be used in place of one.
+
+    Parameters
+    ----------
+    name : str
+        Server name, used in log messages
+    floor, ceiling : int
+        Lowest and highest number of simultaneous transfers
+    initial : int
+        Starting limit, defaults to the floor
+    latency_factor : float
+        Slowdown in average transfer time treated as congestion
+    """
+    def __init__(self, name, floor, ceiling, initial=None, latency_factor=2.0):
+        self.name = name
+        self.floor = max(1, floor)
+        self.ceiling = max(self.floor, ceiling)
+        self.limit = min(max(initial or self.floor, self.floor), self.ceiling)
+        self.latency_factor = latency_factor
+
+        self.active = 0
+        self.transfers = 0
+        self.failures = 0
+        self.bytes = 0
+        self.mbps = 0.0
+
+        self._best_latency = None
+        self._round_start = time.monotonic()
+        self._round = []
+        self._cond = threading.Condition()
+
+    def acquire(self, blocking=True, timeout=None):
+        """Waits for a free transfer slot. Returns False if none became free
+        within the timeout."""
+        with self._cond:
+            if not blocking:
+                timeout = 0
+            if not self._cond.wait_for(lambda: self.active < self.limit, timeout):
+                return False
+            # Don't count time spent idle between batches against a round
+            if self.active == 0 and not self._round:
+                self._round_start = time.monotonic()
+            self.active += 1
+            return True
+
+    def release(self):
+        """Frees a transfer slot"""
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+    def record(self, nbytes, seconds):
+        """Reports a completed transfer"""
+        with self._cond:
+            self.transfers += 1
+            self.bytes += nbytes
+            self._round.append((nbytes, seconds, True))
+            self._end_round()
+
+    def record_failure(self):
+        """Reports a transfer which failed because of the server or network"""
+        with self._cond:
+            self.failures += 1
+            self._round.append((0, 0, False))
+            self._end_round()
+
+    def stats(self):
+        """Returns the current limit, activity and throughput"""
+        with self._cond:
+            return {"limit": self.limit, "active": self.active, "floor": self.floor,
+                    "ceiling": self.ceiling, "mbps": round(self.mbps, 3),
+                    "transfers": self.transfers, "failures": self.failures,
+                    "bytes": self.bytes}
+
+    def _end_round(self):
+        if len(self._round) < self.limit:
+            return
+
+        now = time.monotonic()
+        elapsed = max(now - self._round_start, 1e-6)
+        completed = [r for r in self._round if r[2]]
+        previous_mbps = self.mbps
+        self.mbps = sum(r[0] for r in completed) / 1e6 / elapsed
+
+        latency = None
+        if completed:
+            latency = sum(r[1] for r in completed) / len(completed)
+            # The baseline creeps up so that a server which has become
+            # slower for good isn't held at the floor forever
+            if self._best_latency is None:
+                self._best_latency = latency
+            else:
+                self._best_latency = min(latency, self._best_latency * 1.05)
+
+        limit = self.limit
+        if len(completed) < len(self._round):
+            limit = max(self.floor, limit // 2)
+        elif latency is not None and latency > self.latency_factor * self._best_latency:
+            limit = max(self.floor, limit // 2)
+        elif self.mbps >= 0.95 * previous_mbps:
+            limit = min(self.ceiling, limit + 1)
+
+        if limit != self.limit:
+            logging.info("(%s) Download concurrency %d -> %d (%0.3f MB/s)",
+                         self.name, self.limit, limit, self.mbps)
+            self.limit = limit
+            self._cond.notify_all()
+
+        self._round = []
+        self._round_start = now
@@ -0,0 +1,224 @@
+"""Shared keep-alive HTTP connection pool for HVPull
+
+The data browsers and downloaders make many requests to the same few hosts.
+Opening a fresh connection for each one means a new TCP (and often TLS)
+handshake every time, so connections are instead kept open after each
+response and handed to the next request for the same host.
+
+urlopen behaves like urllib.request.urlopen for the simple GET requests
+HVPull makes. Connection failures raise URLError and error responses raise
+HTTPError, so callers handle errors exactly as before.
+"""
+import socket
+import threading
+import time
+import http.client
+from urllib.parse import urlsplit, urljoin
+from urllib.error import URLError, HTTPError
+
+# Responses which are followed to the new location
+_REDIRECTS = (301, 302, 303, 307, 308)
+_MAX_REDIRECTS = 5
+
+# Errors raised when sending on a kept-alive connection the server has
+# since closed
+_STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, BrokenPipeError,
+                            ConnectionResetError, ConnectionAbortedError)
+
+
+class ConnectionPool:
+    """Thread-safe pool of idle HTTP connections, keyed by host.
+
+    Parameters
+    ----------
+    maxsize : int
+        Maximum number of idle connections kept open for each host. More
+        connections than this may be open at once, but the extras are
+        closed rather than returned to the pool.
+    idle_timeout : float
+        Seconds an idle connection is kept before it is closed
+    timeout : float
+        Socket timeout for new connections, defaults to the global timeout
+    """
+    def __init__(self, maxsize=4, idle_timeout=60, timeout=None):
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.opened = 0
+        self.reused = 0
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def urlopen(self, url, headers=None):
+        """Sends a GET request and returns the response.
+
+        Redirects are followed. The response must be closed (or read to
+        the end) for its connection to be reused.
+        """
+        for i in range(_MAX_REDIRECTS + 1):
+            response = self._request(url, headers or {})
+            if response.status not in _REDIRECTS or response.getheader("Location") is None:
+                break
+            response.read()
+            response.close()
+            url = urljoin(url, response.getheader("Location"))
+
+        if response.status >= 400:
+            # Drain the body so the connection can go back to the pool
+            response.read()
+            response.close()
+            raise HTTPError(url, response.status, response.reason, response.headers, None)
+
+        return response
+
+    def stats(self):
+        """Returns the number of connections opened and reused so far"""
+        with self._lock:
+            return {"opened": self.opened, "reused": self.reused}
+
+    def clear(self):
+        """Closes all idle connections"""
+        with self._lock:
+            idle = [conn for connections in self._idle.values() for conn, last_used in connections]
+            self._idle = {}
+        for conn in idle:
+            conn.close()
+
+    def _request(self, url, headers):
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            raise URLError("unknown url type: %s" % parts.scheme)
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+
+        conn, reused = self._get_connection(key)
+        try:
+            conn.request("GET", path, headers=headers)
+            response = conn.getresponse()
+        except _STALE_CONNECTION_ERRORS as e:
+            conn.close()
+            if not reused:
+                raise URLError(e)
+            # The server closed the idle connection, try once more on a new one
+            conn, reused = self._new_connection(key), False
+            try:
+                conn.request("GET", path, headers=headers)
+                response = conn.getresponse()
+            except OSError as e:
+                conn.close()
+                raise URLError(e)
+        except OSError as e:
+            conn.close()
+            raise URLError(e)
+
+        return PooledResponse(self, key, conn, response)
+
+    def _get_connection(self, key):
+        """Returns (connection, reused) for the given host"""
+        now = time.monotonic()
+        expired = []
+        conn = None
+
+        with self._lock:
+            connections = self._idle.get(key, [])
+            while connections:
+                candidate, last_used = connections.pop()
+                if now - last_used > self.idle_timeout:
+                    expired.append(candidate)
+                else:
+                    conn = candidate
+                    self.reused += 1
+                    break
+
+        for candidate in expired:
+            candidate.close()
+
+        if conn is not None:
+            return conn, True
+        return self._new_connection(key), False
+
+    def _new_connection(self, key):
+        scheme, host, port = key
+        timeout = self.timeout if self.timeout is not None else socket.getdefaulttimeout()
+        if scheme == "https":
+            conn = http.client.HTTPSConnection(host, port, timeout=timeout)
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=timeout)
+        with self._lock:
+            self.opened += 1
+        return conn
+
+    def _release(self, key, conn):
+        """Returns a connection whose response has been fully read"""
+        with self._lock:
+            connections = self._idle.setdefault(key, [])
+            if len(connections) < self.maxsize:
+                connections.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+
+class PooledResponse:
+    """Wraps an http.client.HTTPResponse, returning its connection to the
+    pool once the response is closed"""
+    def __init__(self, pool, key, conn, response):
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self._response = response
+        self.status = response.status
+        self.code = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+
+    def read(self, amt=None):
+        data = self._response.read(amt)
+        # Hand the connection back as soon as the body has been consumed
+        if self._response.isclosed():
+            self.close()
+        return data
+
+    def getheader(self, name, default=None):
+        return self._response.getheader(name, default)
+
+    def close(self):
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        # A partly read body, or one cut short by the server, leaves the
+        # connection unusable
+        response = self._response
+        reusable = (response.isclosed() and not response.will_close and
+                    not response.length)
+        response.close()
+        if reusable:
+            self._pool._release(self._key, conn)
+        else:
+            conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+_pool = ConnectionPool()
+
+
+def configure(maxsize, idle_timeout):
+    """Sets the size and idle timeout of the shared pool"""
+    _pool.maxsize = maxsize
+    _pool.idle_timeout = idle_timeout
+
+
+def urlopen(url, headers=None):
+    """Sends a GET request using the shared pool"""
+    return _pool.urlopen(url, headers)
+
+
+def stats():
+    """Returns the shared pool's connection counters"""
+    return _pool.stats()
@@ -4,16 +4,27 @@
 # Author: Jack Ireland <jack.ireland@nasa.gov>
 # pylint: disable=E1121
 import sys
-import stat
-import grp
 import datetime
 import time
 import logging
 import os
 import shutil
 import traceback
-from helioviewer.jp2 import process_jp2_images, BadImage, create_image_data, transcode, KduTranscodeError
-from helioviewer.db  import get_db_cursor, mark_as_corrupt
+import threading
+import json
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from helioviewer.jp2 import V2Writer, SpooledV2Writer, process_jp2_images, BadImage, create_image_data, create_image_data_batch, create_parse_pool, transcode_batch, KduTranscodeError
+from helioviewer.archive import ArchiveWriter
+from helioviewer.jp2codestream import read_codestream_info, needs_transcode
+from helioviewer.db  import DatasourceResolver, get_db_cursor, get_known_filenames, get_ingested_filenames, get_corrupt_filenames, mark_as_corrupt
+from helioviewer.hvpull.net.fileindex import KnownFileIndex
+from helioviewer.hvpull.net.pipeline import IngestPipeline, Stage
+from helioviewer.hvpull.net import connectionpool
+from helioviewer.hvpull.net.watermarks import WatermarkStore
+from helioviewer.hvpull.net.filters import QueryFilter
+from helioviewer.hvpull.net.scheduler import DownloadScheduler
+from helioviewer.hvpull.net.concurrency import AdaptiveConcurrency
 from helioviewer.hvpull.browser.basebrowser import NetworkError
 from sunpy.time import is_time
 
@@ -31,6 +42,13 @@ if (sys.version_info >= (3, 0)):
 else:
     import Queue as queue
 
+# Without the ingestion pipeline, downloaded files are ingested in batches
+# of this many, or whatever is left once every download has finished
+__INGEST_BATCH_SIZE__ = 100
+# Seconds between checks for downloader failures and shutdown requests
+# while waiting for downloads
+__ACQUIRE_POLL_INTERVAL__ = 1
+
 class ImageRetrievalDaemon:
     """Retrieves images from the server as specified"""
     def __init__(self, servers, browse_method, download_method, conf):
@@ -55,17 +73,23 @@ class ImageRetrievalDaemon:
             self.shutdown()
             self.stop()
 
-        # v2 database
+        # v2 database. Rows are either inserted alongside the data rows, or
+        # spooled locally and inserted in the background.
+        self.v2_spool_file = os.path.expanduser(conf.get('database_v2', 'spool_file', fallback=''))
+        self.v2_writer = None
         if self.dbhost_v2 != "" and self.dbname_v2 != "":
-            try:
-                self._db_v2, self._cursor_v2 = get_db_cursor(self.dbhost_v2, self.dbname_v2, self.dbuser_v2, self.dbpass_v2)
-            except mysqld.OperationalError:
-                logging.error("Unable to access MySQL. Is the database daemon running (v2)?")
-                self.shutdown()
-                self.stop()
-        else:
-            self._db_v2 = None
-            self._cursor_v2 = None
+            if self.v2_spool_file:
+                self.v2_writer = SpooledV2Writer(self.v2_spool_file, self._connect_v2)
+            else:
+                try:
+                    self.v2_writer = V2Writer(*self._connect_v2())
+                except mysqld.OperationalError:
+                    logging.error("Unable to access MySQL. Is the database daemon running (v2)?")
+                    self.shutdown()
+                    self.stop()
+
+        # Datasources are looked up from a cached copy of the table
+        self.datasources = DatasourceResolver()
 
         # Email notification
         self.email_server = conf.get('notifications', 'server')
@@ -78,45 +102,118 @@ class ImageRetrievalDaemon:
         # Maximum number of simultaneous downloads
         self.max_downloads = conf.getint('network', 'max_downloads')
 
+        # Keep-alive connections shared by the browsers and downloaders
+        connectionpool.configure(conf.getint('network', 'pool_size', fallback=4),
+                                 conf.getfloat('network', 'idle_timeout', fallback=60))
+
         # Directories
         self.working_dir = os.path.expanduser(conf.get('directories', 'working_dir'))
         self.image_archive = os.path.expanduser(conf.get('directories', 'image_archive'))
         self.incoming = os.path.join(self.working_dir, 'incoming')
         self.quarantine = os.path.join(self.working_dir, 'quarantine')
         self.kdu_transcode = os.path.expanduser(conf.get('kakadu', 'kdu_transcode'))
+        self.transcode_workers = conf.getint('kakadu', 'transcode_workers', fallback=2)
+        self.skip_compatible = conf.getboolean('kakadu', 'skip_compatible', fallback=False)
+        self.parse_workers = conf.getint('pipeline', 'parse_workers', fallback=2)
+        self.fast_metadata = conf.getboolean('pipeline', 'fast_metadata', fallback=False)
+        # Header parsing processes, started once and reused for every batch
+        self._parse_pool = create_parse_pool(self.parse_workers) if self.parse_workers != 1 else None
+        self.rows_per_insert = conf.getint('database', 'rows_per_insert', fallback=500)
 
         # Check directory permission
         self._init_directories()
 
+        # Moves files into the archive, flushing them to disk every
+        # fsync_batch files if set
+        self.archive = ArchiveWriter(fsync_batch=conf.getint('directories', 'fsync_batch', fallback=0))
+
+        # Serializes access to the database connection between threads
+        self._db_lock = threading.Lock()
+
+        # Servers which the daemon gave up trying to reach
+        self._unreachable_servers = set()
+        self._unreachable_lock = threading.Lock()
+
+        # Files known to be ingested or corrupt, seeded on the first query
+        self.known_files = KnownFileIndex()
+
+        # Observation times parsed from filenames during the current query
+        self._file_times = {}
+
+        # Directory listings made during the current query
+        self._listings = []
+
+        # How far each server's directories have been read, kept between runs
+        self.watermarks = None
+        state_file = conf.get('directories', 'state_file', fallback='')
+        if state_file:
+            lookback = datetime.timedelta(minutes=conf.getint('network', 'lookback', fallback=120))
+            self.watermarks = WatermarkStore(os.path.expanduser(state_file), lookback)
+            self.watermarks.load()
+
+        # Pipeline which ingests each file as soon as it is downloaded
+        self.pipeline = None
+        if conf.getboolean('pipeline', 'enabled', fallback=False):
+            self.pipeline = self._create_pipeline(conf)
+
         # Load data server, browser, and downloader
         self.servers = self._load_servers(servers)
 
+        # Time window and subsampling rules for each server
+        self.filters = {server.name: QueryFilter.from_config(conf, server.name)
+                        for server in self.servers}
+
+        # Maximum number of simultaneous directory listings per server
+        for server in self.servers:
+            server.max_connections = conf.getint('network', 'max_listings',
+                                                 fallback=server.max_connections)
+
         self.browsers = []
         self.downloaders = []
         self.queues = []
+        self.concurrency = []
+
+        # Files downloaded but not ingested yet, when there is no pipeline
+        self._downloaded = []
+        self._downloaded_lock = threading.Lock()
+
+        # Per-server download statistics are written here after each batch
+        self.stats_file = os.path.expanduser(conf.get('directories', 'stats_file', fallback=''))
+
+        # Download scheduling: recent files go first, with a share of the
+        # downloads kept for backfill
+        recent_window = datetime.timedelta(minutes=conf.getint('network', 'recent_window', fallback=360))
+        backfill_share = conf.getfloat('network', 'backfill_share', fallback=0.2)
+        backfill_max_wait = conf.getint('network', 'backfill_max_wait', fallback=60) * 60
 
         # For each server instantiate a browser and one or more downloaders
         for server in self.servers:
             print("Creating browser with me")
-            self.browsers.append(self._load_browser(browse_method, server))
-            global queue
-            queue = queue.Queue()
-            self.queues.append(queue)
-            self.downloaders.append([self._load_downloader(download_method, queue)
-                                     for i in range(self.max_downloads)])
+            browser = self._load_browser(browse_method, server)
+            browser.configure(conf)
+            self.browsers.append(browser)
+            download_queue = DownloadScheduler(server.get_datetime_from_file, recent_window,
+                                               backfill_share, backfill_max_wait)
+            self.queues.append(download_queue)
+
+            # Servers listed in [concurrency] have their number of
+            # simultaneous downloads adjusted to how they respond. The rest
+            # always run max_downloads at once.
+            floor, ceiling = self._get_concurrency_range(conf, server.name)
+            controller = AdaptiveConcurrency(server.name, floor, ceiling, self.max_downloads)
+            self.concurrency.append(controller)
+
+            if self._get_downloader_class(download_method).multiplexed:
+                self.downloaders.append([self._load_downloader(download_method, download_queue,
+                                                               controller.ceiling, controller)])
+            else:
+                self.downloaders.append([self._load_downloader(download_method, download_queue,
+                                                               concurrency=controller)
+                                         for i in range(controller.ceiling)])
 
         # Shutdown switch
         self.shutdown_requested = False
 
-    def is_sdo(self):
-        """
-        Returns true if the current server is an SDO server
-        """
-        return self.servers[0].name in ['LMSAL', 'LMSAL2', 'JSOC']
-
-    def get_sdo_processing_delay(self):
-        return {"aia": datetime.timedelta(minutes=0), "hmi": datetime.timedelta(minutes=4*60)}
-
     def start(self, starttime=None, endtime=None, backfill=None):
         """Start daemon operation."""
         logging.info("Initializing HVPull")
@@ -131,12 +228,18 @@ class ImageRetrievalDaemon:
         #
         # @TODO: Send email notification when HVpull stops/exits for any reason?
 
+        # Fixed time ranges are queried alongside the regular daemon, so
+        # leave its watermarks alone
+        if backfill is not None or endtime is not None:
+            self.watermarks = None
+
         # Determine starttime and endtime to use
         if backfill is None:
             if starttime is not None:
                 starttime = datetime.datetime.strptime(starttime, date_fmt)
             else:
-                starttime = self.servers[0].get_starttime()
+                # Resume from where the last run left off
+                starttime = self._get_resume_starttime() or self.servers[0].get_starttime()
             self.oldest_timestamp = starttime
 
             # If end time is specified, fill in data from start to end
@@ -173,8 +276,9 @@ class ImageRetrievalDaemon:
 
             # get a list of files available
             # self.oldest_timestamp gets set by query() during the first run
-            # before the main loop.
-            self.query(self.oldest_timestamp, now)
+            # before the main loop. With watermarks, only the time since the
+            # newest files seen (less the lookback) is queried instead.
+            self.query(self._get_resume_starttime() or self.oldest_timestamp, now)
 
             self.sleep()
 
@@ -204,6 +308,14 @@ class ImageRetrievalDaemon:
         if (starttime > endtime):
             raise ValueError(f"Start Time {starttime} is ahead of End Time {endtime}. No files would be downloaded.")
         urls = []
+        servers = []
+
+        # Filenames are parsed once per query and reused by every filter
+        self._file_times = {}
+
+        # Directory listings, recorded in the watermarks once their files
+        # have been downloaded
+        self._listings = []
 
         fmt = '%Y-%m-%d %H:%M:%S'
 
@@ -227,6 +339,7 @@ class ImageRetrievalDaemon:
             #print(matches)
             if len(matches) > 0:
                 urls.append(matches)
+                servers.append(browser.server)
 
         #print(urls)
         # Spread load across servers
@@ -236,15 +349,28 @@ class ImageRetrievalDaemon:
         # Filter out files that are already in the database
         new_urls = []
 
-        for url_list in urls:
+        # Forget files which have fallen out of the query window
+        index_starttime = self._get_index_starttime(starttime)
+        evicted = self.known_files.evict_before(index_starttime)
+        if evicted > 0:
+            logging.info("Evicted %d files from the known file index", evicted)
+        if self.watermarks is not None:
+            self.watermarks.evict_before(index_starttime)
+
+        for server, url_list in zip(servers, urls):
             filtered = None
 
             while filtered is None:
                 try:
-                    # Filter by time range
-                    filtered = self._filter_files_by_time(url_list, starttime, endtime)
-                    # Filter to only download new files that have not already been downloaded previously.
-                    filtered = list(filter(self._filter_new, filtered))
+                    # Load the files known to the database for the query window
+                    if not self.known_files.seeded:
+                        self._seed_known_files(index_starttime, endtime)
+                    # Filter by time range, then to only download new files that
+                    # have not already been downloaded previously, then
+                    # subsample high volume instruments
+                    filtered = self.filters[server.name].apply(
+                        url_list, self._get_file_times(url_list), starttime, endtime,
+                        self._filter_new)
                 except mysqld.OperationalError:
                     # MySQL has gone away -- try again in 5s
                     logging.warning(("Unable to access database to check for file existence. Will try again in 5 seconds."))
@@ -260,97 +386,35 @@ class ImageRetrievalDaemon:
                     except:
                         pass
 
-
-            ################################
-            # Temporarily slow down the cadence of the data from certain instruments
-            # Apply the extra filtering to the high-volume data only.
-            # Note that the backfill operations should also be killed when using this option
-            # Also the look-back time should not exceed the time between searches
-
-            # Sample size
-            stride = 20
-
-            # Number of strided files
-            n_strided = 0
-
-            # We want to subsample data from these high volume instruments
-            high_volume_instruments = ('aia', 'hmi')
-
-            # Some of these high volume data are slower behind real time than others
-            processing_delay = self.get_sdo_processing_delay()
-
-            # Storage for the ub-sampled URLs
-            strided = dict()
-
-            # URLs that do not include specified instruments
-            does_not_include_specified_instruments = []
-
-            for instrument in high_volume_instruments:
-                # Dictionary contains the results for the next instrument
-                strided[instrument] = []
-
-                # Delay
-                delay = processing_delay[instrument]
-
-                # These URLs are within the time range
-                includes_specified_instruments = []
-                for this_url in filtered:
-                    if instrument in this_url.lower():
-                        # Calculate the observation time of the
-                        url_time = self._get_datetime_from_file(this_url)
-
-                        # Get all the URLs within a specified time range
-                        if (starttime - delay <= url_time) and (url_time <= endtime - delay):
-                            includes_specified_instruments.append(this_url)
-                print("Time filtered file count: %d" % len(includes_specified_instruments))
-                # Take a subsample of the files for this instrument
-                strided[instrument] = includes_specified_instruments[::stride]
-                n = len(strided[instrument])
-                n_strided = n_strided + n
-                logging.info('Number of files from ' + instrument + ' = ' + str(n))
-
-            high_volume_instrument_string = ' '.join([str(elem) for elem in high_volume_instruments])
-            logging.info('Number of files available in time range from high volume instruments= ' + str(len(filtered)))
-            logging.info('High volume instruments are = ' + high_volume_instrument_string)
-            logging.info('Stride value = ' + str(stride))
-            logging.info('Number of strided files from high volume instruments = ' + str(n_strided))
-            # Create a combined list
-            extra_filtered = []
-            for instrument in high_volume_instruments:
-                extra_filtered.extend(strided[instrument])
-            extra_filtered.extend(does_not_include_specified_instruments)
-            logging.info('Number of new URLS = ' + str(len(extra_filtered)))
-
-            ################################
-            if self.servers[0].name in ['LMSAL2']:
-                new_urls.append(extra_filtered)
-                if len(extra_filtered) > 0:
-                    # Using max(starttime, ...) so oldest_timestamp never goes earlier than the initial requested starttime
-                    self.oldest_timestamp = max(starttime, self._get_oldest_image(extra_filtered))
-            else:
-                new_urls.append(filtered)
-                if len(filtered) > 0:
-                    # Using max(starttime, ...) so oldest_timestamp never goes earlier than the initial requested starttime
-                    self.oldest_timestamp = max(starttime, self._get_oldest_image(filtered))
+            logging.info("(%s) Number of new URLS = %d", server.name, len(filtered))
+            new_urls.append(filtered)
+            if len(filtered) > 0:
+                # Using max(starttime, ...) so oldest_timestamp never goes earlier than the initial requested starttime
+                self.oldest_timestamp = max(starttime, self._get_oldest_image(filtered))
 
         # check disk space
         if not self.sent_diskspace_warning:
             self._check_free_space()
 
         # acquire the data files
-        self.acquire(new_urls)
+        completed = self.acquire(new_urls)
+
+        # A listing only counts once everything found in it has been
+        # fetched, otherwise the files left over would never be retried
+        if self.watermarks is not None and completed:
+            self._commit_watermarks()
 
     def _dedupe_urls(self, urls: list) -> list:
         """
         Deduplicates files in the given url list.
         This ensures that no files with the same name are ignored
         """
-        known_files = []
+        known_files = set()
         final_urls = []
         for url in urls:
             fname = os.path.basename(url)
             if fname not in known_files:
-                known_files.append(fname)
+                known_files.add(fname)
                 final_urls.append(url)
         return final_urls
 
@@ -360,98 +424,196 @@ class ImageRetrievalDaemon:
         i.e. starttime may be 2022-03-25 00:00:00, but we should still query
         2022-03-24 in order to catch HMI images from the day before.
         """
-        if self.servers[0].name in ['LMSAL', 'LMSAL2']:
-            hmi_delay = self.get_sdo_processing_delay()['hmi']
-            return starttime - hmi_delay
-        else:
-            return starttime
+        return starttime - self._get_max_processing_delay()
 
-    def _get_oldest_image(self, image_list):
+    def _get_index_starttime(self, starttime):
         """
-        Returns the oldest image out of the given list of image file names
+        Returns the oldest observation time which can still pass the time
+        filters applied by query() for the given starttime. Files observed
+        before this time no longer need to be kept in the known file index.
         """
-        oldest = self._get_datetime_from_file(image_list[0])
-        for image in image_list:
-            image_time = self._get_datetime_from_file(image)
-            if (image_time < oldest):
-                oldest = image_time
-        return oldest
+        return self._get_query_starttime(starttime)
 
-    def _get_datetime_from_file(self, file):
-        return self.servers[0].get_datetime_from_file(file)
+    def _get_max_processing_delay(self):
+        """Returns the longest delay behind real time of any instrument"""
+        return max((f.max_delay for f in self.filters.values()), default=datetime.timedelta(0))
+
+    def _seed_known_files(self, starttime, endtime):
+        """
+        Populates the known file index with the files in the `data` and
+        `corrupt` tables for the given time range.
+        """
+        t1 = time.time()
+
+        files = list(get_ingested_filenames(self._cursor, starttime, endtime))
+
+        for filename, timestamp in get_corrupt_filenames(self._cursor, starttime):
+            try:
+                obs_time = self._get_datetime_from_file(filename)
+            except ValueError:
+                obs_time = timestamp
+            files.append((filename, obs_time))
 
-    def _filter_files_by_time(self, files, starttime, endtime):
+        self.known_files.seed(files)
+
+        t2 = time.time()
+        logging.info("Seeded known file index with %d files in %0.3fs", len(files), t2 - t1)
+
+    def _add_known_file(self, filename):
+        """Records a file as ingested or corrupt in the known file index"""
+        try:
+            self.known_files.add(filename, self._get_datetime_from_file(filename))
+        except ValueError:
+            # Files without a recognizable date are left to the database check
+            pass
+
+    def _get_oldest_image(self, image_list):
         """
-        Days on the server are already organized by day of the month.
-        This function will further filter through the file names for
-        hours:minutes:seconds time.
+        Returns the oldest image out of the given list of image file names
         """
-        filtered_list = []
-        hmi_delay = self.get_sdo_processing_delay()['hmi']
+        return min(self._get_file_times(image_list))
+
+    def _get_datetime_from_file(self, file):
+        """Returns the observation time of a file, parsing each filename
+        only once per query"""
+        try:
+            return self._file_times[file]
+        except KeyError:
+            timestamp = self.servers[0].get_datetime_from_file(file)
+            self._file_times[file] = timestamp
+            return timestamp
+
+    def _get_file_times(self, files):
+        """Returns the observation times of a list of files"""
+        file_times = self._file_times
+        parse = self.servers[0].get_datetime_from_file
+        times = []
         for file in files:
-            timestamp = self._get_datetime_from_file(file)
-            if (timestamp > starttime) and (timestamp < endtime):
-                filtered_list.append(file)
-            elif self.is_sdo():
-                # SDO contains AIA and HMI, while AIA is up-to-date, HMI lags by
-                # roughly 4 hours, so this accounts for that when using the LMSAL
-                # data servers
-                modified_start = starttime - hmi_delay
-                modified_end = endtime - hmi_delay
-                if (timestamp > modified_start) and (timestamp < modified_end):
-                    filtered_list.append(file)
-        return filtered_list
+            timestamp = file_times.get(file)
+            if timestamp is None:
+                timestamp = file_times[file] = parse(file)
+            times.append(timestamp)
+        return times
 
     def query_server(self, browser, starttime, endtime):
-        """Queries a single server for new files"""
+        """Queries a single server for new files
+
+        Remote directories are listed concurrently, with at most
+        max_connections listings in flight for the server at once.
+        """
         directories = browser.get_directories(starttime, endtime)
 
+        # Skip date directories which can't have changed since they were
+        # last listed
+        if self.watermarks is not None:
+            delay = self.filters[browser.server.name].max_delay
+            directories = [d for d in directories
+                           if not self.watermarks.is_complete(browser.server.name, d, delay)]
+
         # Get a sorted list of available JP2 files via browser
         files = []
 
         # Check each remote directory for new files
-        for directory in directories:
-            if self.shutdown_requested:
-                return []
+        with ThreadPoolExecutor(max_workers=browser.server.max_connections) as executor:
+            listings = executor.map(lambda directory: self._list_directory(browser, directory),
+                                    directories)
+            for matches in listings:
+                files.extend(matches)
 
-            matches = None
-            num_retries = 0
+        if self.shutdown_requested:
+            return []
 
-            logging.info('(%s) Scanning %s' % (browser.server.name, directory))
+        return files
 
-            # Attempt to read directory contents. Retry up to 10 times
-            # if failed and then notify admin
-            while matches is None:
-                if self.shutdown_requested:
-                    return []
+    def _list_directory(self, browser, directory):
+        """Returns the files in a single remote directory"""
+        matches = None
+        num_retries = 0
 
-                try:
-                    matches = browser.get_files(directory, "jp2", browser.server.filter)
+        if self.shutdown_requested:
+            return []
 
-                    files.extend(matches)
-                except NetworkError:
-                    if num_retries >= 3 * 1440:
+        logging.info('(%s) Scanning %s' % (browser.server.name, directory))
+        listed = datetime.datetime.utcnow()
+
+        # Attempt to read directory contents. Retry up to 10 times
+        # if failed and then notify admin
+        while matches is None:
+            if self.shutdown_requested:
+                return []
+
+            try:
+                matches = list(browser.get_files(directory, "jp2", browser.server.filter))
+            except NetworkError:
+                if browser.server.name in self._unreachable_servers:
+                    # Another listing of this server has already given up
+                    return []
+                if num_retries >= 3 * 1440:
+                    # Only the first listing to give up alerts the admins
+                    with self._unreachable_lock:
+                        first = browser.server.name not in self._unreachable_servers
+                        self._unreachable_servers.add(browser.server.name)
+                    if first:
                         logging.error("Unable to reach %s. Shutting down HVPull.",
                                       browser.server.name)
                         msg = "Unable to reach %s. Is the server online?"
                         self.send_email_alert(msg % browser.server.name)
                         self.shutdown()
-                    else:
-                        msg = "Unable to reach %s. Will try again in 60 seconds."
-                        if num_retries > 0:
-                            msg += " (retry %d)" % num_retries
-                        logging.warning(msg, browser.server.name)
-                        time.sleep(60)
-                        num_retries += 1
-
-        return files
+                    return []
+                else:
+                    msg = "Unable to reach %s. Will try again in 60 seconds."
+                    if num_retries > 0:
+                        msg += " (retry %d)" % num_retries
+                    logging.warning(msg, browser.server.name)
+                    time.sleep(60)
+                    num_retries += 1
+
+        if self.watermarks is not None:
+            self._listings.append((browser.server, directory, matches, listed))
+
+        return matches
+
+    def _commit_watermarks(self):
+        """Records the directory listings of the last query in the
+        watermarks and saves them"""
+        for server, directory, files, listed in self._listings:
+            self._update_watermark(server, directory, files, listed)
+        self._listings = []
+        self.watermarks.save()
+
+    def _update_watermark(self, server, directory, files, listed):
+        """Records the newest file seen in a directory"""
+        watermark = None
+        for file in files:
+            try:
+                obs_time = server.get_datetime_from_file(file)
+            except ValueError:
+                continue
+            if watermark is None or obs_time > watermark:
+                watermark = obs_time
+        self.watermarks.update(server.name, directory, watermark, listed)
+
+    def _get_resume_starttime(self):
+        """Returns the time to query from to catch everything that may have
+        arrived since the servers were last read, or None if there are no
+        watermarks to go on"""
+        if self.watermarks is None:
+            return None
+        starttime = self.watermarks.get_starttime([server.name for server in self.servers])
+        if starttime is None:
+            return None
+        return min(starttime, datetime.datetime.utcnow())
 
     def acquire(self, urls):
-        """Acquires all the available files."""
+        """Acquires all the available files.
+
+        Returns True if every file was downloaded and ingested, or False if
+        a failure or a shutdown request stopped it early.
+        """
         # If no new files are available do nothing
         if not urls:
             logging.info("Found no new files.")
-            return
+            return True
 
         n = sum(len(x) for x in urls)
 
@@ -461,28 +623,17 @@ class ImageRetrievalDaemon:
 
         logging.info("Found %d new files", n)
 
-        # Download files
-        while n > 0:
-            finished = []
+        # Hand every file to its server's scheduler, which decides the order
+        # they are downloaded in: newest first, with a share for backfill
+        for i, url_list in enumerate(urls):
+            for url in url_list:
+                counter += 1.
+                self.queues[i].put([self.servers[i].name, (counter / total) * 100, url])
 
-            # Download files 100 at a time to avoid blocking shutdown requests
-            # and to allow images to be added to database sooner
-            for i, server in enumerate(list(urls)):
-                for j in range(100): #pylint: disable=W0612
-                    if len(list(server)) > 0:
-
-                        url = server.pop()
-
-                        finished.append(url)
-
-                        counter += 1.
-
-                        self.queues[i].put([self.servers[i].name, (counter / total) * 100, url])
-
-                        n -= 1
-
-            for q in self.queues:
-                q.join()
+        # Wait for the downloads, waking up regularly to react to failures
+        # and shutdown requests and to ingest the files downloaded so far
+        while True:
+            done = self._wait_for_downloads(__ACQUIRE_POLL_INTERVAL__)
 
             # Check if any downloaders have failed, and quit if they have
             for downloader_threads in self.downloaders:
@@ -494,12 +645,79 @@ class ImageRetrievalDaemon:
                         self.shutdown()
                         break
 
-            if not self.shutdown_requested:
-                self.ingest(finished)
+            # Without the pipeline, files are ingested in batches as they
+            # are downloaded
+            if self.pipeline is None and not self.shutdown_requested:
+                finished = self._take_downloaded(1 if done else __INGEST_BATCH_SIZE__)
+                if finished:
+                    self.ingest(finished)
 
-            if self.shutdown_requested:
+            if done or self.shutdown_requested:
+                break
+
+            if self.pipeline is not None and self.pipeline.has_failed():
                 break
 
+        stats = connectionpool.stats()
+        logging.info("Opened %d connections, reused %d", stats["opened"], stats["reused"])
+        self._report_download_stats()
+
+        # Wait for downloaded files to make it through the pipeline
+        if self.pipeline is not None:
+            self.pipeline.join()
+            if self.pipeline.has_failed():
+                logging.error("Quitting due to ingestion pipeline failure")
+                sys.exit(1)
+
+        return not self.shutdown_requested
+
+    def _wait_for_downloads(self, timeout):
+        """Waits up to timeout seconds for every queued download to finish.
+        Returns True if they all have."""
+        deadline = time.monotonic() + timeout
+        for q in self.queues:
+            if not q.join(max(deadline - time.monotonic(), 0)):
+                return False
+        return True
+
+    def _add_downloaded(self, filepath):
+        """Records a file downloaded by one of the downloaders"""
+        with self._downloaded_lock:
+            self._downloaded.append(filepath)
+
+    def _take_downloaded(self, minimum):
+        """Returns the files downloaded since the last call, or nothing if
+        there are fewer than minimum of them"""
+        with self._downloaded_lock:
+            if len(self._downloaded) < minimum:
+                return []
+            finished, self._downloaded = self._downloaded, []
+        return finished
+
+    def _get_concurrency_range(self, conf, server_name):
+        """Returns the lowest and highest number of simultaneous downloads
+        for a server, set as e.g. JSOC = 1-8 in [concurrency]"""
+        value = conf.get('concurrency', server_name, fallback=None)
+        if value is None:
+            return self.max_downloads, self.max_downloads
+        floor, ceiling = value.split("-")
+        return int(floor), int(ceiling)
+
+    def _report_download_stats(self):
+        """Logs the download rate of each server, and writes it to the
+        stats file if there is one"""
+        stats = {}
+        for controller in self.concurrency:
+            stats[controller.name] = controller.stats()
+            logging.info("(%s) %d downloads at once, %0.3f MB/s", controller.name,
+                         stats[controller.name]["limit"], stats[controller.name]["mbps"])
+
+        if self.stats_file:
+            tmp = self.stats_file + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(stats, f, indent=1, sort_keys=True)
+            os.replace(tmp, self.stats_file)
+
     def ingest(self, urls):
         """
         Add images to helioviewer data db.
@@ -509,153 +727,210 @@ class ImageRetrievalDaemon:
           (4) Ingest
           (5) Update database to say that the file has been successfully
               'ingested'.
+
+        This processes the files one stage at a time and is used when the
+        ingestion pipeline is disabled.
         """
         # Get filepaths
         filepaths = []
         images = []
-        corrupt = []
 
         for url in urls:
             path = os.path.join(self.incoming, os.path.basename(url)) # @TODO: Better path computation
             if os.path.isfile(path):
                 filepaths.append(path)
 
-        # Add to hvpull/Helioviewer.org databases
-        for filepath in filepaths:
-            filename = os.path.basename(filepath)
+        # Parse headers and validate metadata
+        parsed, failures = create_image_data_batch(filepaths, self.parse_workers,
+                                                   fast_metadata=self.fast_metadata,
+                                                   executor=self._parse_pool)
 
-            # Parse header and validate metadata
-            try:
-                try:
-                    image_params = create_image_data(filepath)
-                except:
-                    # Make sure the full exception gets into the log
-                    # so we can debug it.
-                    logging.error(traceback.format_exc())
-                    raise BadImage("HEADER")
-                self._validate(image_params)
-            except BadImage as e:
-                logging.warn("Quarantining invalid image: %s", filename)
-                logging.warn("BadImage found; error message= %s", e.get_message())
-                shutil.move(filepath, os.path.join(self.quarantine, filename))
-                mark_as_corrupt(self._cursor, filename, e.get_message())
-                corrupt.append(filename)
-                continue
+        for filepath, error in failures:
+            # Make sure the full exception gets into the log
+            # so we can debug it.
+            logging.error(error)
+            self._quarantine(filepath, BadImage("HEADER"))
 
-            # If everything looks good, move to archive and add to database
-            # print image_params['date']
-            # The files must be transcoded in order to work with JHelioviewer.
-            # Therefore, any problem with the transcoding process must raise
-            # an error.
-            try:
-                cprecincts = None
-                if image_params['instrument'] == "AIA":
-                    cprecincts = [128,128]
-                transcoded = transcode(self.kdu_transcode, filepath, cprecincts=cprecincts)
-                # Remove old version and replace with transcoded one
-                # OSError
-                os.remove(filepath)
-                logging.info('Removed %s ' % filepath)
-                os.rename(transcoded, filepath)
-                logging.info('Renamed %s to %s' % (transcoded, filepath))
-            except KduTranscodeError as e:
-                logging.error("kdu_transcode: " + e.get_message())
-                logging.error("Quitting due to kdu_transcode error")
-                # Don't continue from here, it's very likely that
-                # there's something else wrong causing the transcode
-                # step to fail that needs to be investigated. Transcoding
-                # is a required step for JHelioviewer to be able to use
-                # the images.
-                sys.exit(1)
-
-            # Move to archive
-            directory = os.path.join(self.image_archive, image_params['storage_path'])
-            dest = os.path.join(directory, filename)
+        for image_params in parsed:
+            if self._validate_image(image_params) is not None:
+                images.append(image_params)
 
-            image_params['filepath'] = dest
+        # If everything looks good, move to archive and add to database
+        try:
+            self._transcode_images(images)
+            for image_params in images:
+                self._archive_image(image_params)
+        except (KduTranscodeError, IOError):
+            sys.exit(1)
 
-            if not os.path.exists(directory):
-                self.create_image_directory(directory)
+        # Add valid images to main Database
+        self._insert_images(images)
 
-            try:
-                shutil.move(filepath, dest)
-            except IOError:
-                logging.error("Unable to move files to destination. Is there "
-                              "enough free space?")
-                # Do not proceed to insert these images into the database if
-                # we were unable to move them to the image archive.
-                sys.exit(1)
+    def _parse_image(self, filepath):
+        """
+        Parses and validates the header of a downloaded image.
 
-            # Add to list to send to main database
-            images.append(image_params)
+        Returns the image parameters, or None if the image is bad, in which
+        case it is quarantined and marked as corrupt.
+        """
+        try:
+            image_params = create_image_data(filepath, self.fast_metadata)
+        except:
+            # Make sure the full exception gets into the log
+            # so we can debug it.
+            logging.error(traceback.format_exc())
+            self._quarantine(filepath, BadImage("HEADER"))
+            return None
 
-        # Add valid images to main Database
-        process_jp2_images(images, self.image_archive, self._db, self._cursor, True, None, self._cursor_v2)
+        return self._validate_image(image_params)
 
-        logging.info("Added %d images to database", len(images))
+    def _validate_image(self, image_params):
+        """
+        Validates the metadata of a parsed image. Returns the image
+        parameters, or None if the image was quarantined.
+        """
+        try:
+            self._validate(image_params)
+        except BadImage as e:
+            self._quarantine(image_params['filepath'], e)
+            return None
+
+        return image_params
+
+    def _quarantine(self, filepath, e):
+        """Moves a bad image to the quarantine and marks it as corrupt"""
+        filename = os.path.basename(filepath)
+
+        logging.warn("Quarantining invalid image: %s", filename)
+        logging.warn("BadImage found; error message= %s", e.get_message())
+        shutil.move(filepath, os.path.join(self.quarantine, filename))
+        with self._db_lock:
+            mark_as_corrupt(self._cursor, filename, e.get_message())
+        self._add_known_file(filename)
+        logging.info("Marked %s as corrupt", filename)
+
+    def _transcode_image(self, image_params):
+        """
+        Transcodes an image in place so that it works with JHelioviewer.
 
-        if len(corrupt) > 0:
-            logging.info("Marked %d images as corrupt", len(corrupt))
+        Any problem with the transcoding process raises a KduTranscodeError.
+        Don't continue from there, it's very likely that there's something
+        else wrong causing the transcode step to fail that needs to be
+        investigated. Transcoding is a required step for JHelioviewer to be
+        able to use the images.
+        """
+        self._transcode_images([image_params])
+        return image_params
 
-    def get_helioviewer_group(self):
+    def _transcode_images(self, images):
         """
-        Returns the linux group id of the group used
-        for managing the helioviewer archive. The group
-        name used is 'helioviewer' if the group does not
-        exist on the system, it will be created.
+        Transcodes a batch of images in place, running up to
+        transcode_workers instances of kdu_transcode at once.
         """
-        group_name = 'helioviewer'
+        jobs = [(image_params['filepath'], self._get_cprecincts(image_params)) for image_params in images]
+        if self.skip_compatible:
+            jobs = [(filepath, cprecincts) for filepath, cprecincts in jobs
+                    if self._needs_transcode(filepath, cprecincts)]
+            if len(jobs) < len(images):
+                logging.info("%d of %d images are already JHelioviewer compatible, skipping transcode",
+                             len(images) - len(jobs), len(images))
+            if not jobs:
+                return
         try:
-            grp.getgrnam(group_name)
-        except KeyError:
-            # create the group if it doesn't exist
-            os.system('groupadd {}'.format(group_name))
+            transcoded = transcode_batch(self.kdu_transcode, jobs, self.transcode_workers)
+        except KduTranscodeError as e:
+            logging.error("kdu_transcode: " + e.get_message())
+            logging.error("Quitting due to kdu_transcode error")
+            raise
+
+        for (filepath, cprecincts), tmp in zip(jobs, transcoded):
+            # Remove old version and replace with transcoded one
+            # OSError
+            os.remove(filepath)
+            logging.info('Removed %s ' % filepath)
+            os.rename(tmp, filepath)
+            logging.info('Renamed %s to %s' % (tmp, filepath))
+
+    def _needs_transcode(self, filepath, cprecincts):
+        """Checks the codestream header of an image to see whether it already
+        has the layout that transcoding would give it"""
+        try:
+            return needs_transcode(read_codestream_info(filepath), cprecincts)
+        except (ValueError, OSError) as e:
+            logging.warning("Unable to read the codestream header of %s: %s", filepath, e)
+            return True
+
+    def _get_cprecincts(self, image_params):
+        """Returns the precinct sizes to transcode an image with"""
+        if image_params['instrument'] == "AIA":
+            return [128,128]
+        return None
+
+    def _archive_image(self, image_params):
+        """
+        Moves a transcoded image into the image archive and updates its
+        filepath to point at the archived file.
+        """
+        filepath = image_params['filepath']
+        filename = os.path.basename(filepath)
 
-        return grp.getgrnam(group_name).gr_gid
+        directory = os.path.join(self.image_archive, image_params['storage_path'])
+        dest = os.path.join(directory, filename)
 
-    def create_image_directory(self, path):
-        """
-        Creates a directory with appropriate permissions
-        for storing images. All parent directories up to
-        and including PATH will be created with group
-        write permissions set.
+        try:
+            self.archive.makedirs(directory)
+        except OSError as e:
+            logging.error("Unable to create the directory '" +
+                          directory + "'. Please ensure that you "
+                          "have the proper permissions and try again.")
+            logging.error(f"Error: {str(e)}")
+            # Do not continue if we don't have a directory to place
+            # the files into. Callers stop HVPull when this happens.
+            raise
 
-        args:
-          path - The full path & name of the directory to be created
-        """
-        if not os.path.exists(path):
-            permissions = stat.S_IRWXU | stat.S_IRWXG | stat.S_IROTH | stat.S_IXOTH
-            user_id = os.getuid()
-            directories = path.split(os.sep)
-            # Traverse the directories to be created so that
-            # group write permissions can be set on each one.
-            fullpath = ""
-            for directory in directories:
-                try:
-                    fullpath += directory + os.sep
-                    # ignore trying to create /root
-                    if fullpath == '/':
-                        continue
-                    # Once the paths to be created are reached,
-                    # create the directories and set appropriate permissions.
-                    if not os.path.exists(fullpath):
-                        os.mkdir(fullpath)
-                        try:
-                            group_id = self.get_helioviewer_group()
-                            os.chown(fullpath, user_id, group_id)
-                            os.chmod(fullpath, mode=permissions)
-                        except Exception as e:
-                            # Not necessarily an error, things ought to still function, but
-                            # admins may have permission to edit these files.
-                            logging.warn(f"Unable to set group permissions on {fullpath}.")
-                except Exception as e:
-                    logging.error("Unable to create the directory '" +
-                                  fullpath + "'. Please ensure that you "
-                                  "have the proper permissions and try again.")
-                    logging.error(f"Error: {str(e)}")
-                    # Do not continue if we don't have a directory to place
-                    # the files into
-                    sys.exit(1)
+        try:
+            self.archive.move(filepath, dest)
+        except IOError:
+            logging.error("Unable to move files to destination. Is there "
+                          "enough free space?")
+            # Do not proceed to insert these images into the database if
+            # we were unable to move them to the image archive.
+            raise
+
+        image_params['filepath'] = dest
+
+        return image_params
+
+    def _insert_images(self, images):
+        """Adds a batch of archived images to the database"""
+        # Make sure the files are on disk before they are in the database
+        self.archive.flush()
+        with self._db_lock:
+            failed = process_jp2_images(images, self.image_archive, self._db, self._cursor, True, None,
+                                        self.v2_writer, self.rows_per_insert, self.datasources)
+
+        # Files which failed to insert are left out of the index so that
+        # they are looked up again on the next query
+        failed = set(image['filepath'] for image in failed)
+        for image in images:
+            if image['filepath'] not in failed:
+                self._add_known_file(os.path.basename(image['filepath']))
+
+        logging.info("Added %d images to database", len(images) - len(failed))
+
+    def _create_pipeline(self, conf):
+        """Creates the pipeline which ingests files as they are downloaded"""
+        stages = [
+            Stage("parse", self._parse_image, self.parse_workers),
+            Stage("transcode", self._transcode_image, self.transcode_workers),
+            Stage("archive", self._archive_image,
+                  conf.getint('pipeline', 'archive_workers', fallback=1)),
+        ]
+        pipeline = IngestPipeline(stages, self._insert_images,
+                                  conf.getint('pipeline', 'insert_batch_size', fallback=100),
+                                  conf.getint('pipeline', 'queue_size', fallback=50))
+        pipeline.start()
+        return pipeline
 
     def send_email_alert(self, message):
         """Sends an email notification to the Helioviewer admin(s) when a
@@ -693,6 +968,16 @@ class ImageRetrievalDaemon:
             for downloader in server:
                 downloader.stop()
 
+        if getattr(self, 'v2_writer', None) is not None:
+            self.v2_writer.close()
+
+        if getattr(self, '_parse_pool', None) is not None:
+            self._parse_pool.shutdown()
+
+    def _connect_v2(self):
+        """Opens a connection to the v2 database"""
+        return get_db_cursor(self.dbhost_v2, self.dbname_v2, self.dbuser_v2, self.dbpass_v2)
+
     def _check_free_space(self):
         """Checks the amount of free space on the data volume and emails admins
         the first time HVPull detects low disk space"""
@@ -716,8 +1001,23 @@ class ImageRetrievalDaemon:
         # Filenames
         files = [[os.path.basename(url) for url in x] for x in urls]
 
+        # Positions of each filename in each list, so copies of a file on
+        # other servers can be found without searching the lists. Names
+        # which appear more than once in a list map to a queue of positions.
+        positions = []
+        for file_list in files:
+            index = {}
+            for j, filename in enumerate(file_list):
+                if filename not in index:
+                    index[filename] = j
+                elif isinstance(index[filename], deque):
+                    index[filename].append(j)
+                else:
+                    index[filename] = deque([index[filename], j])
+            positions.append(index)
+
         # Number of servers and total number of remote files matched
-        m = len(self.servers)
+        m = len(files)
         n = sum(len(x) for x in files)
 
         # Counters to keep track of sub-list iteration
@@ -742,17 +1042,23 @@ class ImageRetrievalDaemon:
                 if value is None:
                     continue
 
-                filename = os.path.basename(value)
-
                 # Ignore file on other servers if it exists
-                for i, file_list in enumerate(files):
-                    if i == idx:
+                for k, index in enumerate(positions):
+                    if k == idx:
                         continue
 
-                    if filename in file_list:
-                        j = files[i].index(filename)
-                        files[i][j] = None
-                        urls[i][j] = None
+                    j = index.get(value)
+                    if j is None:
+                        continue
+                    if isinstance(j, deque):
+                        matches = j
+                        j = matches.popleft()
+                        if not matches:
+                            del index[value]
+                    else:
+                        del index[value]
+                    files[k][j] = None
+                    urls[k][j] = None
 
             counters[idx] += 1
 
@@ -817,11 +1123,23 @@ class ImageRetrievalDaemon:
                                self.get_browsers().get(browse_method))
         return cls(uri)
 
-    def _load_downloader(self, download_method, queue):
+    def _get_downloader_class(self, download_method):
+        """Returns the class of a data downloader"""
+        return self._load_class('helioviewer.hvpull.downloader', download_method,
+                                self.get_downloaders().get(download_method))
+
+    def _load_downloader(self, download_method, queue, max_downloads=1, concurrency=None):
         """Loads a data downloader"""
-        cls = self._load_class('helioviewer.hvpull.downloader', download_method,
-                               self.get_downloaders().get(download_method))
+        cls = self._get_downloader_class(download_method)
         downloader = cls(self.incoming, queue)
+        downloader.max_downloads = max_downloads
+        if concurrency is not None:
+            downloader.set_concurrency(concurrency)
+
+        if self.pipeline is not None:
+            downloader.set_complete_callback(self.pipeline.put)
+        else:
+            downloader.set_complete_callback(self._add_downloaded)
 
         downloader.setDaemon(True)
         downloader.start()
@@ -838,23 +1156,31 @@ class ImageRetrievalDaemon:
         # Instantiate class and return
         return getattr(sys.modules[modname], classname)
 
-    def _filter_new(self, url):
+    def _filter_new(self, urls):
         """For a given list of remote files determines which ones have not
-        yet been acquired."""
-        filename = os.path.basename(url)
+        yet been acquired.
 
-        # Check to see if image is in `data` table
-        self._cursor.execute("SELECT COUNT(*) FROM data WHERE filename='%s'" % filename)
-        if self._cursor.fetchone()[0] != 0:
-            return False
+        Files are first looked up in the known file index. Only the files
+        it doesn't know are checked against the `data` and `corrupt` tables,
+        in chunks rather than with a pair of queries per file.
+        """
+        t1 = time.time()
 
-        # Check to see if image is in `corrupt` table
-        #print('Remove comments characters to reactivate the code beneath when in production!!!')
-        self._cursor.execute("SELECT COUNT(*) FROM corrupt WHERE filename='%s'" % filename)
-        if self._cursor.fetchone()[0] != 0:
-            return False
+        filenames = [os.path.basename(url) for url in urls]
+        unknown = [(url, filename) for url, filename in zip(urls, filenames)
+                   if filename not in self.known_files]
 
-        return True
+        known = get_known_filenames(self._cursor, [filename for url, filename in unknown])
+        self.known_files.update((filename, self._get_datetime_from_file(url))
+                                for url, filename in unknown if filename in known)
+
+        new_urls = [url for url, filename in unknown if filename not in known]
+
+        t2 = time.time()
+        logging.info("Checked %d files against the database in %0.3fs (%d unknown, %d new)",
+                     len(urls), t2 - t1, len(unknown), len(new_urls))
+
+        return new_urls
 
     @classmethod
     def get_servers(cls):
@@ -899,6 +1225,7 @@ class ImageRetrievalDaemon:
         """Returns a list of valid data downloaders to interact with"""
         return {
             "urllib": "URLLibDownloader",
+            "aiohttp": "AIOHTTPDownloader",
             "localmove": "LocalFileMove"
         }
 
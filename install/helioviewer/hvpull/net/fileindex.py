@@ -0,0 +1,51 @@
+"""In-memory index of files which are known to the Helioviewer database"""
+import threading
+
+
+class KnownFileIndex:
+    """Tracks the names of files that have already been ingested or marked as
+    corrupt, along with their observation times.
+
+    HVPull re-queries an overlapping time window on every pass, so the same
+    files are seen over and over again. Keeping them in memory means the
+    database only needs to be consulted for files the index doesn't know.
+    Entries are evicted by observation time once they fall out of the
+    query window.
+    """
+    def __init__(self):
+        self.seeded = False
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, filename):
+        return filename in self._files
+
+    def __len__(self):
+        return len(self._files)
+
+    def add(self, filename, obs_time):
+        """Adds a file to the index"""
+        with self._lock:
+            self._files[filename] = obs_time
+
+    def update(self, files):
+        """Adds an iterable of (filename, obs_time) pairs to the index"""
+        with self._lock:
+            self._files.update(files)
+
+    def seed(self, files):
+        """Populates the index with the files known to the database for the
+        active query window"""
+        self.update(files)
+        self.seeded = True
+
+    def evict_before(self, time):
+        """Removes all files observed before the given time.
+
+        Returns the number of files removed from the index.
+        """
+        with self._lock:
+            expired = [f for f, obs_time in self._files.items() if obs_time < time]
+            for filename in expired:
+                del self._files[filename]
+        return len(expired)
@@ -0,0 +1,159 @@
+"""Time window and cadence filtering of the files found on a server
+
+Every file found by a query is checked against the query's time window, and
+files from high volume instruments may then be subsampled. Both steps work
+on NumPy arrays of observation times so that long lists of files are
+filtered without a Python loop per instrument.
+
+Rules are set per server in the [processing_delay] and [stride] sections of
+settings.cfg. Each option is a server name, and its value is a list of
+instrument:value pairs, e.g.
+
+    [processing_delay]
+    LMSAL = hmi:240
+
+    [stride]
+    LMSAL2 = aia:20, hmi:20
+
+Instruments are matched against the lower-cased file URL.
+"""
+import datetime
+import logging
+import numpy as np
+
+# Minutes that instruments lag real time on the SDO servers
+DEFAULT_PROCESSING_DELAYS = {
+    "LMSAL": "hmi:240",
+    "LMSAL2": "hmi:240",
+    "JSOC": "hmi:240",
+}
+
+# Cadence reduction for the SDO server which only serves a sample of the data
+DEFAULT_STRIDES = {
+    "LMSAL2": "aia:20, hmi:20",
+}
+
+
+class QueryFilter:
+    """Filters the files found on one server
+
+    Parameters
+    ----------
+    server : str
+        Name of the server, used when reporting counts
+    delays : dict
+        Processing delay (datetime.timedelta) of each instrument which lags
+        behind real time. Files from these instruments are also accepted
+        from the query window shifted back by the delay.
+    strides : dict
+        For each instrument which should be subsampled, keep one file in
+        every this many
+    """
+    def __init__(self, server, delays=None, strides=None):
+        self.server = server
+        self.delays = delays or {}
+        self.strides = strides or {}
+        self.instruments = list(self.delays)
+        self.instruments += [i for i in self.strides if i not in self.delays]
+
+    @classmethod
+    def from_config(cls, conf, server):
+        """Reads the rules for a server from the configuration"""
+        delays = _parse_rules(conf.get('processing_delay', server,
+                                       fallback=DEFAULT_PROCESSING_DELAYS.get(server, '')))
+        strides = _parse_rules(conf.get('stride', server,
+                                        fallback=DEFAULT_STRIDES.get(server, '')))
+        return cls(server,
+                   {instrument: datetime.timedelta(minutes=m) for instrument, m in delays.items()},
+                   strides)
+
+    @property
+    def max_delay(self):
+        """The longest processing delay of any instrument"""
+        return max(self.delays.values(), default=datetime.timedelta(0))
+
+    def classify(self, urls):
+        """Returns the index into self.instruments of each file's
+        instrument, or -1 for files from other instruments"""
+        index = np.full(len(urls), -1, dtype=np.int64)
+        if not self.instruments or not urls:
+            return index
+        lowered = np.char.lower(np.array(urls, dtype=str))
+        for i, instrument in reversed(list(enumerate(self.instruments))):
+            index[np.char.find(lowered, instrument) >= 0] = i
+        return index
+
+    def apply(self, urls, times, starttime, endtime, filter_new=None):
+        """Returns the files which should be downloaded, in their original
+        order.
+
+        Parameters
+        ----------
+        urls : list
+            Files found on the server
+        times : list
+            Observation time of each file
+        starttime, endtime : datetime.datetime
+            Query window
+        filter_new : callable
+            Given the files inside the window, returns those which haven't
+            already been ingested. Only these are subsampled.
+        """
+        instruments = self.classify(urls)
+        t = np.array(times, dtype='datetime64[us]')
+        start = np.datetime64(starttime, 'us')
+        end = np.datetime64(endtime, 'us')
+
+        # Time window, widened for instruments which lag real time
+        mask = (t > start) & (t < end)
+        for i, instrument in enumerate(self.instruments):
+            delay = self.delays.get(instrument)
+            if delay:
+                d = np.timedelta64(delay, 'us')
+                mask |= (instruments == i) & (t > start - d) & (t < end - d)
+
+        if filter_new is not None:
+            new = set(filter_new([urls[i] for i in np.flatnonzero(mask)]))
+            mask &= np.fromiter((url in new for url in urls), dtype=bool, count=len(urls))
+
+        # Take every stride'th file in each subsampled instrument's
+        # (delayed) window. Files outside it are dropped.
+        keep = mask.copy()
+        for i, instrument in enumerate(self.instruments):
+            stride = self.strides.get(instrument)
+            if not stride:
+                continue
+            d = np.timedelta64(self.delays.get(instrument, datetime.timedelta(0)), 'us')
+            selected = mask & (instruments == i)
+            keep[selected] = False
+            in_window = np.flatnonzero(selected & (t >= start - d) & (t <= end - d))
+            keep[in_window[::stride]] = True
+
+        self._report(instruments, mask, keep)
+        return [urls[i] for i in np.flatnonzero(keep)]
+
+    def _report(self, instruments, mask, keep):
+        """Logs the number of new files from each instrument"""
+        for i, instrument in enumerate(self.instruments):
+            selected = instruments == i
+            n = int(np.count_nonzero(selected & mask))
+            if instrument in self.strides:
+                logging.info("(%s) %s: %d new files, %d kept with stride %d", self.server,
+                             instrument, n, int(np.count_nonzero(selected & keep)),
+                             self.strides[instrument])
+            else:
+                logging.info("(%s) %s: %d new files", self.server, instrument, n)
+        if self.instruments:
+            n = int(np.count_nonzero((instruments == -1) & mask))
+            logging.info("(%s) other instruments: %d new files", self.server, n)
+
+
+def _parse_rules(value):
+    """Parses 'instrument:number, ...' into a dict"""
+    rules = {}
+    for rule in value.split(","):
+        if not rule.strip():
+            continue
+        instrument, number = rule.split(":")
+        rules[instrument.strip().lower()] = int(number)
+    return rules
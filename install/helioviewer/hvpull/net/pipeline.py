@@ -0,0 +1,135 @@
+"""Staged ingestion pipeline for HVPull
+
+Downloaded files flow through a series of stages (e.g. header parsing,
+transcoding, archiving) as soon as they arrive, rather than waiting for a
+whole batch of downloads to finish. Each stage has its own pool of worker
+threads and a bounded input queue, so a slow stage applies backpressure to
+the stages in front of it. The final stage collects items into batches.
+"""
+import logging
+import queue
+import threading
+import time
+import traceback
+
+# Sentinel placed on the sink queue to force the current batch to be written
+_FLUSH = object()
+
+
+class Stage:
+    """A single pipeline stage.
+
+    func is called with each item from the stage's input queue and returns
+    the item to pass on to the next stage, or None to drop it.
+    """
+    def __init__(self, name, func, workers=1):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.processed = 0
+        self.busy_time = 0.0
+
+
+class IngestPipeline:
+    """Runs items through a list of stages followed by a batched sink.
+
+    Parameters
+    ----------
+    stages : list
+        Stage instances, in the order items should flow through them
+    sink : function
+        Called with a list of items which made it through every stage
+    batch_size : int
+        Maximum number of items to pass to the sink at once
+    queue_size : int
+        Maximum number of items waiting in front of each stage
+    """
+    def __init__(self, stages, sink, batch_size=100, queue_size=50):
+        self.stages = stages
+        self.sink = sink
+        self.batch_size = batch_size
+        self._failed = False
+        self._lock = threading.Lock()
+
+        self._queues = [queue.Queue(maxsize=queue_size) for stage in stages]
+        self._sink_queue = queue.Queue(maxsize=queue_size)
+        self._batch = []
+
+    def start(self):
+        """Starts the worker threads for each stage"""
+        outputs = self._queues[1:] + [self._sink_queue]
+        for stage, input_queue, output_queue in zip(self.stages, self._queues, outputs):
+            for i in range(stage.workers):
+                worker = threading.Thread(target=self._run_stage,
+                                          args=(stage, input_queue, output_queue),
+                                          name="%s-%d" % (stage.name, i))
+                worker.daemon = True
+                worker.start()
+
+        worker = threading.Thread(target=self._run_sink, name="sink")
+        worker.daemon = True
+        worker.start()
+
+    def put(self, item):
+        """Adds an item to the pipeline. Blocks while the first stage is full."""
+        self._queues[0].put(item)
+
+    def join(self):
+        """Blocks until every item added to the pipeline has been processed
+        and the final partial batch has been passed to the sink."""
+        for stage_queue in self._queues:
+            stage_queue.join()
+        self._sink_queue.put(_FLUSH)
+        self._sink_queue.join()
+
+        for stage in self.stages:
+            if stage.processed > 0:
+                logging.info("(%s) processed %d files (%0.3fs per file)", stage.name,
+                             stage.processed, stage.busy_time / stage.processed)
+
+    def has_failed(self):
+        """Returns True if any stage raised an exception"""
+        return self._failed
+
+    def _fail(self, name):
+        logging.error("Ingestion pipeline stage '%s' failed", name)
+        logging.error(traceback.format_exc())
+        self._failed = True
+
+    def _run_stage(self, stage, input_queue, output_queue):
+        while True:
+            item = input_queue.get()
+            # After a failure keep draining the queues so that nothing
+            # upstream blocks, but stop doing any work.
+            if not self._failed:
+                try:
+                    t1 = time.time()
+                    result = stage.func(item)
+                    t2 = time.time()
+
+                    with self._lock:
+                        stage.processed += 1
+                        stage.busy_time += t2 - t1
+
+                    if result is not None:
+                        output_queue.put(result)
+                except BaseException:
+                    # Includes SystemExit, so that a stage which tries to quit
+                    # still lets join() return and report the failure
+                    self._fail(stage.name)
+            input_queue.task_done()
+
+    def _run_sink(self):
+        while True:
+            item = self._sink_queue.get()
+            if item is not _FLUSH:
+                self._batch.append(item)
+            if (item is _FLUSH or len(self._batch) >= self.batch_size) and len(self._batch) > 0:
+                batch = self._batch
+                self._batch = []
+                if not self._failed:
+                    try:
+                        self.sink(batch)
+                    except BaseException:
+                        self._fail("sink")
+            self._sink_queue.task_done()
@@ -0,0 +1,114 @@
+"""Priority queue for file downloads"""
+import datetime
+import heapq
+import itertools
+import queue
+import time
+
+
+class DownloadScheduler(queue.Queue):
+    """Queue of [server, percent, url] download items which hands out the
+    most recently observed files first.
+
+    Files observed within recent_window of now are recent, everything else
+    is backfill. Recent files always go before backfill, except that while
+    both are waiting backfill is given backfill_share of the downloads, and
+    a backfill file which has waited longer than max_wait goes next. This
+    keeps the newest data flowing without starving old gaps.
+
+    The queue can be used anywhere a queue.Queue is, e.g. by the
+    downloaders, which requeue failed items with put().
+
+    Parameters
+    ----------
+    get_time : callable
+        Returns the observation time of a URL, or raises ValueError
+    recent_window : datetime.timedelta
+        How old a file can be and still count as recent
+    backfill_share : float
+        Fraction of downloads given to backfill while recent files wait
+    max_wait : float
+        Seconds a backfill file waits before it is moved to the front
+    """
+    def __init__(self, get_time, recent_window=datetime.timedelta(hours=6),
+                 backfill_share=0.2, max_wait=3600):
+        self.get_time = get_time
+        self.recent_window = recent_window
+        self.backfill_share = min(max(backfill_share, 0.0), 0.99)
+        self.max_wait = max_wait
+        queue.Queue.__init__(self)
+
+    def join(self, timeout=None):
+        """Blocks until every item put in the queue has been processed, or
+        for at most timeout seconds. Returns True if they all have been."""
+        with self.all_tasks_done:
+            return self.all_tasks_done.wait_for(lambda: not self.unfinished_tasks, timeout)
+
+    def _init(self, maxsize):
+        self._counter = itertools.count()
+        self._recent = []
+        # Backfill entries are [priority, count, enqueued, item] lists in
+        # both a priority heap and a FIFO for aging. Entries taken from one
+        # are marked by clearing their item and skipped in the other.
+        self._backfill = []
+        self._backfill_fifo = []
+        self._backfill_size = 0
+        self._credit = 0.0
+
+    def _qsize(self):
+        return len(self._recent) + self._backfill_size
+
+    def _put(self, item):
+        try:
+            obs_time = self.get_time(item[2])
+        except ValueError:
+            obs_time = datetime.datetime.min
+        priority = -(obs_time - datetime.datetime.min).total_seconds()
+        count = next(self._counter)
+
+        if obs_time >= datetime.datetime.utcnow() - self.recent_window:
+            heapq.heappush(self._recent, (priority, count, item))
+        else:
+            entry = [priority, count, time.monotonic(), item]
+            heapq.heappush(self._backfill, entry)
+            heapq.heappush(self._backfill_fifo, (count, entry))
+            self._backfill_size += 1
+
+    def _get(self):
+        if not self._backfill_size:
+            return heapq.heappop(self._recent)[2]
+
+        # Aged backfill goes first
+        oldest = self._peek_fifo()
+        if time.monotonic() - oldest[2] >= self.max_wait:
+            return self._take(oldest)
+
+        if not self._recent:
+            return self._take(self._pop_backfill())
+
+        # Backfill earns credit for each recent file handed out
+        if self._credit >= 1:
+            self._credit -= 1
+            return self._take(self._pop_backfill())
+        self._credit += self.backfill_share / (1 - self.backfill_share)
+        return heapq.heappop(self._recent)[2]
+
+    def _peek_fifo(self):
+        while self._backfill_fifo[0][1][3] is None:
+            heapq.heappop(self._backfill_fifo)
+        return self._backfill_fifo[0][1]
+
+    def _pop_backfill(self):
+        while True:
+            entry = heapq.heappop(self._backfill)
+            if entry[3] is not None:
+                return entry
+
+    def _take(self, entry):
+        item, entry[3] = entry[3], None
+        self._backfill_size -= 1
+        if not self._backfill_size:
+            # Drop the entries already taken through the other heap
+            self._backfill = []
+            self._backfill_fifo = []
+        return item
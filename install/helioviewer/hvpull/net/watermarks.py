@@ -0,0 +1,136 @@
+"""Persistent record of how far HVPull has read each remote directory"""
+import os
+import json
+import datetime
+import threading
+from helioviewer.hvpull.servers import get_date_from_directory
+
+# Format used for times in the state file
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+class WatermarkStore:
+    """Tracks the newest observation time seen on each server and in each of
+    its directories, along with when each directory was last listed.
+
+    HVPull uses these to restart polling from where it left off, and to skip
+    date directories which were already listed after they could last have
+    changed. Late arrivals are allowed for by a lookback: files are expected
+    to appear on the server within lookback of their observation time.
+
+    Parameters
+    ----------
+    path : str
+        State file the watermarks are loaded from and saved to
+    lookback : datetime.timedelta
+        How long after their observation time files may still appear
+    """
+    def __init__(self, path, lookback):
+        self.path = path
+        self.lookback = lookback
+        self._servers = {}
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Reads the watermarks saved by a previous run, if any"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            state = json.load(f)
+
+        servers = {}
+        for name, server in state.get("servers", {}).items():
+            directories = {}
+            for directory, entry in server.get("directories", {}).items():
+                directories[directory] = (_parse(entry["watermark"]), _parse(entry["listed"]))
+            servers[name] = {"watermark": _parse(server["watermark"]),
+                             "directories": directories}
+        with self._lock:
+            self._servers = servers
+
+    def save(self):
+        """Writes the watermarks to the state file"""
+        with self._lock:
+            state = {"servers": {}}
+            for name, server in self._servers.items():
+                directories = {}
+                for directory, (watermark, listed) in server["directories"].items():
+                    directories[directory] = {"watermark": _format(watermark),
+                                              "listed": _format(listed)}
+                state["servers"][name] = {"watermark": _format(server["watermark"]),
+                                          "directories": directories}
+
+        # Write to a temporary file first so a crash can't leave the state
+        # file half written
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+
+    def update(self, server, directory, watermark, listed):
+        """Records a listing of a directory. watermark is the newest
+        observation time of the files in it, or None if it was empty."""
+        with self._lock:
+            entry = self._servers.setdefault(server, {"watermark": None, "directories": {}})
+            previous = entry["directories"].get(directory, (None, None))[0]
+            if previous is not None and (watermark is None or watermark < previous):
+                watermark = previous
+            entry["directories"][directory] = (watermark, listed)
+            if watermark is not None and (entry["watermark"] is None or watermark > entry["watermark"]):
+                entry["watermark"] = watermark
+
+    def get_starttime(self, servers):
+        """Returns the time polling should start from to pick up every file
+        the given servers may have received since they were last read, or
+        None if any of them hasn't been read yet"""
+        with self._lock:
+            watermarks = [self._servers.get(server, {}).get("watermark") for server in servers]
+        if not watermarks or None in watermarks:
+            return None
+        return min(watermarks) - self.lookback
+
+    def is_complete(self, server, directory, delay=datetime.timedelta(0)):
+        """Returns True if a date directory was last listed after every file
+        for its date should have appeared on the server. delay is the
+        longest processing delay of the instruments on the server, which
+        files may take to appear on top of the lookback."""
+        day_end = _get_day_end(directory, None)
+        if day_end is None:
+            return False
+        with self._lock:
+            entry = self._servers.get(server, {}).get("directories", {}).get(directory)
+        if entry is None:
+            return False
+        return entry[1] >= day_end + self.lookback + delay
+
+    def evict_before(self, time):
+        """Forgets directories which can only hold files observed before
+        the given time, and any others not listed since then.
+
+        Returns the number of directories removed.
+        """
+        n = 0
+        with self._lock:
+            for server in self._servers.values():
+                expired = [d for d, (watermark, listed) in server["directories"].items()
+                           if _get_day_end(d, listed) < time]
+                for directory in expired:
+                    del server["directories"][directory]
+                n += len(expired)
+        return n
+
+
+def _get_day_end(directory, default):
+    """Returns the end of the day a date directory holds files for"""
+    date = get_date_from_directory(directory)
+    if date is None:
+        return default
+    return datetime.datetime.combine(date + datetime.timedelta(days=1), datetime.time())
+
+
+def _parse(value):
+    return None if value is None else datetime.datetime.strptime(value, TIME_FORMAT)
+
+
+def _format(value):
+    return None if value is None else value.strftime(TIME_FORMAT)
@@ -4,33 +4,64 @@ import re
 import datetime
 
 
+def parse_underscored_datetime(s):
+    """Parses YYYY_MM_DD__HH_MM_SS"""
+    return datetime.datetime(int(s[0:4]), int(s[5:7]), int(s[8:10]),
+                             int(s[12:14]), int(s[15:17]), int(s[18:20]))
+
+
+def parse_compact_datetime(s):
+    """Parses YYYYMMDDHHMMSS, optionally with one separator before the
+    time (e.g. YYYYMMDDTHHMMSS)"""
+    return datetime.datetime(int(s[0:4]), int(s[4:6]), int(s[6:8]),
+                             int(s[-6:-4]), int(s[-4:-2]), int(s[-2:]))
+
+
+# Date formats found in filenames, in the order they are tried
+DATETIME_PATTERNS = [
+    (re.compile(r'\d{4}_\d{2}_\d{2}__\d{2}_\d{2}_\d{2}'), parse_underscored_datetime),
+    (re.compile(r'\d{8}T\d{6}'), parse_compact_datetime),
+    (re.compile(r'\d{14}'), parse_compact_datetime),
+]
+
+
 def get_datetime_from_file(filename):
     """Extract datetime from filename using regex matching for date formats '%Y_%m_%d__%H_%M_%S', '%Y%m%dT%H%M%S', or '%Y%m%d%H%M%S'"""
     url_filename = os.path.basename(filename)
 
-    # Try format: YYYY_MM_DD__HH_MM_SS
-    match = re.search(r'(\d{4}_\d{2}_\d{2}__\d{2}_\d{2}_\d{2})', url_filename)
-    if match:
-        url_datetime = match.group(1)
-        return datetime.datetime.strptime(url_datetime, '%Y_%m_%d__%H_%M_%S')
-
-    # Try format: YYYYMMDDTHHMMSS
-    match = re.search(r'(\d{8}T\d{6})', url_filename)
+    # Most files are named by Helioviewer and start with the date, e.g.
+    # 2011_11_17__08_13_08_13__SDO_AIA_AIA_304.jp2, so check the start of
+    # the name before searching all of it
+    pattern, parse = DATETIME_PATTERNS[0]
+    match = pattern.match(url_filename)
     if match:
-        url_datetime = match.group(1)
-        return datetime.datetime.strptime(url_datetime, '%Y%m%dT%H%M%S')
+        return parse(match.group())
 
-    # Try format: YYYYMMDDHHMMSS
-    match = re.search(r'(\d{14})', url_filename)
-    if match:
-        url_datetime = match.group(1)
-        return datetime.datetime.strptime(url_datetime, '%Y%m%d%H%M%S')
+    for pattern, parse in DATETIME_PATTERNS:
+        match = pattern.search(url_filename)
+        if match:
+            return parse(match.group())
 
     raise ValueError(f"No valid datetime format found in filename: {filename}")
 
 
+def get_date_from_directory(directory):
+    """Returns the date of a date directory such as .../2011/11/17/..., or
+    None if the path doesn't contain a date"""
+    match = re.search(r'/(\d{4})/(\d{2})/(\d{2})(?:/|$)', directory)
+    if match is None:
+        return None
+    try:
+        return datetime.date(*map(int, match.groups()))
+    except ValueError:
+        return None
+
+
 class DataServer:
     """Class for interacting with data servers."""
+    # Maximum number of directory listings to request from this server at once
+    max_connections = 4
+
     def __init__(self, uri, name, pause=3):
         self.uri = uri
         self.name = name
@@ -0,0 +1,40 @@
+import datetime
+from unittest.mock import patch
+import pytest
+from .. import get_datetime_from_file
+from ..iris import IRISDataServer
+from ..punch import PUNCHDataServer
+from ..solar_orbiter import SolarOrbiterDataServer
+from helioviewer.hvpull.servers import DataServer
+
+@pytest.mark.parametrize("filename, expected", [
+    ("http://example.com/2011_11_17__08_13_08_13__SDO_AIA_AIA_304.jp2", (2011, 11, 17, 8, 13, 8)),
+    ("kcor_2024_03_01__19_02_15__MLSO_KCOR_KCOR_735.jp2", (2024, 3, 1, 19, 2, 15)),
+    ("solo_L3_eui-fsi304-image_20230405T101530123_V01.jp2", (2023, 4, 5, 10, 15, 30)),
+    ("PUNCH_L3_CAM_20250101123456_v1.jp2", (2025, 1, 1, 12, 34, 56)),
+])
+def test_get_datetime_from_file(filename, expected):
+    assert get_datetime_from_file(filename) == datetime.datetime(*expected)
+
+def test_get_datetime_from_file_rejects_bad_dates():
+    with pytest.raises(ValueError):
+        get_datetime_from_file("2011_13_17__08_13_08_13__SDO_AIA_AIA_304.jp2")
+    with pytest.raises(ValueError):
+        get_datetime_from_file("README.txt")
+
+def test_server_specific_formats():
+    assert (IRISDataServer().get_datetime_from_file("iris_l2_sji20231231_235959_SJI_1400.jp2") ==
+            datetime.datetime(2023, 12, 31, 23, 59, 59))
+    assert (PUNCHDataServer().get_datetime_from_file("PUNCH_L3_CAM_20250101123456_v1.jp2") ==
+            datetime.datetime(2025, 1, 1, 12, 34, 56))
+    assert (SolarOrbiterDataServer().get_datetime_from_file("solo_L3_eui-fsi304-image_20230405T101530123_V01.jp2") ==
+            datetime.datetime(2023, 4, 5, 10, 15, 30))
+
+def test_filenames_are_parsed_once_per_query(make_daemon):
+    daemon = make_daemon()
+    files = ["2011_11_17__08_13_%02d_13__SDO_AIA_AIA_304.jp2" % i for i in range(3)]
+
+    with patch.object(DataServer, "get_datetime_from_file", wraps=daemon.servers[0].get_datetime_from_file) as parse:
+        daemon._get_file_times(files)
+        assert daemon._get_oldest_image(files) == datetime.datetime(2011, 11, 17, 8, 13)
+        assert parse.call_count == 3
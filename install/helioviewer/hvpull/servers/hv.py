@@ -1,6 +1,7 @@
 import os
 import re
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from helioviewer.hvpull.servers import DataServer
 
 class HvDataServer(DataServer):
@@ -11,40 +12,50 @@ class HvDataServer(DataServer):
 
     def compute_directories(self, start_date, end_date):
         """Computes a list of remote directories expected to contain files"""
-        dirs = []
-
         # Start with date directories
-        for date in self.get_dates(start_date, end_date):
-            date_url = os.path.join(self.uri, date)
-            # Recursively enumerate subdirectories starting from date URL
-            dirs.extend(self._enumerate_subdirectories(date_url))
+        date_urls = [os.path.join(self.uri, date) for date in self.get_dates(start_date, end_date)]
 
-        return dirs
+        # Recursively enumerate subdirectories starting from date URLs
+        return self._enumerate_subdirectories(date_urls)
 
-    def _enumerate_subdirectories(self, url):
-        """Recursively enumerate subdirectories by querying the URL"""
-        try:
-            response = requests.get(url)
-            response.raise_for_status()
+    def _enumerate_subdirectories(self, urls):
+        """Recursively enumerate the leaf subdirectories of the given URLs.
 
-            # Extract subdirectory links from HTML
-            subdirs = self._parse_directory_links(response.content.decode('utf-8'))
+        The tree is walked one level at a time so that all directories on
+        the same level are queried concurrently, up to max_connections at
+        once. Leaf directories are returned in depth-first order.
+        """
+        children = {}
 
-            if not subdirs:
+        with ThreadPoolExecutor(max_workers=self.max_connections) as executor:
+            level = urls
+            while level:
+                next_level = []
+                for url, subdirs in zip(level, executor.map(self._get_subdirectories, level)):
+                    children[url] = [f"{url}/{subdir}" for subdir in subdirs]
+                    next_level.extend(children[url])
+                level = next_level
+
+        def leaves(url):
+            if not children[url]:
                 # No subdirectories found, this is a leaf directory
                 return [url]
+            return [leaf for child in children[url] for leaf in leaves(child)]
+
+        return [leaf for url in urls for leaf in leaves(url)]
 
-            # Recursively enumerate each subdirectory
-            all_dirs = []
-            for subdir in subdirs:
-                subdir_url = f"{url}/{subdir}"
-                all_dirs.extend(self._enumerate_subdirectories(subdir_url))
+    def _get_subdirectories(self, url):
+        """Returns the names of the subdirectories found at the given URL"""
+        try:
+            response = requests.get(url)
+            response.raise_for_status()
 
-            return all_dirs
+            # Extract subdirectory links from HTML
+            return self._parse_directory_links(response.content.decode('utf-8'))
 
         except requests.RequestException:
-            # If we can't query the URL, return it as a leaf directory
-            return [url]
+            # If we can't query the URL, treat it as a leaf directory
+            return []
 
     def _parse_directory_links(self, html):
         """Parse HTML content and extract directory links"""
@@ -3,7 +3,7 @@ import os
 import re
 import requests
 from datetime import datetime, timedelta
-from helioviewer.hvpull.servers import DataServer
+from helioviewer.hvpull.servers import DataServer, parse_compact_datetime
 
 class IrisFolder:
     def __init__(self, folder: str, timestamp: datetime):
@@ -45,7 +45,7 @@ class IRISDataServer(DataServer):
     def get_datetime_from_file(self, filename):
         url_filename = os.path.basename(filename)
         url_datetime = url_filename[11:26]
-        return datetime.strptime(url_datetime, '%Y%m%d_%H%M%S')
+        return parse_compact_datetime(url_datetime)
 
     def get_starttime(self):
         """Default start time to use when retrieving data"""
@@ -1,5 +1,5 @@
 """PUNCH DataServer"""
-from helioviewer.hvpull.servers import DataServer
+from helioviewer.hvpull.servers import DataServer, parse_compact_datetime
 from itertools import product,starmap
 import datetime
 import os
@@ -23,4 +23,4 @@ class PUNCHDataServer(DataServer):
     def get_datetime_from_file(self, filename):
         fname = os.path.basename(filename)
         datestr = fname[13:27]
-        return datetime.datetime.strptime(datestr, '%Y%m%d%H%M%S')
+        return parse_compact_datetime(datestr)
@@ -1,6 +1,5 @@
 import os
-import datetime
-from helioviewer.hvpull.servers import DataServer
+from helioviewer.hvpull.servers import DataServer, parse_compact_datetime
 
 class SolarOrbiterDataServer(DataServer):
     """SolarOrbiter Datasource definition"""
@@ -20,5 +19,5 @@ class SolarOrbiterDataServer(DataServer):
     def get_datetime_from_file(self, filename):
         url_filename = os.path.basename(filename)
         url_datetime = url_filename[-26:-11]
-        return datetime.datetime.strptime(url_datetime, '%Y%m%dT%H%M%S')
+        return parse_compact_datetime(url_datetime)
 
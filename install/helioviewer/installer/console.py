@@ -23,26 +23,25 @@ class HelioviewerConsoleInstaller:
 
         print("Processing Images...")
 
+        # The datasources table is only read once for all of the images
+        resolver = DatasourceResolver()
+
         # Extract image parameters, 10,000 at a time
         while len(filepaths) > 0:
             subset = filepaths[:10000]
             filepaths = filepaths[10000:]
 
-            images = []
+            # Headers are parsed across a pool of worker processes
+            images, failures = create_image_data_batch(subset)
 
-            for filepath in subset:
-                try:
-                    image = create_image_data(filepath)
-                    images.append(image)
-                except:
-                    #raise BadImage("HEADER")
-                    print("Skipping corrupt image: %s" % os.path.basename(filepath))
-                    print(sys.exc_info())
-                    continue
+            for filepath, error in failures:
+                #raise BadImage("HEADER")
+                print("Skipping corrupt image: %s" % os.path.basename(filepath))
+                print(error)
 
             # Insert image information into database
             if len(images) > 0:
-                process_jp2_images(images, path, db, cursor, mysql)
+                process_jp2_images(images, path, db, cursor, mysql, resolver=resolver)
 
             # clean up afterwards
             images = []
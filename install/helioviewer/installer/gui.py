@@ -123,6 +123,9 @@ If this is correct, please press "Start" to begin processing.
 
         db, cursor = setup_database_schema(admin, adminpass, "localhost",  hvdb, hvuser, hvpass, mysql)
         
+        # The datasources table is only read once for all of the images
+        resolver = DatasourceResolver()
+
         # Extract image parameters, 10,000 at a time
         while len(self.filepaths) > 0:
             subset = self.filepaths[:10000]
@@ -143,7 +146,8 @@ If this is correct, please press "Start" to begin processing.
             
             # Insert image information into database
             if len(images) > 0:
-                process_jp2_images(images, jp2dir, db, cursor, mysql, self.update_progress)
+                process_jp2_images(images, jp2dir, db, cursor, mysql, self.update_progress,
+                                   resolver=resolver)
                 
             # clean up afterwards
             images = []
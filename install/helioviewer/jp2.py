@@ -2,7 +2,15 @@
 """Helioviewer.org JPEG 2000 processing functions"""
 import os
 import sys
-from helioviewer.db import get_datasources, enable_datasource
+import json
+import time
+import logging
+import threading
+import traceback
+import multiprocessing
+from functools import partial
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from helioviewer.db import DatasourceResolver, getImageGroup
 from helioviewer.jp2parser import JP2parser
 
 class KduTranscodeError(RuntimeError):
@@ -15,18 +23,83 @@ class KduTranscodeError(RuntimeError):
 
 __INSERTS_PER_QUERY__ = 500
 __STEP_FXN_THROTTLE__ = 50
+__PARSE_CHUNKSIZE__ = 50
+# Maximum number of spooled v2 rows inserted at a time
+__SPOOL_REPLAY_ROWS__ = 10000
 
-def create_image_data(filepath):
+__DATA_INSERT_QUERY__ = ("INSERT IGNORE INTO data VALUES (NULL, %s, %s, %s, NULL, %s, " +
+                         ", ".join(["%s"] * 18) + ", 1, %s, %s, %s)")
+__IMAGES_INSERT_QUERY__ = "INSERT IGNORE INTO images VALUES (NULL, %s, %s, %s, %s)"
+
+def create_image_data(filepath, fast_metadata=False):
     """Create data object of JPEG 2000 image.
 
     Get image observatory, instrument, detector, measurement, date from image
     metadata and create an object.
     """
-    JP2data = JP2parser(filepath)
+    JP2data = JP2parser(filepath, fast_metadata)
     image = JP2data.getData()
 
     return image
 
+def _try_create_image_data(filepath, fast_metadata=False):
+    """Runs create_image_data in a worker process, returning any error as a
+    string so that one bad file doesn't abort the rest of the batch."""
+    try:
+        return filepath, create_image_data(filepath, fast_metadata), None
+    except Exception:
+        return filepath, None, traceback.format_exc()
+
+def create_parse_pool(workers=None):
+    """Creates a pool of processes for create_image_data_batch.
+
+    The workers are started by a fork server rather than forked from the
+    caller, so locks held by the caller's other threads (downloads, database
+    writers) are never copied into them.
+    """
+    return ProcessPoolExecutor(max_workers=workers,
+                               mp_context=multiprocessing.get_context("forkserver"))
+
+def create_image_data_batch(filepaths, workers=None, chunksize=__PARSE_CHUNKSIZE__,
+                            fast_metadata=False, executor=None):
+    """Create data objects for a list of JPEG 2000 images.
+
+    Headers are parsed across a pool of worker processes, each of which is
+    handed the files in chunks. A pool from create_parse_pool can be passed
+    in as executor to reuse it between calls, otherwise one is created for
+    this call. See JP2parser for fast_metadata.
+
+    Returns
+    -------
+    images : list
+        image dict representations, in the same order as filepaths
+    failures : list
+        (filepath, error) pairs for the files which could not be parsed
+    """
+    images = []
+    failures = []
+    parse = partial(_try_create_image_data, fast_metadata=fast_metadata)
+    own_executor = None
+
+    if len(filepaths) <= 1 or (executor is None and workers == 1):
+        results = map(parse, filepaths)
+    else:
+        if executor is None:
+            executor = own_executor = create_parse_pool(workers)
+        results = executor.map(parse, filepaths, chunksize=chunksize)
+
+    try:
+        for filepath, image, error in results:
+            if error is None:
+                images.append(image)
+            else:
+                failures.append((filepath, error))
+    finally:
+        if own_executor is not None:
+            own_executor.shutdown()
+
+    return images, failures
+
 def find_images(path):
     """Searches a directory for JPEG 2000 images.
 
@@ -43,32 +116,44 @@ def find_images(path):
     return images
 
 
-def process_jp2_images(images, root_dir, db, cursor, mysql=True, step_fxn=None, cursor_v2=None):
-    """Processes a collection of JPEG 2000 Images"""
+def process_jp2_images(images, root_dir, db, cursor, mysql=True, step_fxn=None, v2_writer=None,
+                       batch_size=__INSERTS_PER_QUERY__, resolver=None):
+    """Processes a collection of JPEG 2000 Images
+
+    A DatasourceResolver kept by the caller can be passed in so that the
+    datasources table isn't read again for every call.
+
+    Returns the list of images which could not be added to the database.
+    """
     #if mysql:
     #    import mysql.connector
     #else:
     #    import pgdb
 
-    # Return tree of known data-sources
-    sources = get_datasources(cursor)
+    if resolver is None:
+        resolver = DatasourceResolver()
 
-    # Insert images into database, 500 at a time
+    # Insert images into database, batch_size at a time
+    failed = []
     while len(images) > 0:
-        subset = images[:__INSERTS_PER_QUERY__]
-        images = images[__INSERTS_PER_QUERY__:]
-        insert_images(subset, sources, root_dir, db, cursor, mysql, step_fxn, cursor_v2)
+        subset = images[:batch_size]
+        images = images[batch_size:]
+        failed += insert_images(subset, resolver, root_dir, db, cursor, mysql, step_fxn, v2_writer, batch_size)
+
+    return failed
 
 
-def insert_images(images, sources, rootdir, db, cursor, mysql, step_function=None, cursor_v2=None):
-    """Inserts multiple images into a database using a single query
+def insert_images(images, resolver, rootdir, db, cursor, mysql, step_function=None, v2_writer=None,
+                  batch_size=__INSERTS_PER_QUERY__):
+    """Inserts multiple images into a database using parameterized multi-row
+    queries
 
     Parameters
     ----------
     images : list
         list of image dict representations
-    sources : list
-        tree of datasources supported by Helioviewer
+    resolver : DatasourceResolver
+        datasources supported by Helioviewer
     rootdir : string
         image archive root directory
     cursor : mixed
@@ -77,6 +162,15 @@ def insert_images(images, sources, rootdir, db, cursor, mysql, step_function=Non
         whether or not MySQL syntax should be used
     step_function : function
         function to call after each insert query
+    v2_writer : V2Writer or SpooledV2Writer
+        writer for the Helioviewer v2 `images` table, if it is kept up to date
+    batch_size : int
+        maximum number of rows to send in a single query
+
+    Returns
+    -------
+    failed : list
+        images which could not be inserted into the data table
     """
 
     # TEMPORARY SOLUTION
@@ -85,66 +179,283 @@ def insert_images(images, sources, rootdir, db, cursor, mysql, step_function=Non
     # separatly.
     #
     # To solve this we duplicated query with different table names and exetuning it to different databases.
+    # The v2 rows are handed to v2_writer, which inserts them while the data rows are inserted here.
     #
-    query = "INSERT IGNORE INTO data VALUES "
-    query_v2 = "INSERT IGNORE INTO images VALUES "
+    rows = []
+    rows_v2 = []
 
-    # Add images to SQL query
+    # Build a row of query parameters for each image
     for i, img in enumerate(images):
         # break up directory and filepath
         directory, filename = os.path.split(img['filepath'])
 
         path = "/" + os.path.relpath(directory, rootdir)
 
-        prev = ""
-        source = sources
-
-        leafs = JP2parser.get_detection_keys(img)
-        for leaf in leafs:
-            if img[leaf] != prev:
-                source = source[str(img[leaf])]
-            prev = img[leaf]
-
         # Enable datasource if it has not already been
-        if (not source['enabled']):
-            enable_datasource(cursor, source['id'])
-
-        groups = getImageGroup(source['id'])
+        source = resolver.resolve(cursor, JP2parser.get_source_key(img))
+        groups = source.groups
 
-        # insert into database
-        queryStr = "(NULL, '%s', '%s', '%s', NULL, %d, '%s', '%s', '%s', '%s', '%s', '%s', '%s', '%s', '%s', '%s', '%s', '%s', '%s', '%s', '%s', '%s', '%s', '%s', 1, %d, %d, %d),"
+        rows.append(tuple(_sql_value(value) for value in (
+            path, filename, str(img["date"]), source.id,
+            img["scale"], img["width"], img["height"], img["refPixelX"], img["refPixelY"], img["layeringOrder"],
+            img["DSUN_OBS"], img["SOLAR_R"], img["RADIUS"], img["CDELT1"], img["CDELT2"],
+            img["CRVAL1"], img["CRVAL2"], img["CRPIX1"], img["CRPIX2"], img["XCEN"], img["YCEN"],
+            img["CROTA1"], groups["groupOne"], groups["groupTwo"], groups["groupThree"])))
 
-        query += queryStr % (path, filename, img["date"], source['id'],
-                  img["scale"], img["width"], img["height"], img["refPixelX"], img["refPixelY"], img["layeringOrder"],
-                  img["DSUN_OBS"], img["SOLAR_R"], img["RADIUS"], img["CDELT1"], img["CDELT2"],
-                  img["CRVAL1"], img["CRVAL2"], img["CRPIX1"], img["CRPIX2"], img["XCEN"], img["YCEN"],
-                  img["CROTA1"], groups["groupOne"], groups["groupTwo"], groups["groupThree"])
-
-        query_v2 += "(NULL, '%s', '%s', '%s', %d)," % (path, filename, img["date"], source['id'])
+        rows_v2.append((path, filename, str(img["date"]), source.id))
 
         # Progressbar
         if step_function and (((i + 1) % __STEP_FXN_THROTTLE__) == 0):
             step_function(filename)
 
-    # Remove trailing comma
-    query = query[:-1] + ";"
-    query_v2 = query_v2[:-1] + ";"
+    v2_result = None
+    if v2_writer is not None:
+        v2_result = v2_writer.submit(rows_v2, batch_size)
 
-    # Execute query
-    try:
-        cursor.execute(query)
-	# Commit enabling datasources
-        db.commit()
-    except Exception as e:
-        print("Error: " + e.args[1])
+    failed_rows = insert_rows(__DATA_INSERT_QUERY__, rows, db, cursor, "data", batch_size)
+
+    # Raises any connection error from the v2 database
+    if v2_result is not None:
+        v2_result.result()
+
+    failed = set(failed_rows)
+    return [img for img, row in zip(images, rows) if row in failed]
 
-    if cursor_v2:
+
+def insert_rows(query, rows, db, cursor, table, batch_size=__INSERTS_PER_QUERY__):
+    """Inserts rows using a parameterized query, batch_size rows at a time.
+
+    If a batch fails it is split in half and each half is retried, so a bad
+    row only costs that row rather than the whole batch. Connection errors
+    are raised straight away.
+
+    Returns
+    -------
+    failed : list
+        rows which could not be inserted
+    """
+    failed = []
+    t1 = time.time()
+
+    for i in range(0, len(rows), batch_size):
+        batch = rows[i:i + batch_size]
         try:
-            cursor_v2.execute(query_v2)
-            # Commit enabling datasources
-            db.commit()
+            _execute_batch(query, batch, db, cursor)
         except Exception as e:
-            print("Error: " + e.args[1])
+            # Retrying row by row won't help if the connection has gone
+            if _is_connection_error(e):
+                raise
+            logging.error("Failed to insert batch of %d rows into %s: %s", len(batch), table, e)
+            failed += _bisect_batch(query, batch, db, cursor, table)
+
+    elapsed = time.time() - t1
+    inserted = len(rows) - len(failed)
+    if len(rows) > 0:
+        logging.info("Inserted %d/%d rows into %s in %0.3fs (%0.1f rows/s)", inserted, len(rows),
+                     table, elapsed, inserted / elapsed if elapsed > 0 else 0)
+
+    return failed
+
+
+def _execute_batch(query, batch, db, cursor):
+    cursor.executemany(query, batch)
+    # Commit enabling datasources
+    db.commit()
+
+
+def _bisect_batch(query, batch, db, cursor, table):
+    """Retries the halves of a failed batch, returning the rows which fail
+    on their own"""
+    if len(batch) == 1:
+        logging.error("Failed to insert %s into %s", batch[0][1], table)
+        return list(batch)
+
+    failed = []
+    middle = len(batch) // 2
+    for half in (batch[:middle], batch[middle:]):
+        try:
+            _execute_batch(query, half, db, cursor)
+        except Exception as e:
+            if _is_connection_error(e):
+                raise
+            failed += _bisect_batch(query, half, db, cursor, table)
+    return failed
+
+
+def _is_connection_error(e):
+    """Returns True for errors caused by the database connection rather than
+    the rows being inserted. Both mysql.connector and MySQLdb use the DB-API
+    OperationalError and InterfaceError classes for these."""
+    if isinstance(e, ConnectionError):
+        return True
+    return any(cls.__name__ in ('OperationalError', 'InterfaceError') for cls in type(e).__mro__)
+
+
+class V2Writer:
+    """Inserts rows into the Helioviewer v2 `images` table on its own
+    connection.
+
+    Rows are inserted on a worker thread, at the same time as the caller
+    inserts the matching rows into the `data` table.
+    """
+    def __init__(self, db, cursor):
+        self.db = db
+        self.cursor = cursor
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="v2-writer")
+
+    def submit(self, rows, batch_size=__INSERTS_PER_QUERY__):
+        """Starts inserting rows, returning a Future for the failed rows"""
+        return self._executor.submit(insert_rows, __IMAGES_INSERT_QUERY__, rows, self.db,
+                                     self.cursor, "images", batch_size)
+
+    def close(self):
+        self._executor.shutdown()
+
+
+class SpooledV2Writer:
+    """Queues rows for the Helioviewer v2 `images` table in a local spool
+    file and inserts them from a background thread.
+
+    Ingestion doesn't wait for the v2 database, so a slow or unavailable
+    v2 server only delays the v2 rows. The position of the first row which
+    hasn't been inserted yet is kept in a file next to the spool, and the
+    spool is emptied once every row in it has been inserted. Any rows left
+    over when HVPull stops are inserted after the next start.
+
+    Parameters
+    ----------
+    path : str
+        Spool file
+    connect : callable
+        Returns a (db, cursor) pair for the v2 database
+    retry_interval : float
+        Seconds to wait after a connection error before trying again
+    """
+    def __init__(self, path, connect, retry_interval=30):
+        self.path = path
+        self.offset_path = path + ".offset"
+        self.connect = connect
+        self.retry_interval = retry_interval
+        self.batch_size = __INSERTS_PER_QUERY__
+        self._db = None
+        self._cursor = None
+        self._lock = threading.Lock()
+        self._offset = self._load_offset()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="v2-spool", daemon=True)
+        self._wake.set()
+        self._thread.start()
+
+    def submit(self, rows, batch_size=__INSERTS_PER_QUERY__):
+        """Adds rows to the spool, returning a Future which is already done"""
+        with self._lock:
+            self.batch_size = batch_size
+            with open(self.path, "a") as f:
+                for row in rows:
+                    f.write(json.dumps(row) + "\n")
+        self._wake.set()
+        future = Future()
+        future.set_result([])
+        return future
+
+    def close(self):
+        """Stops the background thread. Rows still in the spool are kept."""
+        self._stop.set()
+        self._wake.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait()
+            self._wake.clear()
+            # Replay until the spool is empty
+            while not self._stop.is_set():
+                n = self._replay()
+                if n is None:
+                    self._stop.wait(self.retry_interval)
+                elif n == 0:
+                    break
+
+    def _load_offset(self):
+        """Returns the position in the spool saved by a previous run"""
+        try:
+            with open(self.offset_path) as f:
+                offset = int(f.read())
+        except (OSError, ValueError):
+            return 0
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            size = 0
+        return offset if offset <= size else 0
+
+    def _read_spool(self, limit):
+        """Returns up to limit rows from the current position in the spool
+        and the position following them"""
+        with self._lock:
+            if not os.path.exists(self.path):
+                return [], self._offset
+            rows = []
+            with open(self.path, "rb") as f:
+                f.seek(self._offset)
+                while len(rows) < limit:
+                    line = f.readline()
+                    if not line:
+                        break
+                    if line.strip():
+                        rows.append(tuple(json.loads(line)))
+                return rows, f.tell()
+
+    def _remove_from_spool(self, offset):
+        """Moves the current position in the spool past the rows which have
+        been inserted, emptying the spool when none are left"""
+        with self._lock:
+            if offset >= os.path.getsize(self.path):
+                open(self.path, "w").close()
+                if os.path.exists(self.offset_path):
+                    os.remove(self.offset_path)
+                self._offset = 0
+            else:
+                tmp = self.offset_path + ".tmp"
+                with open(tmp, "w") as f:
+                    f.write(str(offset))
+                os.replace(tmp, self.offset_path)
+                self._offset = offset
+
+    def _replay(self):
+        """Inserts rows from the spool. Returns the number of rows replayed,
+        or None if the v2 database could not be reached."""
+        rows, offset = self._read_spool(__SPOOL_REPLAY_ROWS__)
+        if not rows:
+            return 0
+        try:
+            if self._db is None:
+                self._db, self._cursor = self.connect()
+            t1 = time.time()
+            failed = insert_rows(__IMAGES_INSERT_QUERY__, rows, self._db, self._cursor,
+                                 "images", self.batch_size)
+        except Exception as e:
+            logging.warning("Unable to insert %d spooled rows into v2 images: %s", len(rows), e)
+            self._db = None
+            self._cursor = None
+            return None
+
+        self._remove_from_spool(offset)
+        logging.info("Replayed %d spooled rows into v2 images in %0.3fs, %d failed",
+                     len(rows), time.time() - t1, len(failed))
+        return len(rows)
+
+
+def _sql_value(value):
+    """Converts an image property into a query parameter. Missing header
+    values are stored as the string 'NULL' and become SQL NULLs."""
+    if isinstance(value, str) and value == 'NULL':
+        return None
+    # numpy scalars aren't understood by the database drivers
+    if hasattr(value, 'item'):
+        return value.item()
+    return value
 
 
 class BadImage(ValueError):
@@ -157,46 +468,6 @@ class BadImage(ValueError):
         return self.message
 
 
-def getImageGroup(sourceId):
-    """Create data object of XRT groups
-
-    TODO: move groupId definition to the database
-    """
-    groups = dict()
-    groups["groupOne"] = 0
-    groups["groupTwo"] = 0
-    groups["groupThree"] = 0
-
-    if sourceId > 37 and sourceId < 75:
-        groups["groupOne"] = 10001
-
-        # ID 68 messes up the math because it doesn't fit the pattern.
-        # So for values > 68 offset it by 1 so we basically ignore it
-        # in the math. This is confirmed to work via test_jp2.py
-        offset = sourceId
-        if sourceId > 68:
-            offset = sourceId - 1
-
-        # sourceId 68 doesn't follow the pattern. groups 2 and 3 should
-        # be 0 for 68, so exclude it here.
-        if sourceId != 68:
-            # thanks to the pattern of how the data is laid out
-            # group 2 follows a modulus of 10002 - 10007 and repeats
-            # i.e. 38 -> 10002 ... 43 -> 10007, 44 -> 10002 ... 49 -> 10007, etc
-            # So group 2 can be set with a modulus
-            groups["groupTwo"] = ((offset - 38) % 6) + 10002
-
-            # Group 3 has a similar pattern, every 6 share a group and then
-            # the group is incremented by one.
-            # i.e. 38 -> 10008 ... 43 -> 10008, 44 -> 10009 ... 49 -> 10009, etc
-            # Count on integer division to drop the result in the correct bucket
-            # 38 to 43 when subtracted will return 0 - 5, when divided by 6 returns 0.
-            # 44 to 49 when subtracted will return 6 - 11, when divided by 6 returns 1.
-            # etc.
-            groups["groupThree"] = ((offset - 38) // 6) + 10008
-
-    return groups
-
 def build_transcode_cmd(transcoder: str, infile: str, outfile: str, corder: str, orggen_plt: str, cprecincts) -> list:
     """
     Returns a list of arguments suitable for subprocess.run with shell=False
@@ -232,7 +503,6 @@ def transcode(transcoder: str, filepath: str, corder: str ='RPCL', orggen_plt: s
     On failure, raises a KduTranscode exception
     """
     import subprocess
-    import logging
 
     tmp = filepath + '.tmp.jp2'
     command = build_transcode_cmd(transcoder, filepath, tmp, corder, orggen_plt, cprecincts)
@@ -253,3 +523,41 @@ def transcode(transcoder: str, filepath: str, corder: str ='RPCL', orggen_plt: s
         logging.error(f'kdu_transcode stderr: {result.stderr}')
         raise KduTranscodeError(filepath)
     return tmp
+
+def transcode_batch(transcoder: str, jobs: list, workers: int = 1, corder: str = 'RPCL', orggen_plt: str = 'yes') -> list:
+    """
+    Transcodes several JPEG 2000 images concurrently
+
+    Each job is a (filepath, cprecincts) pair. kdu_transcode runs as a
+    separate process, so a pool of threads is enough to keep `workers`
+    cores busy.
+
+    On success, returns the paths to the transcoded files in the same order
+    as the jobs. If any file fails to transcode, jobs which have not started
+    yet are cancelled, the output of those which finished is removed and the
+    KduTranscodeError is raised.
+    """
+    def timed_transcode(filepath, cprecincts):
+        t1 = time.time()
+        transcoded = transcode(transcoder, filepath, corder, orggen_plt, cprecincts)
+        t2 = time.time()
+        logging.info('Transcoded %s in %0.3fs', os.path.basename(filepath), t2 - t1)
+        return transcoded
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(timed_transcode, filepath, cprecincts) for filepath, cprecincts in jobs]
+        done, not_done = wait(futures, return_when=FIRST_EXCEPTION)
+        for future in not_done:
+            future.cancel()
+
+    # Leaving the executor waits for the jobs which were already running
+    errors = [future.exception() for future in futures
+              if not future.cancelled() and future.exception() is not None]
+    if errors:
+        for filepath, cprecincts in jobs:
+            tmp = filepath + '.tmp.jp2'
+            if os.path.isfile(tmp):
+                os.remove(tmp)
+        raise errors[0]
+
+    return [future.result() for future in futures]
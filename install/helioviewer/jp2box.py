@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""Lightweight JPEG 2000 box reader
+
+Helioviewer only needs a couple of boxes out of each JP2 file, most often
+the XML box holding the FITS header. Rather than parsing the complete box
+structure (including the codestream header), this module seeks through the
+top-level box headers and reads only the boxes that are asked for.
+"""
+import struct
+from xml.etree import ElementTree as ET
+
+__BOX_HEADER_LENGTH__ = 8
+
+
+def iter_boxes(fp):
+    """Yields (box_type, offset, length) for each top-level box in a JP2 file.
+
+    offset is the position of the box contents, just past the box header,
+    and length is the length of the contents. The file position is left at
+    the start of each box's contents when it is yielded.
+    """
+    fp.seek(0, 2)
+    file_size = fp.tell()
+    position = 0
+
+    while position + __BOX_HEADER_LENGTH__ <= file_size:
+        fp.seek(position)
+        box_length, box_type = struct.unpack('>I4s', fp.read(__BOX_HEADER_LENGTH__))
+        header_length = __BOX_HEADER_LENGTH__
+
+        if box_length == 0:
+            # Box extends to the end of the file
+            box_length = file_size - position
+        elif box_length == 1:
+            # Box length is given by the 64-bit XLBox field
+            box_length, = struct.unpack('>Q', fp.read(8))
+            header_length += 8
+
+        if box_length < header_length:
+            raise ValueError("Invalid box length %d at byte %d" % (box_length, position))
+
+        yield box_type.decode('latin-1'), position + header_length, box_length - header_length
+        position += box_length
+
+
+def find_box(fp, box_type):
+    """Returns (offset, length) of the first top-level box of the given type,
+    or None if the file has no such box."""
+    for found_type, offset, length in iter_boxes(fp):
+        if found_type == box_type:
+            return offset, length
+    return None
+
+
+def read_xml_box(filepath):
+    """Returns the contents of the first top-level XML box in a JP2 file as
+    text, or None if the file does not have an XML box."""
+    with open(filepath, 'rb') as fp:
+        box = find_box(fp, 'xml ')
+        if box is None:
+            return None
+        offset, length = box
+        fp.seek(offset)
+        contents = fp.read(length)
+
+    try:
+        text = contents.decode('utf-8')
+    except UnicodeDecodeError:
+        # Possibly junk in front of the XML, try starting at the declaration
+        start = contents.find(b'<?xml')
+        if start < 0:
+            raise
+        text = contents[start:].decode('utf-8')
+
+    # Trailing nulls would break XML parsing
+    return text.rstrip(chr(0))
+
+
+def element_to_dict(element):
+    """Converts the children of an XML element into a dictionary.
+
+    This produces the same structure as sunpy.util.xml.node_to_dict: leaf
+    elements map to their text, elements with the attribute multiple="true"
+    map to a list of their children, and all other elements are converted
+    recursively.
+    """
+    result = {}
+    for child in element:
+        value = element_value(child)
+        # node_to_dict skips multiple="true" elements with no children
+        if value != []:
+            result[child.tag] = value
+    return result
+
+
+def element_value(element):
+    """Converts a single XML element into a string, list or dictionary"""
+    if element.get('multiple') == 'true':
+        return [element_to_dict(item) for item in element]
+    if len(element) == 0:
+        return element.text or ""
+    return element_to_dict(element)
+
+
+def read_header_xml(filepath):
+    """Reads the FITS and helioviewer elements from a JP2 file's XML box.
+
+    Returns
+    -------
+    fits : dict
+        The FITS header, with all values as strings, or None if the file has
+        no XML box or no fits element
+    helioviewer : dict
+        The helioviewer element, or None if it isn't present
+    """
+    text = read_xml_box(filepath)
+    if text is None:
+        return None, None
+
+    root = ET.fromstring(text.encode('utf-8'))
+    fits = root.find('fits')
+    if fits is None:
+        return None, None
+
+    helioviewer = root.find('helioviewer')
+    if helioviewer is not None:
+        helioviewer = element_value(helioviewer)
+
+    return element_value(fits), helioviewer
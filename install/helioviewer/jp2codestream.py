@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""JPEG 2000 codestream header inspector
+
+Reads the coding parameters which matter to JHelioviewer and the JPIP
+server (progression order, quality layers, precinct sizes and whether
+packet lengths are recorded in PLT markers) straight from the marker
+segments at the start of the codestream. Only the main header and the
+first tile-part header are read, so this takes microseconds rather than
+the time needed to run jpylyzer or kdu_transcode on the file.
+"""
+import struct
+from collections import namedtuple
+from helioviewer.jp2box import find_box
+
+# Marker codes
+__SOC__ = 0xFF4F
+__SOT__ = 0xFF90
+__SOD__ = 0xFF93
+__SIZ__ = 0xFF51
+__COD__ = 0xFF52
+__PLT__ = 0xFF58
+
+PROGRESSION_ORDERS = ["LRCP", "RLCP", "RPCL", "PCRL", "CPRL"]
+
+# Precinct size used when COD doesn't give any, as an exponent of 2
+__MAX_PRECINCT_EXPONENT__ = 15
+
+CodestreamInfo = namedtuple("CodestreamInfo", [
+    "width",        # image width on the reference grid
+    "height",       # image height on the reference grid
+    "tiles",        # number of tiles
+    "components",   # number of image components
+    "progression",  # progression order, e.g. 'RPCL'
+    "layers",       # number of quality layers
+    "levels",       # number of decomposition levels
+    "precincts",    # (width, height) of the precincts at each resolution,
+                    # from the lowest resolution up
+    "plt",          # whether the first tile-part has PLT markers
+])
+
+
+def read_codestream_info(filepath):
+    """Returns the CodestreamInfo of a JP2 file or raw J2K codestream.
+
+    Raises ValueError if the codestream can't be found or is malformed.
+    """
+    with open(filepath, 'rb') as fp:
+        if fp.read(2) == struct.pack('>H', __SOC__):
+            offset = 0
+        else:
+            box = find_box(fp, 'jp2c')
+            if box is None:
+                raise ValueError("No codestream found in %s" % filepath)
+            offset = box[0]
+        fp.seek(offset)
+        return _read_headers(fp)
+
+
+def needs_transcode(info, cprecincts=None):
+    """Returns True if kdu_transcode would need to be run on a file to give
+    a single tile, RPCL progression, PLT markers and, if given, the precinct
+    size cprecincts at every resolution."""
+    if info.tiles != 1 or info.progression != 'RPCL' or not info.plt:
+        return True
+    if cprecincts is not None:
+        return any(size != tuple(cprecincts) for size in info.precincts)
+    return False
+
+
+def _read_marker(fp):
+    """Reads a marker and the contents of its segment"""
+    header = fp.read(4)
+    if len(header) < 4:
+        raise ValueError("Codestream ends before the first tile-part")
+    marker, length = struct.unpack('>HH', header)
+    if marker >> 8 != 0xFF or length < 2:
+        raise ValueError("Invalid marker 0x%04X" % marker)
+    return marker, length - 2
+
+
+def _read_headers(fp):
+    if fp.read(2) != struct.pack('>H', __SOC__):
+        raise ValueError("Codestream doesn't start with SOC")
+
+    siz = None
+    cod = None
+
+    # Main header, which ends at the first tile-part
+    while True:
+        marker, length = _read_marker(fp)
+        if marker == __SOT__:
+            fp.seek(length, 1)
+            break
+        if marker == __SIZ__:
+            siz = _parse_siz(fp.read(length))
+        elif marker == __COD__:
+            cod = _parse_cod(fp.read(length))
+        else:
+            fp.seek(length, 1)
+
+    if siz is None or cod is None:
+        raise ValueError("Codestream main header is missing SIZ or COD")
+
+    # First tile-part header, which ends at the start of its data
+    plt = False
+    while True:
+        header = fp.read(2)
+        if len(header) < 2:
+            raise ValueError("Codestream ends in a tile-part header")
+        marker, = struct.unpack('>H', header)
+        if marker == __SOD__:
+            break
+        length, = struct.unpack('>H', fp.read(2))
+        if marker == __PLT__:
+            plt = True
+            break
+        fp.seek(length - 2, 1)
+
+    return CodestreamInfo(plt=plt, **siz, **cod)
+
+
+def _parse_siz(data):
+    (rsiz, xsiz, ysiz, xosiz, yosiz, xtsiz, ytsiz, xtosiz, ytosiz,
+     csiz) = struct.unpack('>HIIIIIIIIH', data[:36])
+    tiles_x = -(-(xsiz - xtosiz) // xtsiz)
+    tiles_y = -(-(ysiz - ytosiz) // ytsiz)
+    return {"width": xsiz - xosiz, "height": ysiz - yosiz,
+            "tiles": tiles_x * tiles_y, "components": csiz}
+
+
+def _parse_cod(data):
+    scod, order, layers, mct, levels = struct.unpack('>BBHBB', data[:6])
+    if order >= len(PROGRESSION_ORDERS):
+        raise ValueError("Unknown progression order %d" % order)
+
+    # Precinct sizes are given for each resolution when bit 0 of Scod is
+    # set, as powers of 2 in the low (width) and high (height) nibbles
+    if scod & 1:
+        sizes = data[10:11 + levels]
+        if len(sizes) < levels + 1:
+            raise ValueError("COD marker is too short for its precinct sizes")
+        precincts = [(1 << (b & 0x0F), 1 << (b >> 4)) for b in sizes]
+    else:
+        size = 1 << __MAX_PRECINCT_EXPONENT__
+        precincts = [(size, size)] * (levels + 1)
+
+    return {"progression": PROGRESSION_ORDERS[order], "layers": layers,
+            "levels": levels, "precincts": precincts}
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""Map-free source metadata
+
+JP2parser normally builds a sunpy Map from a 1x1 dummy array just to read a
+handful of homogenized properties (observatory, instrument, detector,
+measurement, nickname and date). Constructing and validating the map costs
+far more than reading the header itself.
+
+This module derives the same properties straight from the header using a
+table of rules which mirror the sunpy map sources for the instruments that
+make up the bulk of the ingested data. resolve_metadata returns None for
+any header the table can't resolve exactly as sunpy would, in which case
+the caller should fall back to building the map.
+"""
+from functools import lru_cache
+import astropy.units as u
+from astropy.time import Time
+from sunpy.time import is_time, parse_time
+from sunpy.util.metadata import MetaDict
+
+
+class HeaderMetadata:
+    """Stands in for the sunpy map properties read by JP2parser.getData"""
+    def __init__(self, meta, observatory, instrument, detector, measurement, nickname, date):
+        self.meta = meta
+        self.observatory = observatory
+        self.instrument = instrument
+        self.detector = detector
+        self.measurement = measurement
+        self.nickname = nickname
+        self.date = date
+
+
+class Unresolved(Exception):
+    """Raised by a rule when a header needs the full sunpy map"""
+    pass
+
+
+@lru_cache(maxsize=None)
+def _unit(unit_str):
+    return u.Unit(unit_str)
+
+
+def _check_spatial_units(units):
+    """Mirrors GenericMap._validate_meta. Headers which would fail
+    validation have their CUNITs patched by JP2parser, so leave them to it."""
+    for unit in units:
+        if unit is None:
+            raise Unresolved()
+        try:
+            if not _unit(unit).is_equivalent(u.arcsec):
+                raise Unresolved()
+        except (ValueError, TypeError):
+            raise Unresolved()
+
+
+def _generic_spatial_units(meta):
+    units = [meta.get('cunit1'), meta.get('cunit2')]
+    return [None if unit is None else str(unit).lower() for unit in units]
+
+
+def _default_arcsec_spatial_units(meta):
+    return [str(meta.get('cunit1', 'arcsec')), str(meta.get('cunit2', 'arcsec'))]
+
+
+def _rhessi_spatial_units(meta):
+    units = [meta.get('cunit1'), meta.get('cunit2')]
+    if meta.get('ctype1') == 'arcsec':
+        units[0] = 'arcsec'
+    if meta.get('ctype2') == 'arcsec':
+        units[1] = 'arcsec'
+    return [None if unit is None else str(unit).lower() for unit in units]
+
+
+def _generic_observatory(meta):
+    return meta.get('obsrvtry', meta.get('telescop', "")).replace("_", " ")
+
+
+def _sdo_observatory(meta):
+    return meta.get('telescop', '').split('/')[0]
+
+
+def _generic_instrument(meta):
+    return meta.get('instrume', "").replace("_", " ")
+
+
+def _get_date(meta, key, timesys=None):
+    """Mirrors GenericMap._get_date"""
+    time = meta.get(key, None)
+    if not time:
+        return None
+    if 'TAI' in time:
+        return parse_time(time, scale='tai')
+    if timesys is None:
+        timesys = meta.get('timesys', 'UTC')
+    if not isinstance(timesys, str):
+        raise Unresolved()
+    return parse_time(time, scale=timesys.lower())
+
+
+def _generic_date(meta):
+    """Mirrors GenericMap.date for headers with an observation date. Other
+    sources of the date (DATE-BEG etc.) are left to sunpy."""
+    for key in ('date-obs', 'date_obs'):
+        time = meta.get(key, None)
+        if time is None:
+            continue
+        # Same check as sunpy.time.is_time, keeping the result so that UTC
+        # dates (by far the most common) are only parsed once
+        try:
+            date = parse_time(time)
+        except ValueError:
+            continue
+        if isinstance(time, str) and 'TAI' not in time and meta.get('timesys', 'UTC') == 'UTC':
+            return date
+        return _get_date(meta, key)
+    raise Unresolved()
+
+
+def _wavelength(meta):
+    """Mirrors GenericMap.wavelength. Without a WAVEUNIT sunpy looks for the
+    unit in the key comments, so those headers are left to sunpy."""
+    if 'wavelnth' not in meta:
+        return None
+    if not meta.get('waveunit'):
+        raise Unresolved()
+    return u.Quantity(meta['wavelnth'], _unit(meta['waveunit']))
+
+
+def _aia(meta):
+    detector = meta.get('detector', 'AIA')
+    return (_sdo_observatory(meta), _generic_instrument(meta), detector,
+            _wavelength(meta), detector, _generic_date(meta))
+
+
+def _hmi(meta):
+    if (str(meta.get('telescop', '')).endswith('HMI') and
+            'carrington synoptic chart' in str(meta.get('content', '')).lower()):
+        # HMI synoptic maps have their own sunpy source
+        raise Unresolved()
+    content = meta.get('content', '').split(" ")
+    if len(content) > 1 and content[0].lower() == 'hmi':
+        measurement = content[1].lower()
+    else:
+        measurement = content[0].lower()
+    detector = meta.get('detector', 'HMI')
+    return (_sdo_observatory(meta), _generic_instrument(meta), detector,
+            measurement, detector, _generic_date(meta))
+
+
+def _eit(meta):
+    if meta.get('level') is not None:
+        # EIT level 1 files have their own sunpy source
+        raise Unresolved()
+    if 'wavelnth' in meta:
+        unit = meta.get('waveunit', 'Angstrom') or 'Angstrom'
+        measurement = u.Quantity(meta['wavelnth'], _unit(unit))
+    else:
+        measurement = None
+    date = _get_date(meta, 'date_obs') or _generic_date(meta)
+    return (_generic_observatory(meta), "EIT", "EIT", measurement, "EIT", date)
+
+
+def _lasco(meta):
+    instrument = _generic_instrument(meta)
+    detector = meta.get('detector', "")
+    date = meta.get('date-obs', meta.get('date_obs'))
+    if not date:
+        raise Unresolved()
+    time = meta.get('time-obs', meta.get('time_obs'))
+    if time and 'T' not in date:
+        date = f"{date}T{time}"
+    nickname = f"{instrument}-{detector} {meta.get('filter', '')}"
+    return (_generic_observatory(meta), instrument, detector, "white-light",
+            nickname, parse_time(date))
+
+
+def _iris_sji(meta):
+    if not str(meta.get('telescop', '')).startswith('IRIS'):
+        raise Unresolved()
+    wavelength = meta.get('wavelnth', meta.get('twave1'))
+    if wavelength is None:
+        raise Unresolved()
+    measurement = wavelength * _unit(meta.get('waveunit', "Angstrom"))
+    return (_generic_observatory(meta), _generic_instrument(meta), "SJI",
+            measurement, "SJI", _generic_date(meta))
+
+
+def _rhessi_date(meta):
+    """Mirrors JP2parser._get_date for RHESSI maps. The RHESSI map source
+    reads TIMESYS through the key comments, which JP2 headers don't have,
+    so sunpy raises a KeyError and JP2parser falls back to DATE_OBS."""
+    if is_time(meta.get('date-obs', None)):
+        time = meta['date-obs']
+    elif is_time(meta.get('date_obs', None)):
+        time = meta['date_obs']
+    else:
+        raise Unresolved()
+
+    if 'TAI' in time:
+        return parse_time(time, scale='tai')
+    if 'timesys' not in meta:
+        return parse_time(time, scale='utc')
+    if 'date_obs' not in meta:
+        raise Unresolved()
+    return Time(meta['date_obs'])
+
+
+def _rhessi(meta):
+    detector = meta['telescop']
+    measurement = u.Quantity([meta['energy_l'], meta['energy_h']],
+                             unit=_unit(meta.get('waveunit', 'keV')))
+    return (_generic_observatory(meta), _generic_instrument(meta), detector,
+            measurement, detector, _rhessi_date(meta))
+
+
+# Rules are looked up by the first part of INSTRUME, e.g. "AIA_4" -> "AIA".
+# Each entry is (rule, spatial units). A rule returns (observatory,
+# instrument, detector, measurement, nickname, date) for the header, and
+# raises Unresolved if the header isn't one sunpy would handle the same way.
+_SOURCE_RULES = {
+    'AIA': (_aia, _generic_spatial_units),
+    'HMI': (_hmi, _generic_spatial_units),
+    'EIT': (_eit, _default_arcsec_spatial_units),
+    'LASCO': (_lasco, _generic_spatial_units),
+    'SJI': (_iris_sji, _default_arcsec_spatial_units),
+    'RHESSI': (_rhessi, _rhessi_spatial_units),
+}
+
+# Exact INSTRUME values sunpy requires for sources which don't match on prefix
+_EXACT_INSTRUMENTS = {'EIT', 'LASCO', 'RHESSI'}
+
+
+def resolve_metadata(header):
+    """Derives the map properties used by Helioviewer from a header.
+
+    Parameters
+    ----------
+    header : dict
+        The FITS header read from the JP2 file
+
+    Returns
+    -------
+    HeaderMetadata or None
+        None if the header can't be resolved without a sunpy map
+    """
+    meta = MetaDict(header)
+    instrume = meta.get('instrume')
+    if not isinstance(instrume, str):
+        return None
+
+    key = instrume.split('_')[0]
+    if key not in _SOURCE_RULES or (key in _EXACT_INSTRUMENTS and instrume != key):
+        return None
+
+    rule, spatial_units = _SOURCE_RULES[key]
+    try:
+        _check_spatial_units(spatial_units(meta))
+        observatory, instrument, detector, measurement, nickname, date = rule(meta)
+    except (Unresolved, KeyError, ValueError, TypeError, AttributeError):
+        return None
+
+    return HeaderMetadata(meta, observatory, instrument, detector, measurement, nickname, date)
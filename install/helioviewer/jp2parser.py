@@ -14,6 +14,8 @@ from sunpy.util.xml import xml_to_dict
 from sunpy.io._header import FileHeader
 from sunpy.map.mapbase import MapMetaValidationError
 from glymur import Jp2k
+from helioviewer.jp2box import read_header_xml
+from helioviewer.jp2meta import HeaderMetadata, resolve_metadata
 from sunpy.util.xml import xml_to_dict
 from typing import Union
 
@@ -24,11 +26,24 @@ class JP2parser:
     _filepath = None
     _data = None
 
-    def __init__(self, path):
-        """Main application"""
+    def __init__(self, path, fast_metadata=False):
+        """Main application
+
+        If fast_metadata is set, the image properties are derived directly
+        from the header wherever possible instead of building a sunpy map.
+        """
         self._filepath = path
         # getImageMap initializes self._data
-        self._imageData = self._loadSunpyMap()
+        if fast_metadata:
+            self._imageData = self._loadHeaderMetadata()
+        else:
+            self._imageData = self._loadSunpyMap()
+
+    def _loadHeaderMetadata(self) -> Union[HeaderMetadata, GenericMap]:
+        metadata = resolve_metadata(self.get_header()[0])
+        if metadata is None:
+            return self._loadSunpyMap()
+        return metadata
 
     def _loadSunpyMap(self) -> GenericMap:
         try:
@@ -36,7 +51,7 @@ class JP2parser:
         except (MapMetaValidationError, ValueError): # ValueError catches a CUNIT with type 'degrees'
             return Map(self.read_header_only_but_still_use_sunpy_map(patch_cunit=True))
 
-    def getImageMap(self) -> GenericMap:
+    def getImageMap(self) -> Union[HeaderMetadata, GenericMap]:
         return self._imageData
 
     def getData(self):
@@ -182,6 +197,22 @@ class JP2parser:
             leafs = ["observatory", "instrument", "detector", "measurement"]
         return leafs
 
+    @staticmethod
+    def get_source_key(img):
+        """
+        Returns the tuple of this file's detection values which identifies
+        its data source, see get_detection_keys. Repeated values such as
+        AIA -> AIA are only included once, as in the datasource_property
+        table.
+        """
+        key = []
+        prev = ""
+        for leaf in JP2parser.get_detection_keys(img):
+            if img[leaf] != prev:
+                key.append(str(img[leaf]))
+            prev = img[leaf]
+        return tuple(key)
+
     def _get_punch_file_type(self, filepath):
         """
         Returns the PUNCH file type e.g. CAM/PAM based on the filename.
@@ -283,10 +314,14 @@ class JP2parser:
         headers : list
             A list of headers read from the file
         """
-        jp2 = Jp2k(self._filepath)
-        xml_box = [box for box in jp2.box if box.box_id == 'xml ']
-        xmlstring = ET.tostring(xml_box[0].xml.find('fits'))
-        pydict = xml_to_dict(xmlstring)["fits"]
+        try:
+            pydict, hvdict = read_header_xml(self._filepath)
+        except (ValueError, ET.ParseError):
+            pydict = None
+
+        # Fall back to glymur for files the box reader can't handle
+        if pydict is None:
+            pydict, hvdict = self._read_header_xml_with_glymur()
 
         # Fix types
         for k, v in pydict.items():
@@ -301,13 +336,34 @@ class JP2parser:
 
         self._data = pydict
 
+        if hvdict is not None:
+            self._helioviewer = hvdict
+
+
+        return [FileHeader(pydict)]
+
+    def _read_header_xml_with_glymur(self):
+        """
+        Reads the fits and helioviewer elements of the XML box using glymur
+
+        Returns
+        -------
+        (fits, helioviewer) : tuple
+            dicts of the fits and helioviewer elements. helioviewer is None
+            if the element does not exist.
+        """
+        jp2 = Jp2k(self._filepath)
+        xml_box = [box for box in jp2.box if box.box_id == 'xml ']
+        xmlstring = ET.tostring(xml_box[0].xml.find('fits'))
+        pydict = xml_to_dict(xmlstring)["fits"]
+
+        hvdict = None
         hv_tag = xml_box[0].xml.find('helioviewer')
         if hv_tag is not None:
             hvxml = ET.tostring(hv_tag)
-            self._helioviewer = xml_to_dict(hvxml)["helioviewer"]
-
+            hvdict = xml_to_dict(hvxml)["helioviewer"]
 
-        return [FileHeader(pydict)]
+        return pydict, hvdict
 
 
     def _is_float(self, s):
@@ -13,9 +13,9 @@ to run update.py.
 '''
 import sys
 import os
-import shutil
 import sunpy
-from helioviewer.jp2 import find_images, process_jp2_images, create_image_data
+from helioviewer.archive import ArchiveWriter
+from helioviewer.jp2 import find_images, process_jp2_images, create_image_data_batch
 from helioviewer.db  import get_db_cursor
 from helioviewer import init_logger
 from optparse import OptionParser, IndentedHelpFormatter
@@ -34,25 +34,23 @@ def main(argv):
     if len(filepaths) is 0:
         return
 
-    images = []
+    # Parse image headers
+    images, failures = create_image_data_batch(filepaths)
+
+    for filepath, error in failures:
+        print("Unable to parse %s, skipping" % filepath)
+        print(error)
 
     # Move images to main archive
-    for filepath in filepaths:
+    archive = ArchiveWriter(group=None)
+    for image_params in images:
+        filepath = image_params['filepath']
         dest = os.path.join(options.destination, 
                             os.path.relpath(filepath, options.source))
         
-        # Parse image header
-        image_params = create_image_data(filepath)
         image_params['filepath'] = dest
-        
-        images.append(image_params)
-
-        directory = os.path.dirname(dest)
-        
-        if not os.path.isdir(directory):
-            os.makedirs(directory)
 
-        shutil.move(filepath, dest)
+        archive.move(filepath, dest)
     
     # Add images to the database
     db, cursor = get_db_cursor(options.dbhost, options.dbname, options.dbuser, options.dbpass)
@@ -1,52 +1,40 @@
 import sys
 sys.path.append("../../install/helioviewer")
 from argparse import ArgumentParser
-from db import get_datasources, get_db_cursor
+from db import DatasourceResolver, get_db_cursor
 from jp2parser import JP2parser
 import configparser
 import os
 
-# This dictates which fields should be examined for a given observatory's images.
-# It should align with those in `jp2.py`
-OBSERVATORY_KEYWORDS = {
-    "RHESSI": ["observatory", "energy_band", "reconstruction_method"],
-    "Hinode": ["observatory", "instrument", "detector", "filter1", "filter2"],
-    "default": ["observatory", "instrument", "detector", "measurement"]
-}
-
 def parse_args():
     parser = ArgumentParser(description="Determines the required data source name for a given file")
     parser.add_argument('jp2_file', type=str, help="JPEG2000 file to examine")
     parser.add_argument('-c', '--config', metavar='config', type=str, help="Config file with database credentials")
     return parser.parse_args()
 
-def extract_datasource_name(jp2_file, cursor):
-    sources = get_datasources(cursor)
-    source = sources
-    prev = ""
+def extract_datasource_name(jp2_file, cursor, resolver=None):
+    if resolver is None:
+        resolver = DatasourceResolver()
     jp2 = JP2parser(jp2_file)
     img = jp2.getData()
-    try:
-        leafs = OBSERVATORY_KEYWORDS[img["observatory"]]
-    except KeyError:
-        leafs = OBSERVATORY_KEYWORDS["default"]
 
-    in_db = True # Track if the datasource is in the database
-    for leaf in leafs:
+    # The fields examined for each observatory's images are the same ones
+    # used when the image is ingested
+    for leaf in JP2parser.get_detection_keys(img):
         print("{}: {}".format(leaf, img[leaf]))
 
-        # Check if the found field is in the database
-        if in_db:
-            try:
-                if img[leaf] != prev:
-                    # If the field is in the source dictionary, then
-                    # it is in the database
-                    source = source[str(img[leaf])]
-                prev = img[leaf]
-            except KeyError:
-                # If a KeyError occurs, it's because the item was not found in the database
-                print("{} not found in database".format(img[leaf]))
-                in_db = False
+    key = JP2parser.get_source_key(img)
+    try:
+        source = resolver.lookup(cursor, key)
+        print("Datasource id: {}".format(source.id))
+    except KeyError:
+        # Report the first value which isn't in the database
+        for i in range(1, len(key) + 1):
+            if not resolver.is_known_prefix(cursor, key[:i]):
+                print("{} not found in database".format(key[i - 1]))
+                break
+        else:
+            print("No datasource matches {}".format(", ".join(key)))
 
 def get_config(filepath):
     """Load configuration file"""
@@ -3,9 +3,10 @@ from configparser import ConfigParser
 from datetime import datetime
 import MySQLdb
 import os
-import shutil
 import subprocess
 import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "install"))
+from helioviewer.archive import ArchiveWriter
 
 # Images from disk will be moved here in case they need to be restored.
 IMAGE_BACKUP_DIR = "/tmp/refill"
@@ -86,10 +87,9 @@ def backup_files(files: list):
     """
     Moves the given list of files to the image backup dir
     """
-    if not os.path.exists(IMAGE_BACKUP_DIR):
-        os.mkdir(IMAGE_BACKUP_DIR)
+    archive = ArchiveWriter(group=None)
     for fname in files:
-        shutil.move(fname, IMAGE_BACKUP_DIR)
+        archive.move(fname, os.path.join(IMAGE_BACKUP_DIR, os.path.basename(fname)))
 
 def download_files(start: datetime, end: datetime, server: str, script: str):
     """
@@ -2,6 +2,9 @@
 #-*- coding:utf-8 -*-
 """Helioviewer.org JP2 Transcoding check
 Check recursively folder with JP2 files for any un-transcoded files and then convert it
+Files are checked in parallel by a pool of processes. Each finished directory is
+recorded in a checkpoint file so that a stopped run picks up where it left off,
+and files which need or needed transcoding are reported as JSON lines.
 Require: https://github.com/Helioviewer-Project/hvJP2K
 """
 from __future__ import print_function
@@ -14,6 +17,8 @@ import logging.handlers
 
 import argparse
 import signal
+import json
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 
 import xml.etree.cElementTree as cet
 from lxml import etree as let
@@ -22,6 +27,9 @@ from jpylyzer import jpylyzer, config
 
 from hvJP2K.jp2.data import *
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'install'))
+from helioviewer.jp2codestream import read_codestream_info, needs_transcode
+
 #rootdir = '/mnt/data/jp2/SXT/2001/03/01/Al01'
 #rootdir = '/mnt/data/jp2/TRACE'
 #rootdir = '/mnt/data/jp2/AIA'
@@ -32,6 +40,13 @@ from hvJP2K.jp2.data import *
 #logfile = '/var/www/beta3.helioviewer.org/!work/jp2verify/transcoding.log'
 #init_logger(logfile)
 
+# Schema which files are checked against, compiled once in each worker
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scheme.sch')
+_schema = None
+
+# Number of files handed to the workers ahead of the results being read
+FILES_IN_FLIGHT_PER_WORKER = 16
+
 def main():
     """Main application"""
 
@@ -43,49 +58,163 @@ def main():
         logfile = os.path.abspath(args.log)
     else:
         logfile = "jp2check.log"
+
+    # init_logger changes directory, so resolve these first
+    checkpoint = os.path.abspath(args.checkpoint)
+    report = os.path.abspath(args.report)
+    if args.directory is not None:
+        directorypath = os.path.abspath(args.directory)
     
     init_logger(logfile)
     
     # Configure source directory
-    if args.directory is not None:
-        directorypath = os.path.abspath(args.directory)
-    else:
+    if args.directory is None:
         logging.error("Missing directory argument")
         exit(0)
-    
-    # Begin data check
-    for subdir, dirs, files in os.walk(directorypath):
-        for file in files:
-            filename, file_extension = os.path.splitext(file)
-        
-            if file_extension.lower() == '.jp2':
-                fpath = os.path.join(subdir, file)
-            
-                config.outputVerboseFlag = False
-                config.extractNullTerminatedXMLFlag = True
-            
-                xmlTree = let.fromstring(cet.tostring(jpylyzer.checkOneFile(fpath)))
-                schfile = 'scheme.sch'
-                schema = iso.Schematron(let.parse(schfile))
-             
-                if schema.validate(xmlTree) is False:
-                    try:
-                        if 'AIA' in fpath:
-                            _transcode(fpath, cprecincts=[128, 128])
-                        else:
-                            _transcode(fpath)
-                    except KduTranscodeError, e:
-                        logging.error("kdu_transcode: " + e.get_message())
-                else:
+
+    # Directories finished by a previous run are skipped
+    completed = _load_checkpoint(checkpoint)
+    if completed:
+        logging.info("Resuming, %d directories already checked" % len(completed))
+
+    workers = args.workers or os.cpu_count()
+    counts = {}
+    with open(checkpoint, 'a') as fcheckpoint, open(report, 'a') as freport:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            # Remaining files in each directory
+            remaining = {}
+            futures = set()
+
+            def handle(future):
+                fpath, status, message = future.result()
+                counts[status] = counts.get(status, 0) + 1
+                if status == 'ok':
                     logging.info("SKIPPING: " + fpath)
-    
+                else:
+                    if status == 'error':
+                        logging.error("%s: %s" % (fpath, message))
+                    else:
+                        logging.info("%s: %s" % (status.upper(), fpath))
+                    freport.write(json.dumps({"file": fpath, "status": status,
+                                              "message": message}) + "\n")
+                    freport.flush()
+
+                directory = os.path.dirname(fpath)
+                remaining[directory] -= 1
+                if remaining[directory] == 0:
+                    del remaining[directory]
+                    _checkpoint(fcheckpoint, directory)
+
+            def wait_for(limit):
+                while len(futures) > limit:
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        futures.remove(future)
+                        handle(future)
+
+            # Begin data check
+            for subdir, files in _iter_directories(directorypath, completed):
+                if not files:
+                    _checkpoint(fcheckpoint, subdir)
+                    continue
+                remaining[subdir] = len(files)
+                for fpath in files:
+                    futures.add(pool.submit(check_file, fpath, not args.report_only))
+                    wait_for(workers * FILES_IN_FLIGHT_PER_WORKER)
+            wait_for(0)
+
+    logging.info("Checked %d files: %s" % (sum(counts.values()),
+                 ", ".join("%d %s" % (n, status) for status, n in sorted(counts.items()))))
     logging.info("Exiting JP2verify")
 
+def _iter_directories(root, completed):
+    """Yields each directory under root which hasn't been checked yet, with
+    the JP2 files in it"""
+    for subdir, dirs, files in os.walk(root):
+        dirs.sort()
+        if subdir in completed:
+            continue
+        yield subdir, [os.path.join(subdir, f) for f in sorted(files)
+                       if os.path.splitext(f)[1].lower() == '.jp2']
+
+def _load_checkpoint(checkpoint):
+    """Returns the set of directories recorded as checked"""
+    if not os.path.exists(checkpoint):
+        return set()
+    with open(checkpoint) as f:
+        return set(line.rstrip('\n') for line in f if line.strip())
+
+def _checkpoint(f, directory):
+    f.write(directory + "\n")
+    f.flush()
+
+def _init_worker():
+    """Prepares a worker process to check files"""
+    global _schema
+    config.outputVerboseFlag = False
+    config.extractNullTerminatedXMLFlag = True
+    _schema = iso.Schematron(let.parse(SCHEMA_FILE), store_report=True)
+
+    # Results are logged by the main process
+    logging.getLogger('').handlers = []
+
+    # Let the main process handle Ctrl-C
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def check_file(fpath, transcode=True):
+    """Checks whether a file needs to be transcoded, and transcodes it if
+    transcode is set.
+
+    Returns (fpath, status, message) where status is one of 'ok',
+    'transcode' (needs transcoding), 'transcoded' or 'error'.
+    """
+    if 'AIA' in fpath:
+        cprecincts = [128, 128]
+    else:
+        cprecincts = None
+
+    try:
+        # Files whose codestream already has the layout transcoding
+        # gives don't need the full jpylyzer check
+        if _is_compatible(fpath, cprecincts):
+            return fpath, 'ok', None
+
+        xmlTree = let.fromstring(cet.tostring(jpylyzer.checkOneFile(fpath)))
+        if _schema.validate(xmlTree) is not False:
+            return fpath, 'ok', None
+
+        # First failed assertion, to say why the file needs transcoding
+        message = None
+        for text in _schema.validation_report.iter('{http://purl.oclc.org/dsdl/svrl}text'):
+            message = text.text.strip()
+            break
+
+        if not transcode:
+            return fpath, 'transcode', message
+        _transcode(fpath, cprecincts=cprecincts)
+        return fpath, 'transcoded', message
+    except KduTranscodeError as e:
+        return fpath, 'error', "kdu_transcode: " + e.get_message()
+    except Exception as e:
+        return fpath, 'error', repr(e)
+
+def _is_compatible(fpath, cprecincts):
+    """Returns True if the codestream header shows that a file doesn't need
+    transcoding"""
+    try:
+        return not needs_transcode(read_codestream_info(fpath), cprecincts)
+    except (ValueError, IOError):
+        return False
+
 def get_args():
     parser = argparse.ArgumentParser(description='Retrieves JPEG 2000 images.', add_help=False)
     parser.add_argument('-h', '--help', help='Show this help message and exit', action='store_true')
     parser.add_argument('-d', '--directory', metavar='directory', dest='directory', help='Directory path to check')
     parser.add_argument('-l', '--log-path', metavar='log', dest='log', help='Filepath to use for logging events. Defaults to HVPull working directory.')
+    parser.add_argument('-w', '--workers', metavar='workers', dest='workers', type=int, help='Number of files to check at once. Defaults to the number of CPUs.')
+    parser.add_argument('-c', '--checkpoint', metavar='checkpoint', dest='checkpoint', default='jp2check.checkpoint', help='File listing the directories already checked. A run which is stopped resumes from it.')
+    parser.add_argument('-r', '--report', metavar='report', dest='report', default='jp2check.jsonl', help='File that each file needing a transcode, transcoded or failing is reported to, as one JSON object per line.')
+    parser.add_argument('-n', '--report-only', dest='report_only', action='store_true', help='Only report the files which need transcoding, without transcoding them.')
 
     # Parse arguments
     args = parser.parse_args()
@@ -106,6 +235,10 @@ Example Usage:
 
 jp2verify.py -d /path/to/folder -l /path/to/logfile.log
 
+Check without transcoding, using 8 processes:
+
+jp2verify.py -d /path/to/folder -w 8 -n -r needs_transcode.jsonl
+
 ''') 
 
 def init_logger(filepath):
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""
+Directory listing parser benchmark
+
+Compares the time HVPull's URLLister takes to pull the JP2 links out of a
+large Apache directory index against the HTMLParser-based lister it
+replaced.
+
+A recorded listing can be passed on the command-line, e.g.
+
+    curl -o listing.html https://helioviewer.org/jp2/AIA/2011/10/19/171/
+    python listing_benchmark.py listing.html
+
+Otherwise a listing is generated with one entry every 12 seconds for a
+day, the same as an AIA day directory.
+"""
+import os
+import io
+import sys
+import timeit
+import datetime
+from email.message import Message
+from html.parser import HTMLParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "..", "install"))
+from helioviewer.hvpull.browser.httpbrowser import URLLister
+
+RUNS = 20
+
+class HTMLParserLister(HTMLParser):
+    """The HTMLParser-based URLLister, reading from an open response"""
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.urls = []
+
+    def parse(self, usock):
+        self.feed(usock.read().decode(usock.headers.get_content_charset()))
+        return [url for url in self.urls if url.endswith(".jp2")]
+
+    def handle_starttag(self, tag, attrs):
+        href = [v for k, v in attrs if k == 'href']
+        if href:
+            self.urls.extend(href)
+
+class RecordedResponse(io.BytesIO):
+    """A listing read from memory, as if from the server"""
+    def __init__(self, body):
+        io.BytesIO.__init__(self, body)
+        self.headers = Message()
+        self.headers["Content-Type"] = "text/html; charset=utf-8"
+
+def generate_listing():
+    """Generates an Apache index of a day of AIA 171 images"""
+    rows = []
+    date = datetime.datetime(2011, 10, 19)
+    for i in range(7200):
+        name = date.strftime("%Y_%m_%d__%H_%M_%S_34__SDO_AIA_AIA_171.jp2")
+        rows.append('<tr><td valign="top"><img src="/icons/image2.gif" alt="[IMG]"></td>'
+                    '<td><a href="%s">%s</a></td><td align="right">%s  </td>'
+                    '<td align="right">1.2M</td></tr>' % (name, name, date.strftime("%Y-%m-%d %H:%M")))
+        date += datetime.timedelta(seconds=12)
+    return ('<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 3.2 Final//EN"><html><head>'
+            '<title>Index of /jp2/AIA/2011/10/19/171</title></head><body><table>'
+            '<tr><th><a href="?C=N;O=D">Name</a></th></tr>'
+            '<tr><td><a href="/jp2/AIA/2011/10/19/">Parent Directory</a></td></tr>' +
+            "\n".join(rows) + '</table></body></html>').encode("utf-8")
+
+def main(argv):
+    if len(argv) > 1:
+        with open(argv[1], "rb") as f:
+            body = f.read()
+    else:
+        body = generate_listing()
+
+    parsers = [("HTMLParser", lambda: HTMLParserLister().parse(RecordedResponse(body))),
+               ("URLLister", lambda: URLLister("jp2").parse(RecordedResponse(body)))]
+
+    expected = parsers[0][1]()
+    print("Listing: %d bytes, %d JP2 files\n" % (len(body), len(expected)))
+
+    for name, parse in parsers:
+        assert parse() == expected, "%s found different files" % name
+        times = timeit.repeat(parse, number=1, repeat=RUNS)
+        print("%-10s best: %0.2fms  mean: %0.2fms" %
+              (name, min(times) * 1000, sum(times) / len(times) * 1000))
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+"""
+HVPull URL dedupe and load balancing benchmark
+
+Times ImageRetrievalDaemon._dedupe_urls and _balance_load on synthetic
+listings from several mirrors of the same data, e.g. soho,hv_soho. Each
+server lists a day's worth of AIA-like filenames per wavelength, with most
+files present on every server.
+
+The list-searching implementations they replaced are quadratic, so they are
+only timed up to --max-quadratic files.
+
+    python url_balance_benchmark.py --servers 2 --sizes 10000 100000 1000000
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "..", "install"))
+from helioviewer.hvpull.net.daemon import ImageRetrievalDaemon
+from helioviewer.hvpull.servers import DataServer
+
+WAVELENGTHS = [94, 131, 171, 193, 211, 304, 335, 1600, 1700]
+
+def generate_urls(n, servers, overlap, seed=0):
+    """Returns one list of n URLs for each server. Each file is listed by
+    a server with probability overlap, and at least one server lists it."""
+    rng = random.Random(seed)
+    date = datetime.datetime(2011, 10, 19)
+    urls = [[] for i in range(servers)]
+    for i in range(n):
+        t = date + datetime.timedelta(seconds=12 * (i // len(WAVELENGTHS)))
+        name = t.strftime("%Y_%m_%d__%H_%M_%S_34__SDO_AIA_AIA_") + "%d.jp2" % WAVELENGTHS[i % len(WAVELENGTHS)]
+        listed = [s for s in range(servers) if rng.random() < overlap] or [rng.randrange(servers)]
+        for s in listed:
+            urls[s].append("http://server%d.example.com/jp2/%s" % (s, name))
+    return urls
+
+def quadratic_dedupe(urls):
+    known_files = []
+    final_urls = []
+    for url in urls:
+        fname = os.path.basename(url)
+        if fname not in known_files:
+            known_files.append(fname)
+            final_urls.append(url)
+    return final_urls
+
+def quadratic_balance_load(urls, m):
+    files = [[os.path.basename(url) for url in x] for x in urls]
+    n = sum(len(x) for x in files)
+    counters = [0] * m
+    for i in range(n):
+        idx = i % m
+        if len(files[idx]) > counters[idx]:
+            value = files[idx][counters[idx]]
+            while value is None:
+                counters[idx] += 1
+                if len(files[idx]) > counters[idx]:
+                    value = files[idx][counters[idx]]
+                else:
+                    break
+            if value is None:
+                continue
+            for k, file_list in enumerate(files):
+                if k != idx and value in file_list:
+                    j = file_list.index(value)
+                    files[k][j] = None
+                    urls[k][j] = None
+        counters[idx] += 1
+    return [[x for x in url_list if x is not None] for url_list in urls]
+
+def timed(func, *args):
+    t1 = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - t1
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--servers", type=int, default=2, help="Number of mirrors")
+    parser.add_argument("--overlap", type=float, default=0.9,
+                        help="Chance that each mirror lists a given file")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000],
+                        help="Number of distinct files to generate")
+    parser.add_argument("--max-quadratic", type=int, default=20000,
+                        help="Largest size to time the old implementations at")
+    args = parser.parse_args()
+
+    daemon = ImageRetrievalDaemon.__new__(ImageRetrievalDaemon)
+    daemon.servers = [DataServer("http://server%d.example.com" % i, "TEST%d" % i)
+                      for i in range(args.servers)]
+
+    for n in args.sizes:
+        urls = generate_urls(n, args.servers, args.overlap)
+        total = sum(len(x) for x in urls)
+        print("[n=%d, %d URLs over %d servers]" % (n, total, args.servers))
+
+        deduped, t = timed(lambda: [daemon._dedupe_urls(x) for x in urls])
+        print(" _dedupe_urls : %8.3fs" % t)
+        balanced, t = timed(daemon._balance_load, [list(x) for x in deduped])
+        print(" _balance_load: %8.3fs" % t)
+
+        if n <= args.max_quadratic:
+            expected, t = timed(lambda: [quadratic_dedupe(x) for x in urls])
+            assert expected == deduped
+            print(" old dedupe   : %8.3fs" % t)
+            expected, t = timed(quadratic_balance_load, [list(x) for x in deduped], args.servers)
+            assert expected == balanced
+            print(" old balance  : %8.3fs" % t)
+        print("")
+
+if __name__ == "__main__":
+    main()